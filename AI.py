@@ -1,5 +1,4 @@
 import os
-import requests
 import threading
 import json
 from dotenv import load_dotenv, set_key
@@ -104,6 +103,8 @@ class AIChat:
 
         def fetch():
             try:
+                # requests 导入较慢，在第一次发送消息时（后台线程中）才导入
+                import requests
                 response = requests.post(
                     self.api_url,
                     headers={"Authorization": f"Bearer {self.api_key}"},
@@ -3,10 +3,11 @@
 
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
+from PIL import Image
 import os
 import re
 import shutil
+import photo_cache
 
 # 使用说明文件路径与图片存放目录
 USAGE_FILE = "usage.txt"
@@ -41,8 +42,8 @@ class UsageEditor:
         # 设置隐藏图片路径的样式
         self.text.tag_configure("hidden", foreground="#f0f0f0")  # 文字颜色设为白色（隐藏）
 
-        # 保存对图片对象的引用，防止垃圾回收
-        self.image_refs = []
+        # 图片由 photo_cache 持有；跟踪本组件，图片被删除后释放引用
+        photo_cache.track_widget(self.text)
 
         # 加载使用说明
         self.load_usage()
@@ -58,7 +59,7 @@ class UsageEditor:
 
         self.text.config(state="normal")
         self.text.delete("1.0", tk.END)
-        self.image_refs.clear()
+        photo_cache.get_cache().sync_widget(self.text)
 
         base_dir = os.path.dirname(os.path.abspath(__file__))
         pattern = r"\[\[IMG:(.*?)\]\]"
@@ -114,17 +115,13 @@ class UsageEditor:
             return
 
         try:
-            image = Image.open(img_path)
-            max_width = 300
-            if image.width > max_width:
-                ratio = max_width / image.width
-                new_size = (max_width, int(image.height * ratio))
-                image = image.resize(new_size, Image.LANCZOS)
-
-            photo = ImageTk.PhotoImage(image)
+            # 宽度超过 300 时按比例缩小；同一张图片只解码一次，由进程内共享缓存持有
+            cache = photo_cache.get_cache()
+            photo = cache.load(img_path, (300, 100000), Image.LANCZOS)
 
             # 插入图片，去掉额外的换行
             self.text.image_create(tk.END, image=photo)  # 插入图片
+            cache.acquire(self.text, photo)
 
             # 插入隐藏文本标记（在同一行），避免额外换行
             start_idx = self.text.index(tk.END)  # 记录插入前的位置
@@ -134,7 +131,6 @@ class UsageEditor:
             # 让 `[[IMG:xxx]]` 变成白色（隐藏），并放在同一行
             self.text.tag_add("hidden", start_idx, end_idx)
 
-            self.image_refs.append(photo)  # 保持图片引用，防止垃圾回收
         except Exception as e:
             self.text.insert(tk.END, f"[图片加载失败: {img_marker}]\n")
 
@@ -1,23 +1,44 @@
+# 最先导入 AI：它会加载 .env，下面的模块在导入时就会读取其中的配置
+from AI import AIChat, load_config, save_config  # 引入 AI 模块及配置函数
 import tkinter as tk
 from text_shortcuts import TextShortcuts
 from note_manager import NoteManager
 from image_handler import ImageHandler
 from window_controls import WindowControls
+from autosave import AutoSaver
+import rich_text
+import window_stats
+import change_feed
 from ToolTip import ToolTip  # 悬浮提示
-from AI import AIChat, load_config, save_config  # 引入 AI 模块及配置函数
 import time
 import multiprocessing
 import re
-import json
 import os  # 用于文件操作
 
 global_command_queue = None
 IMAGE_FOLDER = "sticky_notes_images"
 
-def launch_sticky_note(note_id=None, command_queue=None, x=None, y=None):
+def launch_sticky_note(note_id=None, command_queue=None, x=None, y=None, requested_at=None, master=None,
+                       window_state=None, events=None):
     global global_command_queue
     global_command_queue = command_queue
-    note = StickyNote(note_id=note_id, x=x, y=y)  # 使用传递的坐标初始化
+    # 本进程的保存/重命名/删除经主进程广播给其他便笺进程；events 为接收广播的管道
+    change_feed.set_publisher(command_queue)
+    note = StickyNote(note_id=note_id, master=master, x=x, y=y)  # 使用传递的坐标初始化
+    if events is not None:
+        change_feed.listen(events, note.root)
+    if window_state:
+        # 恢复上次会话中的窗口大小和置顶状态
+        note.apply_window_state(window_state.get("geometry"), window_state.get("pinned"))
+    if master is not None:
+        # 预热进程中便笺是隐藏根窗口的 Toplevel，便笺关闭后结束事件循环（进程随之退出）
+        note.root.bind("<Destroy>", lambda e: master.quit() if e.widget is note.root else None, add="+")
+    if command_queue is not None and requested_at is not None:
+        # 窗口第一次显示时向主进程报告打开延迟和本进程内存
+        def report():
+            command_queue.put(("window_opened", str(note.note_id),
+                               (time.time() - requested_at) * 1000, window_stats.current_rss_kb()))
+        window_stats.on_first_map(note.root, report)
     note.root.mainloop()
 
 def create_new_sticky_note():
@@ -26,7 +47,7 @@ def create_new_sticky_note():
 
 
 class StickyNote:
-    def __init__(self, note_id=None, master=None, x=None, y=None):
+    def __init__(self, note_id=None, master=None, x=None, y=None, ai_chat=None):
         if master is None:
             self.root = tk.Tk()
         else:
@@ -103,7 +124,10 @@ class StickyNote:
         self.text_widget.tag_configure("strikethrough", font=("微软雅黑", 11, "overstrike"), foreground=self.text_fg)
         self.shortcut_manager = TextShortcuts(self.text_widget, image_handler=self.image_handler)
         self.note_manager.load_note()
-        self.notes_menu = None
+        # 自动保存需在加载完内容之后启动，避免把加载本身当成修改
+        self.autosaver = AutoSaver(self)
+        self.notes_browser = None
+        self.revision_browser = None
         # AI 聊天区域（默认隐藏）
         self.ai_frame = tk.Frame(self.content_frame, bg=self.text_bg)
         self.ai_chat_display = tk.Text(self.ai_frame, wrap="word", height=10,
@@ -121,7 +145,8 @@ class StickyNote:
         self.ai_send_button = tk.Button(self.ai_input_frame, text="发送",
                                         command=self.send_message, bg=self.header_bg, fg="white")
         self.ai_send_button.pack(side=tk.RIGHT)
-        self.ai_chat = AIChat()
+        # 单进程多窗口模式下所有便笺共用一个 AI 客户端
+        self.ai_chat = ai_chat or AIChat()
         # 底部工具栏
         self.toolbar = tk.Frame(self.root, bg=self.header_bg, height=30)
         self.toolbar.grid(row=2, column=0, sticky="ew")
@@ -159,6 +184,9 @@ class StickyNote:
         self.root.lift()
         self.root.attributes("-topmost", True)
         self.root.after(100, self._ensure_topmost_state)
+        # 窗口移动/缩放后（防抖）把位置报告给主进程，用于下次启动时恢复
+        self._window_state_after = None
+        self.root.bind("<Configure>", self._on_root_configure, add="+")
 
     def show_separator_menu(self):
         menu = tk.Menu(self.root, tearoff=0, bg=self.header_bg, fg="white", font=("Segoe UI", 10))
@@ -236,9 +264,39 @@ class StickyNote:
         self.ai_chat_display.see(tk.END)
 
     def hide_window(self):
-        self.note_manager.save_note()
+        self.autosaver.flush()
+        self.report_window_closed()
         self.root.destroy()
 
+    def _on_root_configure(self, event):
+        if event.widget is not self.root:
+            return
+        if self._window_state_after is not None:
+            self.root.after_cancel(self._window_state_after)
+        self._window_state_after = self.root.after(500, self.report_window_state)
+
+    def report_window_state(self):
+        """把窗口位置大小和置顶状态报告给主进程（窗口会话）"""
+        self._window_state_after = None
+        if global_command_queue is not None:
+            global_command_queue.put(("window_state", str(self.note_id), self.root.geometry(), self.is_pinned))
+
+    def report_window_closed(self):
+        """用户关闭（或删除）了便笺，下次启动时不再恢复它"""
+        if self._window_state_after is not None:
+            self.root.after_cancel(self._window_state_after)
+            self._window_state_after = None
+        if global_command_queue is not None:
+            global_command_queue.put(("window_closed", str(self.note_id)))
+
+    def apply_window_state(self, geometry=None, pinned=None):
+        """恢复会话中记录的窗口大小位置与置顶状态"""
+        if geometry:
+            self.root.geometry(geometry)
+        if pinned is not None and bool(pinned) != self.is_pinned:
+            self.is_pinned = bool(pinned)
+            self._refresh_header_buttons()
+
     def _ensure_topmost_state(self):
         if not self.is_pinned:
             self.root.attributes("-topmost", False)
@@ -277,69 +335,27 @@ class StickyNote:
         self.root.withdraw()
 
     def show_saved_notes_menu(self, event=None):
-        from note_manager import NoteManager, SAVE_FILE
-        import tkinter.simpledialog as simpledialog
-        from tkinter import messagebox
-        data = NoteManager.load_notes_list()
-        if hasattr(self, "notes_menu") and self.notes_menu:
-            self.notes_menu.destroy()
-        self.notes_menu = tk.Menu(self.root, tearoff=0,
-                                  bg="#3E3E3E", fg="#FFFFFF",
-                                  activebackground="#FFCC00", activeforeground="black")
-        if not data:
-            self.notes_menu.add_command(label="暂无便笺", state="disabled")
+        """打开（或前置）已保存便笺浏览窗口；列表只读取元数据，并且只为可见的行创建控件"""
+        from notes_browser import NotesBrowser
+        if self.notes_browser is not None and self.notes_browser.window.winfo_exists():
+            self.notes_browser.refresh()
+            self.notes_browser.window.deiconify()
+            self.notes_browser.window.lift()
+            return
+        self.notes_browser = NotesBrowser(self)
+
+    def open_note_nearby(self, note_id):
+        """在当前窗口右下方 30 像素处打开指定便笺"""
+        global global_command_queue
+        geo_str = self.root.geometry()
+        match = re.search(r"(\d+)x(\d+)\+(\d+)\+(\d+)", geo_str)
+        if match:
+            old_x = int(match.group(3))
+            old_y = int(match.group(4))
         else:
-            for note_id in sorted(data.keys()):
-                note_info = data[note_id]
-                display_label = note_info.get("name", note_id)
-                sub_menu = tk.Menu(self.root, tearoff=0,
-                                   bg="#3E3E3E", fg="#FFFFFF",
-                                   activebackground="#FFCC00", activeforeground="black")
-
-                def open_note(nid=note_id):
-                    import re
-                    geo_str2 = self.root.geometry()
-                    m2 = re.search(r"(\d+)x(\d+)\+(\d+)\+(\d+)", geo_str2)
-                    if m2:
-                        w2 = int(m2.group(1))
-                        h2 = int(m2.group(2))
-                        ox2 = int(m2.group(3))
-                        oy2 = int(m2.group(4))
-                    else:
-                        ox2, oy2 = 100, 100
-                        w2 = 300
-                    new_x2 = ox2 + 30
-                    new_y2 = oy2 + 30
-                    global global_command_queue
-                    if global_command_queue:
-                        global_command_queue.put(("open_with_xy", nid, new_x2, new_y2))
-
-                def rename_note(nid=note_id):
-                    current_name = data[note_id].get("name", note_id)
-                    new_name = simpledialog.askstring("重命名", "请输入新的便笺名称：",
-                                                      parent=self.root, initialvalue=current_name)
-                    if new_name:
-                        data[note_id]["name"] = new_name
-                        with open(SAVE_FILE, "w", encoding="utf-8") as f:
-                            json.dump(data, f, indent=4, ensure_ascii=False)
-                        self.show_saved_notes_menu()
-
-                def delete_note(nid=note_id):
-                    from tkinter import messagebox
-                    if messagebox.askyesno("删除便笺", "确定删除此便笺吗？", parent=self.root):
-                        if note_id in data:
-                            del data[note_id]
-                            with open(SAVE_FILE, "w", encoding="utf-8") as f:
-                                json.dump(data, f, indent=4, ensure_ascii=False)
-                        self.show_saved_notes_menu()
-
-                sub_menu.add_command(label="打开", command=open_note)
-                sub_menu.add_command(label="重命名", command=rename_note)
-                sub_menu.add_command(label="删除", command=delete_note)
-                self.notes_menu.add_cascade(label=display_label, menu=sub_menu)
-        bx = self.list_btn.winfo_rootx()
-        by = self.list_btn.winfo_rooty() + self.list_btn.winfo_height()
-        self.notes_menu.tk_popup(bx, by)
+            old_x, old_y = 100, 100
+        if global_command_queue:
+            global_command_queue.put(("open_with_xy", note_id, old_x + 30, old_y + 30))
 
     def _has_tag_in_range(self, tag_name, start, end):
         ranges = self.text_widget.tag_ranges(tag_name)
@@ -352,12 +368,23 @@ class StickyNote:
         return False
 
     def show_context_menu(self, event):
-        """右键弹出菜单，包含 AI 设置和使用说明两个选项"""
+        """右键弹出菜单，包含 AI 设置、历史版本和使用说明"""
         menu = tk.Menu(self.root, tearoff=0)
         menu.add_command(label="AI 设置", command=self.open_ai_settings)
+        menu.add_command(label="历史版本", command=self.show_revisions)
         menu.add_command(label="使用说明", command=self.show_usage)
         menu.tk_popup(event.x_root, event.y_root)
 
+    def show_revisions(self):
+        """打开（或前置）当前便笺的历史版本窗口；先保存未写盘的修改，使最新内容也出现在列表中"""
+        from revision_browser import RevisionBrowser
+        self.autosaver.flush()
+        if self.revision_browser is not None and self.revision_browser.window.winfo_exists():
+            self.revision_browser.refresh()
+            self.revision_browser.window.lift()
+            return
+        self.revision_browser = RevisionBrowser(self)
+
     # 新增：显示使用说明窗口
     def show_usage(self):
         """
@@ -406,7 +433,10 @@ class StickyNote:
 
         usage_text.config(state="normal")
         usage_text.delete("1.0", tk.END)
-        usage_text.image_refs = []  # 保存图片引用
+        # 图片由进程内共享缓存持有，再次打开使用说明时不再重复解码和缩放
+        import photo_cache
+        cache = photo_cache.get_cache()
+        photo_cache.track_widget(usage_text)
 
         base_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -426,17 +456,12 @@ class StickyNote:
                     usage_text.insert(tk.END, f"[图片加载失败: {img_marker}]\n")
                     continue
                 try:
-                    from PIL import Image, ImageTk
-                    image = Image.open(img_path)
-                    max_width = 300
-                    if image.width > max_width:
-                        ratio = max_width / image.width
-                        new_size = (max_width, int(image.height * ratio))
-                        image = image.resize(new_size, Image.LANCZOS)
-                    photo = ImageTk.PhotoImage(image)
+                    from PIL import Image
+                    # 宽度超过 300 时按比例缩小，高度不限
+                    photo = cache.load(img_path, (300, 100000), Image.LANCZOS)
                     usage_text.image_create(tk.END, image=photo)
                     usage_text.insert(tk.END, "\n")
-                    usage_text.image_refs.append(photo)
+                    cache.acquire(usage_text, photo)
                 except Exception as e:
                     usage_text.insert(tk.END, f"[图片加载失败: {img_marker}]\n")
         usage_text.config(state="disabled")
@@ -670,6 +695,7 @@ class StickyNote:
             self.text_widget.tag_add("bold_italic", start, end)
         else:
             self.text_widget.tag_add("bold", start, end)
+        self.autosaver.mark_dirty()
 
     def toggle_italic(self):
         try:
@@ -692,6 +718,7 @@ class StickyNote:
             self.text_widget.tag_add("bold_italic", start, end)
         else:
             self.text_widget.tag_add("italic", start, end)
+        self.autosaver.mark_dirty()
 
     # 新增：下划线切换功能
     def toggle_underline(self):
@@ -704,6 +731,7 @@ class StickyNote:
             self.text_widget.tag_remove("underline", start, end)
         else:
             self.text_widget.tag_add("underline", start, end)
+        self.autosaver.mark_dirty()
 
     # 新增：删除线切换功能
     def toggle_strikethrough(self):
@@ -716,6 +744,7 @@ class StickyNote:
             self.text_widget.tag_remove("strikethrough", start, end)
         else:
             self.text_widget.tag_add("strikethrough", start, end)
+        self.autosaver.mark_dirty()
 
     # 新增：切换项目符号功能
     def toggle_bullets(self):
@@ -745,17 +774,19 @@ class StickyNote:
         self.text_widget.delete(start, end)
         self.text_widget.insert(start, new_text)
 
-    def load_content(self, content):
+    def load_content(self, content, tag_ranges=None):
+        """
+        插入保存的文本；tag_ranges 为 rich_text.decode_tag_info 的结果，随文本一起批量插入。
+        图片先以同尺寸的占位图显示，窗口无需等待图片解码即可使用。
+        """
+        self.image_handler.cancel_pending()
         self.text_widget.delete("1.0", tk.END)
-        pattern = r"\[\[IMG:(.*?)\]\]"
-        parts = re.split(pattern, content)
-        for i, part in enumerate(parts):
-            if i % 2 == 0:
-                self.text_widget.insert(tk.END, part)
-            else:
-                try:
-                    from PIL import Image
-                    image = Image.open(part)
-                    self.image_handler.insert_pil_image(image, part, add_newline=False)
-                except Exception:
-                    self.text_widget.insert(tk.END, f"[图片加载失败:{part}]")
+        rich_text.insert_rich_text(self.text_widget, content, tag_ranges or {}, self._insert_saved_image)
+
+    def _insert_saved_image(self, path):
+        try:
+            # 先插入占位图，图片在后台线程中解码（优先使用缩略图缓存），完成后再替换
+            self.image_handler.insert_saved_image(path)
+        except Exception:
+            # 保留原始标记（可见），这样文本偏移不变，下次保存也不会丢失图片引用
+            self.text_widget.insert("insert", f"[[IMG:{path}]]")
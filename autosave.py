@@ -0,0 +1,110 @@
+import os
+import queue
+import threading
+import time
+
+# 停止输入多久后保存（毫秒），可在 .env 中通过 AUTOSAVE_DELAY_MS 配置
+AUTOSAVE_DELAY_MS = int(os.getenv("AUTOSAVE_DELAY_MS", "1500"))
+# 持续输入时，距第一次未保存的修改最长多久必须保存一次（毫秒）
+AUTOSAVE_MAX_DELAY_MS = int(os.getenv("AUTOSAVE_MAX_DELAY_MS", "10000"))
+
+
+class AutoSaver:
+    """
+    便笺的自动保存引擎：
+    - 通过 Text 组件的 <<Modified>> 事件跟踪是否有未保存的修改；
+    - 一段时间内的连续修改合并为一次保存（防抖），持续输入时也保证最长间隔内保存一次；
+    - 在 UI 线程中采集快照（只读组件），写盘与图片引用更新在后台工作线程中完成；
+    - 关闭窗口时 flush() 会同步等待最后一次写入完成。
+    """
+    def __init__(self, app, delay_ms=AUTOSAVE_DELAY_MS, max_delay_ms=AUTOSAVE_MAX_DELAY_MS):
+        self.app = app
+        self.delay_ms = delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.dirty = False
+        self.saves = 0
+        self._first_dirty = None
+        self._after_id = None
+        self._cancelled = False
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+        self.app.text_widget.edit_modified(False)
+        self.app.text_widget.bind("<<Modified>>", self._on_modified, add="+")
+
+    # ------------------ UI 线程 ------------------
+    def _on_modified(self, event=None):
+        widget = self.app.text_widget
+        if not widget.edit_modified():
+            # 重置标记本身也会触发 <<Modified>>，忽略即可
+            return
+        widget.edit_modified(False)
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        """
+        标记有未保存的修改并（重新）安排保存。
+        标签、颜色、置顶等不会触发 <<Modified>> 的修改也应调用此方法。
+        """
+        if self._cancelled:
+            return
+        now = time.monotonic()
+        if not self.dirty:
+            self.dirty = True
+            self._first_dirty = now
+        if self._after_id is not None:
+            self.app.root.after_cancel(self._after_id)
+            self._after_id = None
+        waited_ms = (now - self._first_dirty) * 1000
+        delay = min(self.delay_ms, max(0, int(self.max_delay_ms - waited_ms)))
+        self._after_id = self.app.root.after(delay, self._save_now)
+
+    def _save_now(self):
+        self._after_id = None
+        if not self.dirty or self._cancelled:
+            return
+        self.dirty = False
+        self._first_dirty = None
+        snapshot = self.app.note_manager.snapshot()
+        if snapshot is not None:
+            self._queue.put(snapshot)
+
+    def flush(self):
+        """立即保存尚未写盘的修改，并等待工作线程写完（退出前调用）"""
+        if self._after_id is not None:
+            self.app.root.after_cancel(self._after_id)
+            self._after_id = None
+        if not self._cancelled:
+            self.dirty = True
+            self._save_now()
+        self._queue.join()
+
+    def cancel(self):
+        """放弃所有尚未写盘的修改（例如便笺被删除时），并等待正在进行的写入结束"""
+        self._cancelled = True
+        if self._after_id is not None:
+            self.app.root.after_cancel(self._after_id)
+            self._after_id = None
+        self.dirty = False
+        self._queue.join()
+
+    # ------------------ 工作线程 ------------------
+    def _run(self):
+        while True:
+            snapshot = self._queue.get()
+            # 合并积压的快照，只写最新的一份
+            while True:
+                try:
+                    newer = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._queue.task_done()
+                snapshot = newer
+            try:
+                if not self._cancelled:
+                    self.app.note_manager.write_snapshot(snapshot)
+                    self.saves += 1
+            except Exception as e:
+                print(f"自动保存失败：{e}")
+            finally:
+                self._queue.task_done()
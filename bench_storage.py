@@ -0,0 +1,371 @@
+"""
+存储性能基准（无需图形界面）：
+
+    python bench_storage.py                          # 默认 10/100/1000/10000 个便笺，当前 NOTE_STORAGE 后端
+    python bench_storage.py --sizes 10,100000 --backends sharded,sqlite,journal
+    python bench_storage.py --output before.json     # 保存机器可读的结果
+    python bench_storage.py --compare before.json    # 与另一次提交的结果对比（按 p50）
+
+每个 (后端, 便笺数) 组合在独立的子进程和临时目录中运行：先生成确定性的合成语料
+（中英混排、密集的 tag_info、大量 [[IMG:...]] 引用，写成旧版 sticky_notes.json 后走正常迁移），
+再对 NoteManager 的各项操作计时，报告分位数和 tracemalloc 峰值内存。
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DEFAULT_SIZES = "10,100,1000,10000"
+IMAGE_FOLDER = "sticky_notes_images"
+# 常用汉字与英文单词，用于拼出中英混排的正文
+CJK_CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理府研"
+ASCII_WORDS = ("meeting todo review deploy fix bug release draft plan idea note budget schedule "
+               "python tkinter sqlite cache index memory latency update report sync backup").split()
+EMOJI = ("😀", "📌", "✅", "🔥")
+RICH_TAGS = ("bold", "italic", "bold_italic", "underline", "strikethrough")
+
+
+# ------------------ 合成语料 ------------------
+def make_text(rng, images):
+    """生成一段中英混排、偶尔带 emoji 和图片标记的正文"""
+    parts = []
+    length = int(min(20000, rng.lognormvariate(6.5, 0.8)))
+    size = 0
+    while size < length:
+        roll = rng.random()
+        if roll < 0.45:
+            piece = "".join(rng.choice(CJK_CHARS) for _ in range(rng.randint(4, 30))) + "。"
+        elif roll < 0.85:
+            piece = " ".join(rng.choice(ASCII_WORDS) for _ in range(rng.randint(2, 12))) + ". "
+        elif roll < 0.9:
+            piece = rng.choice(EMOJI)
+        elif roll < 0.96 or not images:
+            piece = "\n"
+        else:
+            piece = f"[[IMG:{IMAGE_FOLDER}/{rng.choice(images)}]]"
+        parts.append(piece)
+        size += len(piece)
+    return "".join(parts)
+
+
+def make_tag_ranges(rng, length):
+    """每种格式标签生成一批互不重叠的区间，密度约为每 40 个字符一个"""
+    ranges = {}
+    for tag in RICH_TAGS:
+        spans = []
+        pos = rng.randint(0, 40)
+        while pos < length:
+            end = min(length, pos + rng.randint(1, 25))
+            spans.append((pos, end))
+            pos = end + rng.randint(20, 200)
+        ranges[tag] = spans
+    return ranges
+
+
+def make_corpus(count, seed):
+    """返回 (notes, referenced_images, orphan_images)；同样的参数总是生成同样的语料"""
+    import rich_text
+    rng = random.Random(seed)
+    images = [f"{i:06d}.png" for i in range(max(4, count // 2))]
+    notes = {}
+    base_ts = 1700000000
+    for i in range(count):
+        note_id = str(base_ts + i)
+        text = make_text(rng, images)
+        tag_ranges = make_tag_ranges(rng, len(text))
+        note = {
+            "text": text,
+            "header_bg": "#FFD700",
+            "is_pinned": rng.random() < 0.1,
+            "text_bg": "#FFFFE0",
+            "text_fg": "#000000",
+            "tag_info": {tag: rich_text.encode_ranges(r) for tag, r in tag_ranges.items()},
+            "tag_format": rich_text.TAG_FORMAT,
+        }
+        if rng.random() < 0.3:
+            note["name"] = " ".join(rng.choice(ASCII_WORDS) for _ in range(2))
+        notes[note_id] = note
+    orphans = [f"orphan_{i:06d}.png" for i in range(max(2, count // 10))]
+    return notes, images, orphans
+
+
+def write_images(names, old=False):
+    """写入占位图片文件；old=True 时把修改时间调到很久以前，使其超出清理宽限期"""
+    os.makedirs(IMAGE_FOLDER, exist_ok=True)
+    stamp = time.time() - 30 * 24 * 3600
+    for name in names:
+        path = os.path.join(IMAGE_FOLDER, name)
+        with open(path, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n" + name.encode())
+        if old:
+            os.utime(path, (stamp, stamp))
+
+
+# ------------------ 无界面替身 ------------------
+class StubTextWidget:
+    """只实现 rich_text.serialize 需要的 Text.dump，按 Tk 的事件顺序产出 text/tagon/tagoff"""
+    def __init__(self, text, tag_ranges):
+        events = {}
+        for tag, spans in tag_ranges.items():
+            for s, e in spans:
+                events.setdefault(s, []).append(("tagon", tag))
+                events.setdefault(e, []).append(("tagoff", tag))
+        points = sorted(set(events) | {0, len(text)})
+        dump = []
+        for a, b in zip(points, points[1:] + [None]):
+            for kind, tag in sorted(events.get(a, ()), key=lambda item: item[0] != "tagoff"):
+                dump.append((kind, tag, f"1.{a}"))
+            if b is not None and b > a:
+                dump.append(("text", text[a:b], f"1.{a}"))
+        dump.append(("text", "\n", f"1.{len(text)}"))
+        self._dump = dump
+
+    def dump(self, index1, index2=None, **kwargs):
+        return self._dump
+
+
+class StubRoot:
+    def destroy(self):
+        pass
+
+
+class StubApp:
+    """NoteManager 只用到这些属性"""
+    def __init__(self, note_id, note):
+        import rich_text
+        self.note_id = note_id
+        self.root = StubRoot()
+        self.header_bg = note.get("header_bg", "#FFD700")
+        self.is_pinned = note.get("is_pinned", False)
+        self.text_bg = note.get("text_bg", "#FFFFE0")
+        self.text_fg = note.get("text_fg", "#000000")
+        self.text_widget = StubTextWidget(note.get("text", ""), rich_text.decode_tag_info(note))
+
+
+# ------------------ 计时与统计 ------------------
+def percentile(sorted_values, q):
+    """线性插值分位数，q 取 0~100"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+def summarize(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0], 4),
+        "p50_ms": round(percentile(ordered, 50), 4),
+        "p90_ms": round(percentile(ordered, 90), 4),
+        "p99_ms": round(percentile(ordered, 99), 4),
+        "max_ms": round(ordered[-1], 4),
+        "mean_ms": round(sum(ordered) / len(ordered), 4),
+    }
+
+
+def measure(name, func, iterations, results, prepare=None):
+    """
+    先不开 tracemalloc 计时 iterations 次，再单独跟踪一次得到峰值内存，
+    避免 tracemalloc 本身的开销混进耗时。prepare(i) 的返回值作为 func 的参数，不计入耗时。
+    """
+    samples = []
+    for i in range(iterations):
+        arg = prepare(i) if prepare else None
+        start = time.perf_counter()
+        func(arg)
+        samples.append((time.perf_counter() - start) * 1000)
+    arg = prepare(iterations) if prepare else None
+    tracemalloc.start()
+    func(arg)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = summarize(samples)
+    stats["peak_kib"] = round(peak / 1024, 1)
+    results[name] = stats
+    print(f"  {name:<24} p50 {stats['p50_ms']:>10.3f} ms   p99 {stats['p99_ms']:>10.3f} ms   "
+          f"峰值 {stats['peak_kib']:>10.1f} KiB", file=sys.stderr)
+
+
+# ------------------ 子进程：跑一个组合 ------------------
+def run_case(count, iterations, seed):
+    """在当前目录（调用方保证是一个空的临时目录）里建立语料并计时"""
+    import image_gc
+    import image_store
+    import note_manager
+    import search_index
+    from note_manager import NoteManager
+    from note_storage import LEGACY_SAVE_FILE, get_store
+
+    # 基准中没有人点确认框
+    note_manager.messagebox.askyesno = lambda *args, **kwargs: True
+
+    setup = {}
+    start = time.perf_counter()
+    notes, images, orphans = make_corpus(count, seed)
+    with open(LEGACY_SAVE_FILE, "w", encoding="utf-8") as f:
+        json.dump(notes, f, ensure_ascii=False)
+    write_images(images)
+    write_images(orphans, old=True)
+    setup["generate_s"] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    get_store()
+    setup["migrate_s"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    search_index.get_index()
+    setup["search_index_s"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    image_gc.ensure_index()
+    setup["image_refs_s"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    image_store.ensure_migrated()
+    setup["image_migration_s"] = round(time.perf_counter() - start, 3)
+
+    rng = random.Random(seed + 1)
+    ids = sorted(notes)
+    store = get_store()
+    ops = {}
+
+    def cold(func):
+        def run(_arg):
+            store.invalidate()
+            func()
+        return run
+
+    measure("load_notes_list_cold", cold(NoteManager.load_notes_list), iterations, ops)
+    measure("load_notes_list_warm", lambda _arg: NoteManager.load_notes_list(), iterations, ops)
+
+    def build_list():
+        # 与历史列表窗口相同：读取元数据并按最近修改排序
+        meta = NoteManager.list_meta()
+        return sorted(meta.items(), key=lambda item: item[1].get("updated", 0), reverse=True)
+
+    measure("list_build_cold", cold(build_list), iterations, ops)
+    measure("list_build_warm", lambda _arg: build_list(), iterations, ops)
+
+    def prepare_save(i):
+        note_id = rng.choice(ids)
+        note = dict(notes[note_id])
+        note["text"] = note["text"] + f"\nedit {i} 修改"
+        return StubApp(note_id, note)
+
+    measure("save_note", lambda app: NoteManager(app).save_note(), iterations, ops, prepare=prepare_save)
+    measure("rename_note", lambda note_id: NoteManager.rename_note(note_id, f"renamed {time.time()}"),
+            iterations, ops, prepare=lambda i: rng.choice(ids))
+
+    def prepare_delete(i):
+        note_id = ids.pop(rng.randrange(len(ids)))
+        return StubApp(note_id, notes[note_id])
+
+    delete_runs = min(iterations, max(1, len(ids) // 2 - 1))
+    measure("delete_note", lambda app: NoteManager(app).delete_note(), delete_runs, ops, prepare=prepare_delete)
+
+    sweep_runs = max(1, min(iterations, 5))
+    measure("cleanup_unused_images", lambda _arg: NoteManager.cleanup_unused_images(), sweep_runs, ops)
+
+    return {"notes": count, "setup": setup, "ops": ops}
+
+
+# ------------------ 主进程 ------------------
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def spawn_case(backend, count, iterations, seed):
+    """在新进程 + 新临时目录中运行一个组合，避免进程内缓存和单例互相影响"""
+    env = dict(os.environ, NOTE_STORAGE=backend)
+    with tempfile.TemporaryDirectory(prefix="bench_notes_") as workdir:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker",
+             "--sizes", str(count), "--iterations", str(iterations), "--seed", str(seed)],
+            cwd=workdir, env=env, stdout=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{backend}/{count} 基准失败（退出码 {proc.returncode}）")
+    result = json.loads(proc.stdout)
+    result["backend"] = backend
+    return result
+
+
+def compare(results, baseline_path):
+    """按 p50 打印与基线结果的差异"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {(r["backend"], r["notes"]): r["ops"] for r in baseline.get("results", [])}
+    print(f"\n与 {baseline_path}（{baseline.get('meta', {}).get('commit')}）对比 p50：", file=sys.stderr)
+    for result in results:
+        before = old.get((result["backend"], result["notes"]))
+        if before is None:
+            continue
+        for op, stats in result["ops"].items():
+            if op not in before or not before[op]["p50_ms"]:
+                continue
+            change = (stats["p50_ms"] - before[op]["p50_ms"]) / before[op]["p50_ms"] * 100
+            print(f"  {result['backend']:<8} {result['notes']:>7} {op:<24} "
+                  f"{before[op]['p50_ms']:>10.3f} -> {stats['p50_ms']:>10.3f} ms ({change:+.1f}%)",
+                  file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="便笺存储性能基准")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="逗号分隔的便笺数量，例如 10,1000,100000")
+    parser.add_argument("--backends", default=os.getenv("NOTE_STORAGE", "sharded"),
+                        help="逗号分隔的存储后端（sharded/sqlite/journal）")
+    parser.add_argument("--iterations", type=int, default=20, help="每项操作的计时次数")
+    parser.add_argument("--seed", type=int, default=42, help="语料生成的随机种子")
+    parser.add_argument("--output", help="把 JSON 结果写入该文件（默认输出到标准输出）")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    if args.worker:
+        # 被测代码自身的提示信息转到标准错误，标准输出只留给结果
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run_case(sizes[0], args.iterations, args.seed)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    results = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        for count in sizes:
+            print(f"[{backend}] {count} 个便笺", file=sys.stderr)
+            results.append(spawn_case(backend, count, args.iterations, args.seed))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+
+# 便笺变化的种类
+SAVED = "saved"
+RENAMED = "renamed"
+DELETED = "deleted"
+# 便笺进程读取广播管道的间隔（毫秒）
+LISTEN_POLL_MS = 50
+
+_publisher = None
+_listeners = []
+_versions = {}      # 便笺 ID -> 已处理的最新版本
+
+
+def set_publisher(command_queue):
+    """设置向主进程发送变化通知的队列（便笺进程启动时调用）"""
+    global _publisher
+    _publisher = command_queue
+
+
+def publish(note_id, kind, note=None):
+    """
+    本进程写入便笺后调用：通知主进程，由主进程分配版本号并广播给所有便笺进程。
+    保存/重命名时传入写入后的便笺，通知中附带它的元数据，其他进程据此只更新列表缓存中的这一条。
+    可在工作线程中调用（自动保存在后台线程写盘）。
+    """
+    if _publisher is None:
+        return
+    meta = None
+    if note is not None:
+        from note_storage import note_meta
+        meta = note_meta(note)
+    try:
+        _publisher.put(("note_changed", str(note_id), kind, os.getpid(), meta))
+    except Exception as e:
+        print(f"发送便笺变化通知失败：{e}")
+
+
+def subscribe(callback):
+    """注册 callback(note_id, kind, version)，在 UI 线程中调用；返回取消注册的函数"""
+    _listeners.append(callback)
+
+    def unsubscribe():
+        if callback in _listeners:
+            _listeners.remove(callback)
+    return unsubscribe
+
+
+def dispatch(event):
+    """
+    处理主进程广播的 ("note_changed", 便笺ID, 种类, 版本, 来源进程, 元数据)（UI 线程中调用）：
+    其他进程的写入只让进程内缓存中的这一条便笺失效（下次用到时再读取）、用附带的元数据更新列表缓存中的这一条，
+    再通知列表窗口等订阅者；过期的版本直接忽略。
+    搜索索引是各进程共享的 SQLite 文件，写入方已经更新，这里不需要处理。
+    """
+    _, note_id, kind, version, origin, meta = event
+    if version <= _versions.get(note_id, 0):
+        return
+    _versions[note_id] = version
+    if origin != os.getpid():
+        from note_storage import get_store
+        get_store().apply_change(note_id, kind == DELETED, meta)
+    for callback in list(_listeners):
+        try:
+            callback(note_id, kind, version)
+        except Exception as e:
+            print(f"处理便笺变化通知失败：{e}")
+
+
+def listen(conn, widget):
+    """
+    在 widget 所在的 UI 线程中用 after() 定时读取主进程通过管道广播的变化通知（不另开线程，
+    tkinter 对象只在 UI 线程中使用）。管道关闭（主进程退出，或主进程因本进程长时间不读而停止广播）
+    或 widget 被销毁时停止；此后进程内缓存仍会通过文件变化判断其他进程的写入。
+    """
+    pending = [None]
+
+    def poll():
+        pending[0] = None
+        try:
+            while conn.poll():
+                event = conn.recv()
+                try:
+                    dispatch(event)
+                except Exception as e:
+                    print(f"处理便笺变化通知失败：{e}")
+        except (EOFError, OSError):
+            conn.close()
+            return
+        pending[0] = widget.after(LISTEN_POLL_MS, poll)
+
+    def stop(event):
+        if event.widget is widget and pending[0] is not None:
+            widget.after_cancel(pending[0])
+            pending[0] = None
+
+    widget.bind("<Destroy>", stop, add="+")
+    pending[0] = widget.after(LISTEN_POLL_MS, poll)
@@ -0,0 +1,291 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from note_storage import read_json
+
+IMAGE_FOLDER = "sticky_notes_images"
+# 图片引用计数索引（SQLite，每次更新只改动变化的行）：
+#   refs(kind, note_id, name)   -- kind 为 notes（便笺正文）或 revisions（该便笺保留的历史版本）
+#   counts(name, refs)          -- 每张图片的引用方数量
+#   pending(name, since)        -- 引用数归零的时间，宽限期后由后台清理线程删除
+# 便笺的当前正文与它保留的历史版本各算一个引用方，历史版本还在时其中的图片不会被删除
+REFS_DB = "sticky_notes_image_refs.db"
+# 旧版的 JSON 索引：首次建立 SQLite 索引时沿用其中等待删除的记录，之后改名保留
+LEGACY_REFS_FILE = "sticky_notes_image_refs.json"
+# 引用数归零后至少保留多久才删除（秒），给撤销/重新粘贴留出余地
+GRACE_PERIOD = 300
+SWEEP_INTERVAL = 60
+
+IMG_PATTERN = re.compile(r"\[\[IMG:(.*?)\]\]")
+
+_local = threading.local()
+_inherited = []
+_sweeper = None
+
+
+def resolve_image_ref(marker):
+    """
+    把 [[IMG:...]] 中的路径归一化为 sticky_notes_images 下的相对名称。
+    不在图片目录里的引用（例如用户原始文件）不归垃圾回收管理，返回 None。
+    """
+    folder = os.path.abspath(IMAGE_FOLDER)
+    candidates = [os.path.abspath(marker), os.path.abspath(os.path.join(IMAGE_FOLDER, marker))]
+    for path in candidates:
+        try:
+            inside = os.path.commonpath([folder, path]) == folder and path != folder
+        except ValueError:
+            # Windows 下不同盘符的路径无法比较
+            inside = False
+        if inside:
+            return os.path.relpath(path, folder).replace(os.sep, "/")
+    return None
+
+
+def extract_refs(text):
+    refs = set()
+    for marker in IMG_PATTERN.findall(text or ""):
+        name = resolve_image_ref(marker)
+        if name:
+            refs.add(name)
+    return refs
+
+
+# ------------------ 索引存储 ------------------
+def _conn():
+    """每个线程一个连接（sqlite3 连接不能跨线程共享）"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(REFS_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS refs (
+                kind    TEXT NOT NULL,
+                note_id TEXT NOT NULL,
+                name    TEXT NOT NULL,
+                PRIMARY KEY (kind, note_id, name)
+            ) WITHOUT ROWID""")
+        conn.execute("CREATE TABLE IF NOT EXISTS counts (name TEXT PRIMARY KEY, refs INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS pending (name TEXT PRIMARY KEY, since REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        _local.conn = conn
+    return conn
+
+
+def _drop_inherited_connections():
+    """fork 出的子进程不能使用父进程的 SQLite 连接：丢弃（不关闭），用到时重新打开"""
+    global _local
+    _inherited.append(_local)
+    _local = threading.local()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_drop_inherited_connections)
+
+
+def _is_built(conn):
+    return conn.execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone() is not None
+
+
+def _rebuild(conn):
+    """从全部便笺及其历史版本重新计算引用（在写事务内调用；只在索引不存在或做全量整理时使用）"""
+    import revisions
+    from note_manager import NoteManager
+    owners = [("notes", note_id, extract_refs(note.get("text", "")))
+              for note_id, note in NoteManager.load_notes_list().items()]
+    owners += [("revisions", note_id, refs) for note_id, refs in revisions.image_refs().items()]
+    counts = {}
+    conn.execute("DELETE FROM refs")
+    conn.execute("DELETE FROM counts")
+    for kind, note_id, refs in owners:
+        conn.executemany("INSERT INTO refs (kind, note_id, name) VALUES (?, ?, ?)",
+                         [(kind, str(note_id), name) for name in refs])
+        for name in refs:
+            counts[name] = counts.get(name, 0) + 1
+    conn.executemany("INSERT INTO counts (name, refs) VALUES (?, ?)", counts.items())
+    conn.execute("DELETE FROM pending WHERE name IN (SELECT name FROM counts)")
+    legacy = read_json(LEGACY_REFS_FILE, default=None)
+    if isinstance(legacy, dict) and isinstance(legacy.get("pending"), dict):
+        # 旧索引中等待删除的图片继续等待（重建后仍有引用的除外）
+        conn.executemany("INSERT OR IGNORE INTO pending (name, since) VALUES (?, ?)",
+                         [(name, since) for name, since in legacy["pending"].items()
+                          if name not in counts and isinstance(since, (int, float))])
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', ?)", (str(time.time()),))
+
+
+def _write(func, *args):
+    """在写事务中执行 func(conn, *args)；索引尚未建立时先从全部便笺建立"""
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        built_now = not _is_built(conn)
+        if built_now:
+            _rebuild(conn)
+        result = func(conn, *args)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if built_now and os.path.exists(LEGACY_REFS_FILE):
+        os.replace(LEGACY_REFS_FILE, LEGACY_REFS_FILE + ".migrated")
+    return result
+
+
+def ensure_index():
+    """引用计数索引不存在时从全部便笺建立"""
+    _write(lambda conn: None)
+
+
+# ------------------ 增量更新 ------------------
+def _owner_refs(conn, kind, note_id):
+    rows = conn.execute("SELECT name FROM refs WHERE kind = ? AND note_id = ?", (kind, note_id))
+    return {row[0] for row in rows}
+
+
+def _apply_refs(conn, kind, note_id, new_refs):
+    old_refs = _owner_refs(conn, kind, note_id)
+    now = time.time()
+    for name in old_refs - new_refs:
+        conn.execute("DELETE FROM refs WHERE kind = ? AND note_id = ? AND name = ?", (kind, note_id, name))
+        conn.execute("UPDATE counts SET refs = refs - 1 WHERE name = ?", (name,))
+        row = conn.execute("SELECT refs FROM counts WHERE name = ?", (name,)).fetchone()
+        if row is None or row[0] <= 0:
+            conn.execute("DELETE FROM counts WHERE name = ?", (name,))
+            conn.execute("INSERT OR REPLACE INTO pending (name, since) VALUES (?, ?)", (name, now))
+    for name in new_refs - old_refs:
+        conn.execute("INSERT INTO refs (kind, note_id, name) VALUES (?, ?, ?)", (kind, note_id, name))
+        conn.execute("""
+            INSERT INTO counts (name, refs) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET refs = refs + 1""", (name,))
+        conn.execute("DELETE FROM pending WHERE name = ?", (name,))
+
+
+def _update_refs(kind, note_id, new_refs):
+    """
+    根据引用方（kind 为 "notes" 或 "revisions"）新旧引用的差集增量更新引用计数，
+    代价只与这个引用方变化的图片数有关。归零的图片只记入 pending，由后台清理线程在宽限期后删除。
+    """
+    note_id = str(note_id)
+    conn = _conn()
+    # 引用没有变化（绝大多数保存）时只做一次查询，不开写事务
+    if _is_built(conn) and _owner_refs(conn, kind, note_id) == new_refs:
+        return
+    _write(_apply_refs, kind, note_id, new_refs)
+    ensure_sweeper()
+
+
+def update_note_refs(note_id, text):
+    """便笺保存后按新正文更新它的图片引用"""
+    _update_refs("notes", note_id, extract_refs(text) if text is not None else set())
+
+
+def drop_note_refs(note_id):
+    """便笺被删除时释放它的所有图片引用"""
+    update_note_refs(note_id, None)
+
+
+def update_revision_refs(note_id, refs):
+    """便笺保留的历史版本中出现过的全部图片（记录或整理历史版本后调用）"""
+    _update_refs("revisions", note_id, set(refs))
+
+
+def drop_revision_refs(note_id):
+    """历史版本被删除时释放其中的图片引用"""
+    _update_refs("revisions", note_id, set())
+
+
+# ------------------ 清理 ------------------
+def _sweep(conn, grace):
+    removed = 0
+    now = time.time()
+    rows = conn.execute("SELECT name FROM pending WHERE since <= ?", (now - grace,)).fetchall()
+    for (name,) in rows:
+        if conn.execute("SELECT 1 FROM counts WHERE name = ?", (name,)).fetchone() is None:
+            full_path = os.path.join(IMAGE_FOLDER, name)
+            try:
+                # 内容寻址存储在重复粘贴同一张图片时会刷新修改时间，这样的文件暂不删除
+                if now - os.path.getmtime(full_path) < grace:
+                    continue
+                os.remove(full_path)
+                print(f"已删除未被引用的图片: {os.path.abspath(full_path)}")
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"删除图片失败: {full_path}，原因: {e}")
+                continue
+        conn.execute("DELETE FROM pending WHERE name = ?", (name,))
+    return removed
+
+
+def sweep_pending(grace=GRACE_PERIOD):
+    """删除引用数已归零且超过宽限期的图片，返回删除数量"""
+    conn = _conn()
+    if not _is_built(conn):
+        return 0
+    if conn.execute("SELECT 1 FROM pending WHERE since <= ? LIMIT 1", (time.time() - grace,)).fetchone() is None:
+        return 0
+    return _write(_sweep, grace)
+
+
+def ensure_sweeper():
+    """在当前进程中启动（仅一次）后台清理线程"""
+    global _sweeper
+    if _sweeper is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try:
+                sweep_pending()
+            except Exception as e:
+                print(f"图片清理失败：{e}")
+
+    _sweeper = threading.Thread(target=run, daemon=True)
+    _sweeper.start()
+
+
+def _full_sweep(conn, grace):
+    _rebuild(conn)
+    referenced = {row[0] for row in conn.execute("SELECT name FROM counts")}
+    removed = 0
+    now = time.time()
+    if os.path.isdir(IMAGE_FOLDER):
+        for dirpath, dirnames, filenames in os.walk(IMAGE_FOLDER):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for f in filenames:
+                if f.startswith(".") or f.upper().startswith("README"):
+                    continue
+                full_path = os.path.join(dirpath, f)
+                name = os.path.relpath(full_path, IMAGE_FOLDER).replace(os.sep, "/")
+                if name in referenced:
+                    continue
+                try:
+                    if now - os.path.getmtime(full_path) < grace:
+                        continue
+                    os.remove(full_path)
+                    print(f"已删除未被引用的图片: {os.path.abspath(full_path)}")
+                    removed += 1
+                except Exception as e:
+                    print(f"删除图片失败: {full_path}，原因: {e}")
+    return removed
+
+
+def full_sweep(grace=GRACE_PERIOD):
+    """
+    全量标记-清除（维护命令，不在保存路径上调用）：
+    重新扫描全部便笺重建引用索引，并删除图片目录中未被引用、且修改时间早于宽限期的文件。
+    """
+    return _write(_full_sweep, grace)
+
+
+if __name__ == "__main__":
+    # 维护命令：python image_gc.py [--now]
+    # --now 表示忽略宽限期，立即删除所有未被引用的图片
+    count = full_sweep(grace=0 if "--now" in sys.argv else GRACE_PERIOD)
+    print(f"全量整理完成，共删除 {count} 张图片")
@@ -1,31 +1,181 @@
+import tkinter as tk
 from tkinter import filedialog
-from PIL import Image, ImageTk, ImageGrab
-import os
-import time
+# PIL 在第一次显示或处理图片时才导入（见各方法内），没有图片的便笺打开时不需要加载它
+import image_ingest
+import photo_cache
+import thumbnail_cache
+
+PLACEHOLDER_COLOR = "#D9D9D9"
+# 可见区域上下各多少屏内的图片会被解码显示；超出 RELEASE_SCREENS 屏的图片换回占位图
+MATERIALIZE_SCREENS = 1
+RELEASE_SCREENS = 3
+# 粘贴图片时，读取剪贴板完成前显示的占位图尺寸
+PASTE_PLACEHOLDER_SIZE = (120, 80)
 
-IMAGE_FOLDER = "sticky_notes_images"
 
 class ImageHandler:
     def __init__(self, app):
         self.app = app
         self.image_refs = []
+        self._placeholders = {}
+        self._loader = None
+        self._lazy = {}              # 嵌入图片名称 -> {"path", "size", "state"}
+        self._viewport_hooked = False
+        self._check_after = None
+
+    # ------------------ 加载已保存的图片（后台解码） ------------------
+    @property
+    def loader(self):
+        if self._loader is None:
+            from image_loader import AsyncImageLoader
+            self._loader = AsyncImageLoader(self.app.text_widget, self._on_image_ready)
+        return self._loader
+
+    def _placeholder(self, size):
+        """同一尺寸的占位图只创建一次，所有等待解码的位置共用"""
+        photo = self._placeholders.get(size)
+        if photo is None:
+            photo = tk.PhotoImage(width=size[0], height=size[1])
+            photo.put(PLACEHOLDER_COLOR, to=(0, 0, size[0], size[1]))
+            self._placeholders[size] = photo
+        return photo
+
+    def cancel_pending(self):
+        """内容被整体替换前调用：丢弃尚未完成的解码结果和所有懒加载记录"""
+        if self._loader is not None:
+            self._loader.reset()
+        self._lazy.clear()
+
+    def insert_saved_image(self, image_path):
+        """
+        在 insert 位置插入一张与缩略图同样大小的占位图和隐藏的 [[IMG:路径]] 标记。
+        只有位于可见区域附近的图片才会被解码（后台线程池）并换成真正的图片，
+        滚出可见区域较远的图片会换回共享的占位图，释放 PhotoImage；标记始终留在文本中。
+        Text 中嵌入图片的名称会随编辑一起移动（和 mark 一样），加载期间用户输入不会让图片错位。
+        读取图片头部失败（文件不存在等）时抛出异常，由调用方处理。
+        """
+        widget = self.app.text_widget
+        photo_cache.track_widget(widget)
+        self._hook_viewport()
+        size = thumbnail_cache.thumbnail_size(image_path)
+        name = widget.image_create("insert", image=self._placeholder(size))
+        widget.insert("insert", f"[[IMG:{image_path}]]", ("invisible",))
+        self._track(name, image_path, size, "placeholder")
+        self.schedule_viewport_check()
+
+    def _on_image_ready(self, name, image_path, image):
+        entry = self._lazy.get(name)
+        if entry is None or entry["path"] != image_path:
+            # 加载期间该图片已被删除或内容已被替换
+            return
+        if image is None:
+            # 保留占位图；标记仍在文本中，保存时不会丢失图片引用
+            entry["state"] = "failed"
+            return
+        cache = photo_cache.get_cache()
+        photo = cache.put(image_path, thumbnail_cache.THUMB_SIZE, image)
+        try:
+            self.app.text_widget.image_configure(name, image=photo)
+        except tk.TclError:
+            self._lazy.pop(name, None)
+            return
+        cache.acquire(self.app.text_widget, photo)
+        entry["state"] = "shown"
+
+    # ------------------ 按可见区域加载/释放图片 ------------------
+    def _track(self, name, image_path, size, state):
+        self._lazy[name] = {"path": image_path, "size": size, "state": state}
+
+    def _hook_viewport(self):
+        """接管 yscrollcommand（保留原有的回调），视图变化或窗口尺寸变化时检查可见区域"""
+        if self._viewport_hooked:
+            return
+        self._viewport_hooked = True
+        widget = self.app.text_widget
+        previous = widget.cget("yscrollcommand")
+
+        def on_yview(first, last):
+            if previous:
+                widget.tk.eval(f"{previous} {first} {last}")
+            self.schedule_viewport_check()
+
+        widget.config(yscrollcommand=on_yview)
+        widget.bind("<Configure>", lambda e: self.schedule_viewport_check(), add="+")
+
+    def schedule_viewport_check(self):
+        if self._check_after is None:
+            self._check_after = self.app.text_widget.after_idle(self._check_viewport)
+
+    def _check_viewport(self):
+        """
+        可见行上下各 MATERIALIZE_SCREENS 屏内的图片解码显示，
+        超出 RELEASE_SCREENS 屏的图片换回占位图（两者之间保持不变，避免来回抖动）。
+        """
+        self._check_after = None
+        widget = self.app.text_widget
+        if not self._lazy:
+            return
+        try:
+            first = int(widget.index("@0,0").split(".")[0])
+            last = int(widget.index(f"@0,{max(1, widget.winfo_height())}").split(".")[0])
+        except tk.TclError:
+            return
+        span = last - first + 1
+        near = (first - span * MATERIALIZE_SCREENS, last + span * MATERIALIZE_SCREENS)
+        far = (first - span * RELEASE_SCREENS, last + span * RELEASE_SCREENS)
+        released = False
+        for name, entry in list(self._lazy.items()):
+            try:
+                line = int(widget.index(name).split(".")[0])
+            except tk.TclError:
+                # 图片已被删除
+                del self._lazy[name]
+                continue
+            if near[0] <= line <= near[1]:
+                if entry["state"] == "placeholder":
+                    self._materialize(name, entry)
+            elif (line < far[0] or line > far[1]) and entry["state"] == "shown":
+                widget.image_configure(name, image=self._placeholder(entry["size"]))
+                entry["state"] = "placeholder"
+                released = True
+        if released:
+            photo_cache.get_cache().sync_widget(widget)
+
+    def _materialize(self, name, entry):
+        widget = self.app.text_widget
+        marker = f"[[IMG:{entry['path']}]]"
+        # 嵌入图片的名称在原图片被删除后可能被复用，确认其后仍是对应的标记
+        if widget.get(f"{name}+1c", f"{name}+{1 + len(marker)}c") != marker:
+            del self._lazy[name]
+            return
+        cache = photo_cache.get_cache()
+        photo = cache.get(entry["path"], thumbnail_cache.THUMB_SIZE)
+        if photo is not None:
+            widget.image_configure(name, image=photo)
+            cache.acquire(widget, photo)
+            entry["state"] = "shown"
+            return
+        entry["state"] = "loading"
+        self.loader.submit(name, entry["path"])
 
     def handle_image_paste(self):
         """
         当外部（text_shortcuts）未能获取文本时，调用此函数尝试粘贴图片。
-        若检测到剪贴板中有图片，则保存并插入到文本中。
+        立即在光标处放一个占位图；读取剪贴板图片（ImageGrab.grabclipboard）和编码存储
+        都在后台线程中完成，随后把占位图换成真正的图片。剪贴板中没有图片时移除占位图。
         """
-        try:
+        widget = self.app.text_widget
+        name = widget.image_create("insert", image=self._placeholder(PASTE_PLACEHOLDER_SIZE))
+        self._lazy.pop(name, None)
+
+        def work():
+            from PIL import Image, ImageGrab
             image = ImageGrab.grabclipboard()
-            if isinstance(image, Image.Image):
-                folder = IMAGE_FOLDER
-                if not os.path.exists(folder):
-                    os.makedirs(folder)
-                filename = os.path.join(folder, f"{int(time.time())}.png")
-                image.save(filename)
-                self.insert_pil_image(image, filename)
-        except Exception as e:
-            print("粘贴失败(图片):", e)
+            if not isinstance(image, Image.Image):
+                return None
+            return image_ingest.ingest(image=image)
+
+        self.loader.run(work, lambda result: self._on_ingested(name, result, newline_after=True))
 
     def insert_image(self):
         """
@@ -33,8 +183,53 @@ class ImageHandler:
         """
         file_path = filedialog.askopenfilename(filetypes=[("图片文件", "*.png;*.jpg;*.jpeg;*.gif")])
         if file_path:
-            image = Image.open(file_path)
-            self.insert_pil_image(image, file_path)
+            # 处理后复制进图片存储，原文件移动或删除后便笺中的图片仍然有效
+            try:
+                self.ingest_async(source_path=file_path)
+            except Exception as e:
+                print("插入图片失败:", e)
+
+    def ingest_async(self, image=None, source_path=None, add_newline=True):
+        """
+        先在 insert 位置放一个与缩略图同尺寸的占位图，再在后台线程中完成
+        方向校正、缩放、重新编码和写入存储（image_ingest），完成后替换为真正的图片，
+        并在图片后插入隐藏的 [[IMG:路径]] 标记。
+        """
+        widget = self.app.text_widget
+        if image is not None:
+            size = thumbnail_cache.fit_size(image.size)
+        else:
+            size = thumbnail_cache.thumbnail_size(source_path)
+        name = widget.image_create("insert", image=self._placeholder(size))
+        # 名称可能与已被删除的旧图片相同，清掉旧记录
+        self._lazy.pop(name, None)
+        if add_newline:
+            widget.insert("insert", "\n")
+        self.loader.run(lambda: image_ingest.ingest(image=image, source_path=source_path),
+                        lambda result: self._on_ingested(name, result))
+
+    def _on_ingested(self, name, result, newline_after=False):
+        widget = self.app.text_widget
+        try:
+            index = widget.index(name)
+        except tk.TclError:
+            # 处理期间占位图已被删除；写入存储的文件无人引用，之后由图片清理回收
+            return
+        if result is None:
+            widget.delete(index)
+            return
+        photo_cache.track_widget(widget)
+        cache = photo_cache.get_cache()
+        photo = cache.put(result["path"], thumbnail_cache.THUMB_SIZE, result["thumbnail"])
+        widget.image_configure(name, image=photo)
+        cache.acquire(widget, photo)
+        marker = f"[[IMG:{result['path']}]]"
+        widget.insert(f"{index}+1c", marker, ("invisible",))
+        if newline_after:
+            widget.insert(f"{index}+{1 + len(marker)}c", "\n")
+        # 之后滚出可见区域较远时同样可以释放
+        self._hook_viewport()
+        self._track(name, result["path"], (photo.width(), photo.height()), "shown")
 
     def insert_pil_image(self, image, image_path=None, add_newline=True):
         """
@@ -46,14 +241,23 @@ class ImageHandler:
           add_newline: 如果为 True，则在图片后自动插入一个换行符（默认用于粘贴操作）。
                        如果为 False，则不自动添加换行符（在从保存内容中加载时使用）。
         """
-        image.thumbnail((200, 200))
-        photo = ImageTk.PhotoImage(image)
-        self.image_refs.append(photo)
+        image.thumbnail(thumbnail_cache.THUMB_SIZE)
+        widget = self.app.text_widget
+        photo_cache.track_widget(widget)
+        if image_path:
+            # 有路径的图片放入进程内共享缓存，由缓存按引用计数和内存预算管理
+            cache = photo_cache.get_cache()
+            photo = cache.put(image_path, thumbnail_cache.THUMB_SIZE, image)
+        else:
+            from PIL import ImageTk
+            photo = ImageTk.PhotoImage(image)
+            self.image_refs.append(photo)
 
         # 在当前插入点插入图片
-        self.app.text_widget.image_create("insert", image=photo)
+        widget.image_create("insert", image=photo)
 
         if image_path:
+            cache.acquire(widget, photo)
             marker = f"[[IMG:{image_path}]]"
             self.app.text_widget.insert("insert", marker, ("invisible",))
 
@@ -0,0 +1,117 @@
+import io
+import os
+import threading
+import image_store
+import thumbnail_cache
+
+# 粘贴/插入图片时的处理参数，均可在 .env 中配置：
+# 存储的最大边长（像素），超出时按比例缩小；0 表示不限制
+IMAGE_MAX_SIZE = int(os.getenv("IMAGE_MAX_SIZE", "2560"))
+# 存储格式：png（无损并开启优化）、webp 或 jpeg（有损，按 IMAGE_QUALITY 压缩）
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "png").strip().lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+# 有损格式的来源文件：重新编码为 PNG 往往比原文件大好几倍，同时尝试保持 JPEG，取较小的结果
+LOSSY_SOURCE_FORMATS = ("JPEG", "MPO")
+
+_stats_lock = threading.Lock()
+# original_bytes / stored_bytes 只统计有原始文件可比较的图片；
+# 剪贴板图片没有原始数据，只单独统计数量和存储字节数
+_stats = {"images": 0, "original_bytes": 0, "stored_bytes": 0,
+          "clipboard_images": 0, "clipboard_stored_bytes": 0}
+
+
+def _encode(image, fmt):
+    """按格式编码，返回 (数据, 扩展名)；JPEG 不支持透明通道，此时改用 PNG"""
+    buffer = io.BytesIO()
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if fmt == "jpeg" and not has_alpha:
+        image.convert("RGB").save(buffer, format="JPEG", quality=IMAGE_QUALITY, optimize=True)
+        return buffer.getvalue(), ".jpg"
+    if fmt == "webp":
+        image.save(buffer, format="WEBP", quality=IMAGE_QUALITY, method=4)
+        return buffer.getvalue(), ".webp"
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue(), ".png"
+
+
+def _prepare(image):
+    """按 EXIF 方向旋正、限制最大边长，返回 (新图片, 是否改变了像素)"""
+    from PIL import Image, ImageOps
+    changed = False
+    # 0x0112 为 EXIF Orientation，1 表示无需旋转
+    if image.getexif().get(0x0112, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+        changed = True
+    if IMAGE_MAX_SIZE > 0 and max(image.size) > IMAGE_MAX_SIZE:
+        image = image.copy()
+        image.thumbnail((IMAGE_MAX_SIZE, IMAGE_MAX_SIZE), Image.LANCZOS)
+        changed = True
+    if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.mode else "RGB")
+        changed = True
+    return image, changed
+
+
+def ingest(image=None, source_path=None):
+    """
+    把一张图片处理后存入内容寻址存储（应在后台线程中调用）：
+    EXIF 方向校正 -> 限制最大边长 -> 按配置格式重新编码。
+    image 为剪贴板中的 PIL 图片；source_path 为用户选择的文件（二者给一个）。
+    保存各候选结果（配置格式、有损来源的 JPEG、未改动像素时的原始文件）中最小的一个；动图直接保存原始数据。
+    返回 {"path", "thumbnail", "original_bytes", "stored_bytes"}，剪贴板图片没有原始文件，original_bytes 为 None。
+    """
+    from PIL import Image
+    original = None
+    original_ext = ".png"
+    if source_path is not None:
+        with open(source_path, "rb") as f:
+            original = f.read()
+        original_ext = os.path.splitext(source_path)[1]
+        image = Image.open(io.BytesIO(original))
+    source_format = getattr(image, "format", None)
+
+    if getattr(image, "is_animated", False) and original is not None:
+        # 动图重新编码会丢失动画
+        data, ext = original, original_ext
+        prepared = image
+    else:
+        prepared, changed = _prepare(image)
+        candidates = [_encode(prepared, IMAGE_FORMAT)]
+        if source_format in LOSSY_SOURCE_FORMATS and IMAGE_FORMAT != "jpeg":
+            candidates.append(_encode(prepared, "jpeg"))
+        if original is not None and not changed:
+            candidates.append((original, original_ext))
+        data, ext = min(candidates, key=lambda candidate: len(candidate[0]))
+
+    original_bytes = len(original) if original is not None else None
+
+    path = image_store.store_bytes(data, ext)
+    thumbnail = prepared.copy()
+    thumbnail.thumbnail(thumbnail_cache.THUMB_SIZE)
+
+    with _stats_lock:
+        _stats["images"] += 1
+        if original_bytes is None:
+            _stats["clipboard_images"] += 1
+            _stats["clipboard_stored_bytes"] += len(data)
+        else:
+            _stats["original_bytes"] += original_bytes
+            _stats["stored_bytes"] += len(data)
+    if original_bytes is None:
+        print(f"图片已保存：{len(data) / 1024:.1f} KB（剪贴板图片，没有原始文件可比较）")
+    else:
+        saved = original_bytes - len(data)
+        print(f"图片已保存：{len(data) / 1024:.1f} KB（原始 {original_bytes / 1024:.1f} KB，节省 {saved / 1024:.1f} KB）")
+    return {"path": path, "thumbnail": thumbnail,
+            "original_bytes": original_bytes, "stored_bytes": len(data)}
+
+
+def stats():
+    """
+    本进程中处理过的图片数；有原始文件的图片的原始总字节数、实际存储的总字节数与节省的字节数；
+    剪贴板图片的数量与存储字节数
+    """
+    with _stats_lock:
+        result = dict(_stats)
+    result["saved_bytes"] = result["original_bytes"] - result["stored_bytes"]
+    return result
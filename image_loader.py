@@ -0,0 +1,90 @@
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import thumbnail_cache
+
+# 后台解码图片的线程数，可在 .env 中通过 IMAGE_DECODE_WORKERS 调整
+IMAGE_DECODE_WORKERS = int(os.getenv("IMAGE_DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# UI 线程检查解码结果的间隔（毫秒）
+POLL_INTERVAL_MS = 30
+
+_executor = None
+
+
+def get_executor():
+    """进程内共享的解码线程池（首次使用时创建）"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, IMAGE_DECODE_WORKERS),
+                                       thread_name_prefix="image-decode")
+    return _executor
+
+
+class AsyncImageLoader:
+    """
+    在线程池中解码图片（读取/生成缩略图），再交回 UI 线程：
+    - submit() 立即返回，解码结果放入队列；
+    - UI 线程用 after() 轮询队列，对每个结果调用 on_ready(key, path, image)，
+      image 为 PIL Image，解码失败时为 None；PhotoImage 只能在 UI 线程中创建。
+    - reset() 之后，之前提交但尚未完成的结果会被丢弃（例如便笺内容被整体替换时）。
+    """
+    def __init__(self, widget, on_ready):
+        self.widget = widget
+        self.on_ready = on_ready
+        self.generation = 0
+        self._results = queue.Queue()
+        self._pending = 0
+        self._after_id = None
+
+    def reset(self):
+        self.generation += 1
+
+    def submit(self, key, path, size=thumbnail_cache.THUMB_SIZE):
+        """后台读取 path 的缩略图，完成后调用 on_ready(key, path, image)"""
+        def work():
+            try:
+                return thumbnail_cache.get_thumbnail(path, size)
+            except Exception as e:
+                print(f"图片加载失败: {path}，原因: {e}")
+                return None
+
+        self.run(work, lambda image: self.on_ready(key, path, image))
+
+    def run(self, func, callback):
+        """在线程池中执行 func()，完成后在 UI 线程中调用 callback(结果)；func 抛出异常时结果为 None"""
+        generation = self.generation
+        results = self._results
+
+        def work():
+            try:
+                result = func()
+            except Exception as e:
+                print(f"后台图片任务失败：{e}")
+                result = None
+            results.put((generation, callback, result))
+
+        self._pending += 1
+        get_executor().submit(work)
+        self._schedule()
+
+    def _schedule(self):
+        if self._after_id is None:
+            self._after_id = self.widget.after(POLL_INTERVAL_MS, self._poll)
+
+    def _poll(self):
+        self._after_id = None
+        try:
+            if not self.widget.winfo_exists():
+                return
+        except Exception:
+            return
+        while True:
+            try:
+                generation, callback, result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending -= 1
+            if generation == self.generation:
+                callback(result)
+        if self._pending > 0:
+            self._schedule()
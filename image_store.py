@@ -0,0 +1,173 @@
+import hashlib
+import io
+import os
+import re
+import sys
+from note_storage import FileLock, atomic_write_json, read_json
+
+# 图片按内容的 SHA-256 存放：sticky_notes_images/ab/ab12…ef.png
+# 相同的图片无论粘贴多少次、插入到多少个便笺，都只存一份，由 image_gc 按便笺引用计数回收
+IMAGE_FOLDER = "sticky_notes_images"
+HASH_NAME = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+$")
+IMG_PATTERN = re.compile(r"\[\[IMG:(.*?)\]\]")
+# 旧标记（按时间命名或指向用户原始文件）是否已迁移到内容寻址存储
+MIGRATION_FLAG = os.path.join(IMAGE_FOLDER, ".content_addressed.json")
+ALLOWED_EXTS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp")
+
+_migrated = False
+
+
+def _stored_path(digest, ext):
+    return f"{IMAGE_FOLDER}/{digest[:2]}/{digest}{ext}"
+
+
+def is_stored(marker):
+    """标记是否已经指向内容寻址存储中的文件"""
+    marker = marker.replace("\\", "/")
+    prefix = IMAGE_FOLDER + "/"
+    return marker.startswith(prefix) and HASH_NAME.match(marker[len(prefix):]) is not None
+
+
+def store_bytes(data, ext=".png"):
+    """
+    把图片数据写入存储并返回用于 [[IMG:...]] 标记的相对路径。
+    已存在相同内容时不再写入，只刷新修改时间，避免它在引用计数归零的宽限期内被清理。
+    """
+    ext = ext.lower() if ext and ext.lower() in ALLOWED_EXTS else ".png"
+    digest = hashlib.sha256(data).hexdigest()
+    # 扩展名不同但内容相同（例如同一文件被改名）也视为同一张图片
+    for existing_ext in (ext,) + ALLOWED_EXTS:
+        path = _stored_path(digest, existing_ext)
+        if os.path.exists(path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+    path = _stored_path(digest, ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def store_pil_image(image):
+    """把剪贴板中的 PIL 图片编码为 PNG 后存入"""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return store_bytes(buffer.getvalue(), ".png")
+
+
+def import_file(file_path):
+    """把用户选择的图片文件复制进存储（便笺不再依赖原文件的位置）"""
+    with open(file_path, "rb") as f:
+        data = f.read()
+    return store_bytes(data, os.path.splitext(file_path)[1])
+
+
+# ------------------ 旧标记迁移 ------------------
+def _offset_mapper(replacements):
+    """
+    replacements: [(start, end, new_length), ...]（按 start 升序，基于旧文本）
+    返回把旧文本偏移换算为新文本偏移的函数；落在被替换标记内部的偏移夹在新标记范围内。
+    """
+    def convert(offset):
+        shift = 0
+        for start, end, new_length in replacements:
+            if offset <= start:
+                break
+            if offset < end:
+                return start + shift + min(offset - start, new_length)
+            shift += new_length - (end - start)
+        return offset + shift
+    return convert
+
+
+def migrate_note(note, cache):
+    """
+    把一个便笺中旧的 [[IMG:路径]] 改写为内容寻址路径，并同步平移格式标签的偏移。
+    找不到原文件的标记保持不变。返回新的便笺 dict，没有改动时返回 None。
+    cache: {旧路径: 新路径}，在多个便笺之间复用，同一文件只读取一次。
+    """
+    import rich_text
+    text = note.get("text", "")
+    pieces = []
+    replacements = []
+    pos = 0
+    for match in IMG_PATTERN.finditer(text):
+        old_path = match.group(1)
+        if is_stored(old_path):
+            continue
+        if old_path not in cache:
+            try:
+                cache[old_path] = import_file(old_path)
+            except OSError:
+                cache[old_path] = None
+        new_path = cache[old_path]
+        if new_path is None:
+            continue
+        marker = f"[[IMG:{new_path}]]"
+        pieces.append(text[pos:match.start()])
+        pieces.append(marker)
+        replacements.append((match.start(), match.end(), len(marker)))
+        pos = match.end()
+    if not replacements:
+        return None
+    pieces.append(text[pos:])
+
+    convert = _offset_mapper(replacements)
+    tag_info = {}
+    for tag, ranges in rich_text.decode_tag_info(note).items():
+        tag_info[tag] = rich_text.encode_ranges([(convert(s), convert(e)) for s, e in ranges])
+    migrated = dict(note)
+    migrated["text"] = "".join(pieces)
+    migrated["tag_info"] = tag_info
+    migrated["tag_format"] = rich_text.TAG_FORMAT
+    return migrated
+
+
+def migrate_all():
+    """把所有便笺中的旧图片标记迁移到内容寻址存储，返回改写的便笺数"""
+    import image_gc
+    from note_storage import get_store
+    store = get_store()
+    # 先按旧标记建立引用计数，迁移后旧文件的引用才能被正确释放
+    image_gc.ensure_index()
+    cache = {}
+    changed = {}
+    for note_id, note in store.load_all().items():
+        migrated = migrate_note(note, cache)
+        if migrated is not None:
+            changed[note_id] = migrated
+    # 一次提交全部改写（分片存储只重写一次清单）
+    store.save_many(changed)
+    for note_id, migrated in changed.items():
+        # 旧文件的引用随之释放，宽限期后由 image_gc 删除
+        image_gc.update_note_refs(note_id, migrated["text"])
+    return len(changed)
+
+
+def ensure_migrated():
+    """每个数据目录只迁移一次（跨进程用文件锁保证只有一个进程执行）"""
+    global _migrated
+    if _migrated:
+        return
+    if read_json(MIGRATION_FLAG, default=None) is None:
+        os.makedirs(IMAGE_FOLDER, exist_ok=True)
+        with FileLock(MIGRATION_FLAG + ".lock"):
+            if read_json(MIGRATION_FLAG, default=None) is None:
+                count = migrate_all()
+                atomic_write_json(MIGRATION_FLAG, {"version": 1, "notes": count})
+                if count:
+                    print(f"已将 {count} 个便笺中的图片迁移到内容寻址存储")
+    _migrated = True
+
+
+if __name__ == "__main__":
+    # 维护命令：python image_store.py --migrate 重新扫描并迁移所有旧图片标记
+    if "--migrate" in sys.argv:
+        print(f"迁移完成，共改写 {migrate_all()} 个便笺")
+    else:
+        print("用法: python image_store.py --migrate")
@@ -1,62 +1,409 @@
+import argparse
+from collections import deque
 import multiprocessing
+from multiprocessing.connection import wait
+import queue
 import sys
 import os
+import threading
+import time
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from Note import launch_sticky_note
+# 这里只导入轻量模块：已有主进程在运行时，本次启动只转发命令后立即退出。
+# Note（tkinter、PIL、AI，并加载 .env）在确定由本进程作为主进程后才导入。
+import single_instance
+from window_stats import WindowStats, current_rss_kb, on_first_map
 
-def main():
-    processes = []
-    command_queue = multiprocessing.Queue()
+# 第一个便笺的默认位置
+FIRST_NOTE_XY = (1200, 520)
+# 单进程模式下 UI 线程检查其他线程发来的命令的间隔（毫秒）
+LOCAL_QUEUE_POLL_MS = 50
+
+
+def parse_command(cmd):
+    """把便笺发来的命令解析为 (note_id, x, y)；不是打开窗口的命令返回 None"""
+    if cmd == "new":
+        # 默认新便笺(无位置)
+        return None, 100, 100
+    if isinstance(cmd, tuple) and cmd[0] == "new_with_xy":
+        # 指定位置的新便笺
+        return None, cmd[1], cmd[2]
+    if isinstance(cmd, tuple) and cmd[0] == "open_with_xy":
+        return cmd[1], cmd[2], cmd[3]
+    return None
+
+
+def prepare_data():
+    """
+    打开任何窗口（包括预热进程）之前完成一次性的图片标记迁移：迁移期间没有窗口读到旧标记，
+    也就不会在迁移后把旧标记自动保存回去。完成后关闭存储，主进程之后还要 fork 便笺进程。
+    """
+    import image_store
+    from note_storage import close_store
+    try:
+        image_store.ensure_migrated()
+    except Exception as e:
+        print(f"图片迁移失败，下次启动时重试：{e}")
+    finally:
+        close_store()
 
-    # 第一个便笺
-    p = multiprocessing.Process(target=launch_sticky_note, args=(None, command_queue, 1200, 520))
-    p.start()
-    processes.append(p)
 
-    while processes:
+def load_session():
+    """读取上次的窗口会话，返回 (Session, [(便笺ID, 窗口状态)])；已删除或从未保存的便笺不恢复"""
+    import session
+    from note_storage import get_store, close_store
+    current = session.Session()
+    try:
+        known_ids = set(get_store().list_meta())
+    except Exception as e:
+        print(f"读取便笺列表失败，跳过会话恢复：{e}")
+        return current, []
+    finally:
+        # 主进程之后还要 fork 便笺进程，不保留存储实例（缓存、inotify 描述符、SQLite 连接）
+        close_store()
+    return current, current.load(known_ids)
+
+
+class Supervisor:
+    """
+    进程模式的主进程：同时等待命令队列和所有便笺进程的 sentinel（multiprocessing.connection.wait），
+    空闲时不占用 CPU；有命令时立即处理，子进程退出时立即回收（join），不留僵尸进程。
+    counters 记录启动/退出的窗口数、当前与峰值打开窗口数，打开延迟由子进程窗口第一次显示时上报。
+    启动时按批恢复上次打开的窗口（每批 SESSION_RESTORE_BATCH 个，间隔 SESSION_RESTORE_STAGGER_MS）。
+    便笺进程保存/重命名/删除便笺后发来 ("note_changed", 便笺ID, 种类, 进程号, 元数据)，
+    主进程为该便笺分配递增的版本号，经每个子进程各自的管道广播给所有便笺进程。
+    """
+    def __init__(self, pool_size=None):
+        import process_pool
+        self.command_queue = multiprocessing.Queue()
+        # 预热的便笺进程池：新建/打开便笺时直接交给已完成导入和 Tk 初始化的进程
+        if pool_size is None:
+            pool_size = process_pool.NOTE_POOL_SIZE
+        self.pool = process_pool.ProcessPool(self.command_queue, pool_size)
+        self.server = None
+        self.window_stats = WindowStats("process")
+        self.processes = {}     # sentinel -> 进程
+        self.channels = {}      # sentinel -> 向该进程广播变化通知的管道（不再读取的进程为 None）
+        self.versions = {}      # 便笺 ID -> 最新版本号
+        self.counters = {"spawned": 0, "exited": 0, "live": 0, "peak_live": 0, "broadcasts": 0,
+                         "dropped_channels": 0}
+        self.session = None
+        self._restore = deque()
+        self._next_batch_at = 0
+
+    def spawn(self, note_id, x, y, window_state=None):
+        p, channel = self.pool.launch(note_id, x, y, time.time(), window_state)
         try:
-            cmd = command_queue.get(timeout=0.5)
-            if cmd == "new":
-                # 默认新便笺(无位置)
-                new_p = multiprocessing.Process(target=launch_sticky_note, args=(None, command_queue, 100, 100))
-                new_p.start()
-                processes.append(new_p)
-
-            elif isinstance(cmd, tuple) and cmd[0] == "new_with_xy":
-                # 指定位置的新便笺
-                x = cmd[1]
-                y = cmd[2]
-                new_p = multiprocessing.Process(
-                    target=launch_sticky_note,
-                    args=(None, command_queue, x, y)
-                )
-                new_p.start()
-                processes.append(new_p)
-
-            # ============ 新增：open_with_xy 命令处理 ============
-            elif isinstance(cmd, tuple) and cmd[0] == "open_with_xy":
-                note_id = cmd[1]
-                x = cmd[2]
-                y = cmd[3]
-                new_p = multiprocessing.Process(
-                    target=launch_sticky_note,
-                    args=(note_id, command_queue, x, y)
-                )
-                new_p.start()
-                processes.append(new_p)
-
-        except multiprocessing.queues.Empty:
+            # 广播不能因为某个不读管道的便笺进程而阻塞主进程：写端设为非阻塞，管道写满时放弃该进程
+            os.set_blocking(channel.fileno(), False)
+        except (AttributeError, OSError):
             pass
+        self.processes[p.sentinel] = p
+        self.channels[p.sentinel] = channel
+        self.counters["spawned"] += 1
+        self.counters["live"] = len(self.processes)
+        self.counters["peak_live"] = max(self.counters["peak_live"], self.counters["live"])
+
+    def handle(self, cmd):
+        if isinstance(cmd, tuple) and cmd[0] == "window_opened":
+            # 子进程的窗口已显示
+            _, note_id, latency_ms, memory_kb = cmd
+            self.window_stats.record(latency_ms, memory_kb, note_id)
+            self.session.mark_visible(note_id)
+            return
+        if isinstance(cmd, tuple) and cmd[0] == "note_changed":
+            self.broadcast(*cmd[1:])
+            return
+        if self.session.handle(cmd):
+            return
+        target = parse_command(cmd)
+        if target is not None:
+            self.spawn(*target)
 
-        # 清理退出的进程
-        processes = [p for p in processes if p.is_alive()]
+    def broadcast(self, note_id, kind, origin, meta=None):
+        """
+        把便笺变化广播给所有便笺进程（不会阻塞）。管道写满说明该进程长时间没有读取，
+        关闭它的管道、不再向它广播（它的缓存改由文件变化判断失效）；其他写入失败说明该进程正在退出，忽略即可。
+        """
+        version = self.versions.get(note_id, 0) + 1
+        self.versions[note_id] = version
+        event = ("note_changed", note_id, kind, version, origin, meta)
+        for sentinel, channel in list(self.channels.items()):
+            if channel is None:
+                continue
+            try:
+                channel.send(event)
+            except BlockingIOError:
+                print(f"便笺进程 {self.processes[sentinel].pid} 长时间未读取变化通知，停止向它广播")
+                channel.close()
+                self.channels[sentinel] = None
+                self.counters["dropped_channels"] += 1
+            except (BrokenPipeError, OSError):
+                pass
+        self.counters["broadcasts"] += 1
 
-    # 收尾
-    for p in processes:
-        if p.is_alive():
-            p.terminate()
+    def _drain_commands(self):
+        while True:
+            try:
+                cmd = self.command_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.handle(cmd)
+
+    def _reap(self, sentinel):
+        p = self.processes.pop(sentinel)
+        p.join()
+        channel = self.channels.pop(sentinel)
+        if channel is not None:
+            channel.close()
+        self.counters["exited"] += 1
+        self.counters["live"] = len(self.processes)
+
+    def _spawn_restore_batch(self):
+        import session
+        for _ in range(min(session.SESSION_RESTORE_BATCH, len(self._restore))):
+            note_id, state = self._restore.popleft()
+            x, y = session.geometry_xy(state.get("geometry"))
+            self.spawn(note_id, x, y, state)
+        self._next_batch_at = time.time() + session.SESSION_RESTORE_STAGGER_MS / 1000
+
+    def stats(self):
+        return dict(self.counters,
+                    open_latency_ms=self.window_stats.summary()["open_latency_ms"],
+                    restore_ms=self.session.restore_ms if self.session is not None else None,
+                    pool=self.pool.stats())
+
+    def run(self, first_command=None, listener=None):
+        """first_command 为 None 时恢复上次打开的窗口（没有则新建一个便笺）"""
+        import session
+        self.session, entries = load_session()
+        # 启动时先在主线程中预热（此时还没有其他线程）：至少填满池，恢复会话时预热够第一批窗口，
+        # 第一个窗口 / 第一批恢复的窗口直接使用预热进程
+        self.pool.refill(min(len(entries), session.SESSION_RESTORE_BATCH))
+        if listener is not None:
+            # 之后再次启动 main.py 时，命令经本地套接字转发到这里
+            self.server = single_instance.InstanceServer(listener, self.command_queue)
+        if entries:
+            self.session.begin_restore(note_id for note_id, _state in entries)
+            self._restore.extend(entries)
+            self._spawn_restore_batch()
+        if first_command is not None:
+            self.handle(first_command)
+        elif not entries:
+            self.handle(("new_with_xy",) + FIRST_NOTE_XY)
+        try:
+            while self.processes or self._restore:
+                reader = self.command_queue._reader
+                # 只有还有待恢复的窗口或待补充的进程池时才设置超时，其余时间一直阻塞
+                timeouts = [self.pool.refill_timeout()]
+                if self._restore:
+                    timeouts.append(max(0, self._next_batch_at - time.time()))
+                timeouts = [t for t in timeouts if t is not None]
+                ready = wait([reader, *self.processes], min(timeouts) if timeouts else None)
+                # 先处理命令：子进程可能在退出前刚发出新建/打开请求
+                if reader in ready:
+                    self._drain_commands()
+                for sentinel in ready:
+                    if sentinel in self.processes:
+                        self._reap(sentinel)
+                if self._restore and time.time() >= self._next_batch_at:
+                    self._spawn_restore_batch()
+                self.pool.refill_if_due()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        self.pool.shutdown()
+        for p in self.processes.values():
+            if p.is_alive():
+                p.terminate()
             p.join()
+        for channel in self.channels.values():
+            if channel is not None:
+                channel.close()
+        self.processes = {}
+        self.channels = {}
+        self.window_stats.report()
+        counters = self.counters
+        print(f"[process] 共启动 {counters['spawned']} 个窗口，同时打开最多 {counters['peak_live']} 个")
+
+
+class LocalCommandQueue:
+    """
+    单进程模式下代替 multiprocessing.Queue：便笺发出的命令交给同一个 Tk 事件循环处理。
+    put() 可以在任意线程调用（自动保存的写盘线程、实例服务线程），其他线程只把命令放进
+    线程安全的队列，不调用任何 Tk 接口：UI 线程可能正阻塞在等待写盘线程的 flush() 上，
+    此时跨线程的 after() 会互相等待而死锁。队列由 UI 线程每 LOCAL_QUEUE_POLL_MS 毫秒取空一次。
+    """
+    def __init__(self, host):
+        self.host = host
+        self._queue = queue.Queue()
+        self._thread = threading.get_ident()
+
+    def put(self, cmd):
+        self._queue.put(cmd)
+        if threading.get_ident() == self._thread:
+            # UI 线程自己发出的命令不必等下一次轮询
+            self.host.root.after(0, self.drain)
+
+    def drain(self):
+        """在 UI 线程中处理队列中已有的全部命令"""
+        while True:
+            try:
+                cmd = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self.host.handle(cmd)
+            except Exception as e:
+                print(f"处理命令失败：{cmd}，原因：{e}")
+
+    def poll(self):
+        self.drain()
+        self.host.root.after(LOCAL_QUEUE_POLL_MS, self.poll)
+
+
+class ToplevelHost:
+    """
+    单进程多窗口模式：一个隐藏的 Tk 根窗口，每个便笺是它的 Toplevel。
+    所有窗口共用一个解释器、一份便笺缓存/搜索索引/图片缓存和一个 AI 客户端。
+    最后一个便笺关闭后退出。
+    """
+    def __init__(self):
+        import tkinter as tk
+        import Note
+        from AI import AIChat
+        self.root = tk.Tk()
+        self.root.withdraw()
+        import change_feed
+        self.command_queue = LocalCommandQueue(self)
+        Note.global_command_queue = self.command_queue
+        # 所有窗口共用进程内缓存，变化通知只需转给本进程的列表窗口等订阅者
+        change_feed.set_publisher(self.command_queue)
+        self.versions = {}
+        self.ai_chat = AIChat()
+        self.notes = []
+        self.stats = WindowStats("toplevel")
+        self.session = None
+
+    def open(self, note_id=None, x=None, y=None, window_state=None):
+        from Note import StickyNote
+        requested_at = time.time()
+        rss_before = current_rss_kb()
+        note = StickyNote(note_id=note_id, master=self.root, x=x, y=y, ai_chat=self.ai_chat)
+        if window_state:
+            note.apply_window_state(window_state.get("geometry"), window_state.get("pinned"))
+        self.notes.append(note)
+
+        def opened():
+            rss_after = current_rss_kb()
+            memory_kb = rss_after - rss_before if rss_after is not None and rss_before is not None else None
+            self.stats.record((time.time() - requested_at) * 1000, memory_kb, str(note.note_id))
+            self.session.mark_visible(str(note.note_id))
+
+        on_first_map(note.root, opened)
+        note.root.bind("<Destroy>", lambda e: self._on_destroy(note, e), add="+")
+
+    def _on_destroy(self, note, event):
+        if event.widget is not note.root or note not in self.notes:
+            return
+        self.notes.remove(note)
+        if not self.notes:
+            self.root.quit()
+
+    def handle(self, cmd):
+        if isinstance(cmd, tuple) and cmd[0] == "note_changed":
+            import change_feed
+            _, note_id, kind, origin, meta = cmd
+            self.versions[note_id] = self.versions.get(note_id, 0) + 1
+            change_feed.dispatch(("note_changed", note_id, kind, self.versions[note_id], origin, meta))
+            return
+        if self.session.handle(cmd):
+            return
+        target = parse_command(cmd)
+        if target is not None:
+            self.open(*target)
+
+    def _restore_batch(self, entries):
+        """同一个事件循环中逐批创建窗口，批之间让出事件循环，先创建的窗口可以先显示"""
+        import session
+        batch, rest = entries[:session.SESSION_RESTORE_BATCH], entries[session.SESSION_RESTORE_BATCH:]
+        for note_id, state in batch:
+            x, y = session.geometry_xy(state.get("geometry"))
+            self.open(note_id, x, y, state)
+        if rest:
+            self.root.after(session.SESSION_RESTORE_STAGGER_MS, self._restore_batch, rest)
+
+    def run(self, first_command=None, listener=None):
+        """first_command 为 None 时恢复上次打开的窗口（没有则新建一个便笺）"""
+        server = None
+        if listener is not None:
+            server = single_instance.InstanceServer(listener, self.command_queue)
+        self.command_queue.poll()
+        self.session, entries = load_session()
+        if entries:
+            self.session.begin_restore(note_id for note_id, _state in entries)
+            self._restore_batch(entries)
+        if first_command is not None:
+            self.handle(first_command)
+        elif not entries:
+            self.handle(("new_with_xy",) + FIRST_NOTE_XY)
+        self.root.mainloop()
+        if server is not None:
+            server.close()
+        self.stats.report()
+        self.root.destroy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI Note 便笺")
+    parser.add_argument("--new", action="store_true",
+                        help="新建一个便笺（已有 AI Note 在运行时交给它打开）")
+    parser.add_argument("--open", metavar="NOTE_ID",
+                        help="打开指定的便笺（已有 AI Note 在运行时交给它打开）")
+    parser.add_argument("--single-process", action="store_true",
+                        help="所有便笺在同一进程中以 Toplevel 窗口运行（也可设置 NOTE_WINDOW_MODE=toplevel）")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="预热的便笺进程数，0 表示不预热（默认取 .env 中的 NOTE_POOL_SIZE）")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="测量启动：列出各模块的导入耗时和便笺窗口首次绘制的时间后退出")
+    parser.add_argument("--profile-output", metavar="FILE",
+                        help="与 --profile-startup 一起使用，把测量结果写入 JSON 文件")
+    args = parser.parse_args()
+    if args.profile_startup:
+        import startup_profile
+        startup_profile.run_profile(note_id=args.open, output=args.profile_output)
+        return
+    if args.open:
+        first_command = ("open_with_xy", args.open) + FIRST_NOTE_XY
+    elif args.new:
+        first_command = ("new_with_xy",) + FIRST_NOTE_XY
+    else:
+        # 不带参数启动：作为主进程时恢复上次打开的窗口，已有主进程时新建一个便笺
+        first_command = None
+
+    # 同一数据目录只运行一个主进程：已有主进程时转发命令后退出
+    try:
+        listener = single_instance.claim_or_forward(first_command or ("new_with_xy",) + FIRST_NOTE_XY)
+    except (TimeoutError, ConnectionError) as e:
+        print(f"AI Note 主进程已在运行但没有响应，未启动新的主进程：{e}")
+        sys.exit(1)
+    if listener is None:
+        print("AI Note 已在运行，命令已转发")
+        return
+
+    import Note  # 加载 .env，下面的窗口模式与存储后端依赖它
+    prepare_data()
+    # 窗口模式：process（默认，每个便笺一个进程）或 toplevel（所有便笺在同一进程中作为 Toplevel 窗口）
+    window_mode = os.getenv("NOTE_WINDOW_MODE", "process").strip().lower()
+    if args.single_process or window_mode == "toplevel":
+        ToplevelHost().run(first_command, listener)
+    else:
+        Supervisor(args.pool_size).run(first_command, listener)
+
 
 if __name__ == "__main__":
     multiprocessing.freeze_support()
@@ -1,196 +1,162 @@
-import tkinter as tk
-import json
-import os
-import re
 from tkinter import messagebox
-
-SAVE_FILE = "sticky_notes.json"
+import change_feed
+import image_gc
+import image_store
+import revisions
+import rich_text
+import search_index
+from note_storage import get_store
 
 class NoteManager:
     def __init__(self, app):
         self.app = app
+        # 主进程启动时已经迁移过，这里通常只检查一次标记文件
+        image_store.ensure_migrated()
+        image_gc.ensure_sweeper()
 
     @staticmethod
     def load_notes_list():
-        """读取所有便笺的 JSON 文件"""
-        if os.path.exists(SAVE_FILE):
-            try:
-                with open(SAVE_FILE, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    if isinstance(data, dict):
-                        return data
-            except (json.JSONDecodeError, TypeError) as e:
-                print(f"⚠️ JSON 文件损坏，自动重置：{e}")
-                return {}
-        return {}
+        """读取所有便笺（分片存储，旧版 sticky_notes.json 会在首次访问时自动迁移）"""
+        return get_store().load_all()
+
+    @staticmethod
+    def list_meta():
+        """只读取便笺列表所需的元数据（名称、更新时间、大小、首行），不加载正文"""
+        return get_store().list_meta()
+
+    @staticmethod
+    def cache_stats():
+        """返回进程内便笺缓存的命中/未命中/失效计数"""
+        return get_store().stats()
+
+    @staticmethod
+    def get_note(note_id):
+        """只读取单个便笺"""
+        return get_store().load(str(note_id))
+
+    @staticmethod
+    def rename_note(note_id, new_name):
+        """只重写被重命名的便笺，并更新它在搜索索引中的名称"""
+        ok = get_store().rename(str(note_id), new_name)
+        if ok:
+            note = get_store().load(str(note_id)) or {}
+            search_index.get_index().update_note(note_id, note.get("text", ""), new_name)
+            change_feed.publish(note_id, change_feed.RENAMED, note)
+        return ok
+
+    @staticmethod
+    def remove_note(note_id):
+        """删除单个便笺，并释放它引用的图片"""
+        get_store().delete(str(note_id))
+        image_gc.drop_note_refs(note_id)
+        search_index.get_index().remove_note(note_id)
+        revisions.delete_revisions(note_id)
+        change_feed.publish(note_id, change_feed.DELETED)
 
     @staticmethod
     def cleanup_unused_images():
         """
-        遍历所有便笺，收集其中的 [[IMG:...]] 路径，与 sticky_notes_images 文件夹下的文件对比，
-        如果有文件不在引用列表中，则删除它。
+        全量标记-清除：重新扫描所有便笺中的 [[IMG:...]] 并删除 sticky_notes_images 下未被引用的图片。
+        这是维护命令（也可运行 python image_gc.py），日常保存/删除只做增量的引用计数更新。
         """
-        from Note import IMAGE_FOLDER
-        data = NoteManager.load_notes_list()
-        all_references = set()
-
-        pattern = re.compile(r"\[\[IMG:(.*?)\]\]")
-        for note_id, note_info in data.items():
-            text = note_info.get("text", "")
-            matches = pattern.findall(text)
-            for m in matches:
-                possible_abs = os.path.abspath(m)
-                if os.path.exists(possible_abs):
-                    all_references.add(os.path.abspath(possible_abs))
-                else:
-                    alt_path = os.path.abspath(os.path.join(IMAGE_FOLDER, m))
-                    if os.path.exists(alt_path):
-                        all_references.add(alt_path)
-
-        if os.path.exists(IMAGE_FOLDER) and os.path.isdir(IMAGE_FOLDER):
-            for f in os.listdir(IMAGE_FOLDER):
-                full_path = os.path.abspath(os.path.join(IMAGE_FOLDER, f))
-                if full_path not in all_references:
-                    try:
-                        os.remove(full_path)
-                        print(f"已删除未被引用的图片: {full_path}")
-                    except Exception as e:
-                        print(f"删除图片失败: {full_path}，原因: {e}")
+        image_gc.full_sweep()
 
     def save_note(self):
+        """同步保存：采集快照后立即写盘（自动保存引擎则把写盘放到后台线程）"""
+        snapshot = self.snapshot()
+        if snapshot is not None:
+            self.write_snapshot(snapshot)
+
+    def snapshot(self):
         """
-        1) 获取纯文本（含 [[IMG:...]]）和所有标签区间（bold, italic, bold_italic, underline）
-        2) 存入 JSON
-        3) cleanup_unused_images
+        在 UI 线程中采集当前便笺的内容，返回 (note_id, note) 或 None：
+        1) 一次遍历组件，同时获取纯文本（含 [[IMG:...]]）和所有标签区间（差分编码）
+        2) 同时记录 is_pinned, header_bg, text_bg, text_fg
+        这里只读取 Tk 组件，不做任何磁盘 I/O。
         """
-        widget = self.app.text_widget
-        content = widget.get("1.0", tk.END).rstrip("\n")
+        content, tag_info = rich_text.serialize(self.app.text_widget)
 
         # 如果文本全空，就不保存
         if not content.strip():
-            return
-
-        data = self.load_notes_list()
-        if not isinstance(data, dict):
-            data = {}
-
-        note_id_str = str(self.app.note_id)
-        existing = data.get(note_id_str, {})
-        name = existing.get("name", None)
+            return None
 
-        # 提取所有标签区间，包括下划线
-        tag_info = {
-            "bold": self._get_tag_ranges(widget, "bold"),
-            "italic": self._get_tag_ranges(widget, "italic"),
-            "bold_italic": self._get_tag_ranges(widget, "bold_italic"),
-            "underline": self._get_tag_ranges(widget, "underline"),
-            "strikethrough": self._get_tag_ranges(widget, "strikethrough")
-
-        }
-
-        # 同时保存 is_pinned, text_bg, text_fg
-        data[note_id_str] = {
+        note = {
             "text": content,
             "header_bg": self.app.header_bg,
             "is_pinned": self.app.is_pinned,
             "text_bg": self.app.text_bg,
             "text_fg": self.app.text_fg,
-            "tag_info": tag_info
+            "tag_info": tag_info,
+            "tag_format": rich_text.TAG_FORMAT
         }
+        return str(self.app.note_id), note
+
+    @staticmethod
+    def write_snapshot(snapshot):
+        """
+        把 snapshot() 的结果写入存储（可在工作线程中调用）：
+        1) 保留已有的便笺名称后只写入该便笺自身
+        2) 根据新旧图片引用的差异增量更新引用计数
+        3) 重新索引这一条便笺的全文
+        4) 追加一个历史版本（只存与上一版本的差异）
+        """
+        note_id_str, note = snapshot
+        existing = NoteManager.get_note(note_id_str) or {}
+        name = existing.get("name", None)
         if name is not None:
-            data[note_id_str]["name"] = name
+            note["name"] = name
 
-        with open(SAVE_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        get_store().save(note_id_str, note)
 
-        self.cleanup_unused_images()
+        image_gc.update_note_refs(note_id_str, note["text"])
+        search_index.get_index().update_note(note_id_str, note["text"], name)
+        revisions.record_revision(note_id_str, note)
+        # 通知其他便笺进程（主进程广播），它们只更新这一条便笺的缓存
+        change_feed.publish(note_id_str, change_feed.SAVED, note)
 
     def load_note(self):
         """
         1) 加载纯文本并插入（这会还原图片位置）
-        2) 若有 tag_info，则重新给相应区间加上 bold/italic/bold_italic/underline
+        2) 插入的同时带上 tag_info 中的 bold/italic/bold_italic/underline/strikethrough
         3) 恢复 header_bg, is_pinned, text_bg, text_fg 并刷新 UI
         """
-        data = self.load_notes_list()
-        if self.app.note_id in data:
-            note = data[self.app.note_id]
-            # 1) 纯文本 + 图片
-            self.app.load_content(note.get("text", ""))
+        note = self.get_note(self.app.note_id)
+        if note is not None:
+            self.apply_note(note)
 
-            # 2) 恢复标签
-            tag_info = note.get("tag_info", {})
-            self._apply_tag_info(self.app.text_widget, tag_info)
+    def apply_note(self, note):
+        """把便笺 dict（当前版本或某个历史版本）的内容和外观应用到窗口"""
+        # 1) + 2) 纯文本、图片与标签一次性插入
+        self.app.load_content(note.get("text", ""), rich_text.decode_tag_info(note))
 
-            # 3) 恢复外观
-            self.app.header_bg = note.get("header_bg", self.app.header_bg)
-            self.app.is_pinned = note.get("is_pinned", self.app.is_pinned)
-            self.app.text_bg   = note.get("text_bg", self.app.text_bg)
-            self.app.text_fg   = note.get("text_fg", self.app.text_fg)
+        # 3) 恢复外观
+        self.app.header_bg = note.get("header_bg", self.app.header_bg)
+        self.app.is_pinned = note.get("is_pinned", self.app.is_pinned)
+        self.app.text_bg   = note.get("text_bg", self.app.text_bg)
+        self.app.text_fg   = note.get("text_fg", self.app.text_fg)
 
-            # 应用标题栏颜色
-            self.app.header.config(bg=self.app.header_bg)
-            if hasattr(self.app, "_refresh_header_buttons"):
-                self.app._refresh_header_buttons()
+        # 应用标题栏颜色
+        self.app.header.config(bg=self.app.header_bg)
+        if hasattr(self.app, "_refresh_header_buttons"):
+            self.app._refresh_header_buttons()
 
-            if hasattr(self.app, "_ensure_topmost_state"):
-                self.app._ensure_topmost_state()
+        if hasattr(self.app, "_ensure_topmost_state"):
+            self.app._ensure_topmost_state()
 
-            self.app.text_widget.config(bg=self.app.text_bg, fg=self.app.text_fg,
-                                        insertbackground=self.app.text_fg)
+        self.app.text_widget.config(bg=self.app.text_bg, fg=self.app.text_fg,
+                                    insertbackground=self.app.text_fg)
 
     def delete_note(self):
-        """删除当前便笺后，调用 cleanup_unused_images 清理不再使用的图片。"""
+        """删除当前便笺，并释放它引用的图片（由后台线程在宽限期后删除文件）。"""
         if messagebox.askyesno("删除便笺", "确定删除此便笺吗？"):
-            data = self.load_notes_list()
-            if self.app.note_id in data:
-                del data[self.app.note_id]
-                with open(SAVE_FILE, "w", encoding="utf-8") as f:
-                    json.dump(data, f, indent=4, ensure_ascii=False)
+            # 先停掉自动保存，避免后台线程在删除后又把便笺写回去
+            if hasattr(self.app, "autosaver"):
+                self.app.autosaver.cancel()
+            get_store().delete(str(self.app.note_id))
+            if hasattr(self.app, "report_window_closed"):
+                self.app.report_window_closed()
             self.app.root.destroy()
-            self.cleanup_unused_images()
-
-    # ------------------ 以下是提取和还原标签的辅助函数 ------------------
-    def _get_tag_ranges(self, widget, tag_name):
-        """
-        提取 tag_name 在 widget 中的所有区间，
-        返回 [ [start_offset, end_offset], ... ]；使用字符偏移计数
-        """
-        result = []
-        ranges = widget.tag_ranges(tag_name)
-        for i in range(0, len(ranges), 2):
-            start_i = ranges[i]
-            end_i = ranges[i + 1]
-            try:
-                valid_start = widget.index(start_i)
-                valid_end = widget.index(end_i)
-            except tk.TclError:
-                continue
-            if not valid_start or not valid_end:
-                continue
-            start_vals = widget.count("1.0", valid_start, "chars")
-            end_vals = widget.count("1.0", valid_end, "chars")
-            if not start_vals or not end_vals:
-                continue
-            start_off = start_vals[0]
-            end_off = end_vals[0]
-            if end_off > start_off:
-                result.append([start_off, end_off])
-        return result
-
-    def _apply_tag_info(self, widget, tag_info):
-        """
-        根据保存的 tag_info 恢复所有标签
-        tag_info 结构示例:
-        {
-          "bold": [ [start_off, end_off], ... ],
-          "italic": [ ... ],
-          "bold_italic": [ ... ],
-          "underline": [ ... ]
-        }
-        """
-        for tag_name, ranges_list in tag_info.items():
-            for (start_off, end_off) in ranges_list:
-                if end_off > start_off:
-                    start_idx = widget.index(f"1.0+{start_off}c")
-                    end_idx   = widget.index(f"1.0+{end_off}c")
-                    widget.tag_add(tag_name, start_idx, end_idx)
+            image_gc.drop_note_refs(self.app.note_id)
+            search_index.get_index().remove_note(self.app.note_id)
+            revisions.delete_revisions(self.app.note_id)
+            change_feed.publish(self.app.note_id, change_feed.DELETED)
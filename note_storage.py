@@ -0,0 +1,1123 @@
+import ctypes
+import json
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from urllib.parse import quote
+
+LEGACY_SAVE_FILE = "sticky_notes.json"
+NOTES_DIR = "sticky_notes"
+SQLITE_FILE = "sticky_notes.db"
+SNAPSHOT_FILE = "sticky_notes.snapshot.json"
+JOURNAL_FILE = "sticky_notes.journal"
+# 日志超过该大小（字节）后在后台压缩进快照
+JOURNAL_COMPACT_THRESHOLD = 1024 * 1024
+# 分片存储的清单变更日志超过清单本身的大小（且至少为该字节数）时合并回清单
+MANIFEST_LOG_COMPACT_MIN = 64 * 1024
+
+# 存储后端，可在 .env 中通过 NOTE_STORAGE 设置：sharded（默认）/ sqlite / journal
+DEFAULT_BACKEND = "sharded"
+
+
+class FileLock:
+    """
+    基于锁文件的跨进程互斥锁（Windows 使用 msvcrt，其余平台使用 fcntl）。
+    每个便笺运行在独立进程中，所有"读-改-写"共享文件的操作都应在此锁内完成。
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+
+    def __enter__(self):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        self._fh = open(self.path, "a+b")
+        if os.name == "nt":
+            import msvcrt
+            self._fh.seek(0)
+            while True:
+                try:
+                    # LK_LOCK 最多重试 10 次后抛出 OSError，继续等待即可
+                    msvcrt.locking(self._fh.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if os.name == "nt":
+                import msvcrt
+                self._fh.seek(0)
+                msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._fh.close()
+            self._fh = None
+        return False
+
+
+class WriteLock(FileLock):
+    """
+    后端写入用的跨进程锁：加锁后、写入前调用 store.observer.before_write()，
+    写入完成、释放锁前调用 store.observer.after_write()。
+    持锁期间其他进程无法写入，观察者（进程内缓存）据此区分本进程自己的写入与其他进程的写入。
+    """
+    def __init__(self, store):
+        super().__init__(store.lock_file)
+        self.store = store
+
+    def __enter__(self):
+        super().__enter__()
+        if self.store.observer is not None:
+            try:
+                self.store.observer.before_write()
+            except BaseException:
+                super().__exit__(None, None, None)
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None and self.store.observer is not None:
+                self.store.observer.after_write()
+        finally:
+            super().__exit__(exc_type, exc, tb)
+        return False
+
+
+def atomic_write_json(path, data, indent=None):
+    """先写临时文件再 os.replace，保证读者永远看不到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_json(path, default=None):
+    """读取 JSON 文件，文件不存在或损坏时返回 default"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (json.JSONDecodeError, TypeError, UnicodeDecodeError) as e:
+        print(f"⚠️ JSON 文件损坏，已跳过：{path}，原因：{e}")
+        return default
+
+
+IMG_MARKER = re.compile(r"\[\[IMG:.*?\]\]")
+FIRST_LINE_LIMIT = 80
+
+
+def first_line(text):
+    """便笺正文的第一行非空文字（去掉图片标记），用于列表中的预览"""
+    for line in IMG_MARKER.sub("", text or "").splitlines():
+        line = line.strip()
+        if line:
+            return line[:FIRST_LINE_LIMIT]
+    return ""
+
+
+def note_meta(note, updated=None):
+    """便笺的轻量元数据：名称、更新时间、大小与首行，不含正文"""
+    text = note.get("text", "")
+    return {
+        "name": note.get("name"),
+        "updated": time.time() if updated is None else updated,
+        "size": len(text),
+        "first_line": first_line(text),
+    }
+
+
+class NoteStore:
+    """
+    便笺存储后端的基类。所有后端都以 note_id -> 便笺 dict 的形式读写，
+    便笺 dict 的结构与旧版 sticky_notes.json 中的单个条目一致。
+    写入都在 WriteLock 内完成，observer（若有）会在每次写入前后收到通知。
+    """
+    observer = None
+
+    def list_ids(self):
+        raise NotImplementedError
+
+    def load_all(self):
+        """读取全部便笺，返回与旧版 sticky_notes.json 相同结构的 dict"""
+        data = {}
+        for note_id in self.list_ids():
+            note = self.load(note_id)
+            if note is not None:
+                data[note_id] = note
+        return data
+
+    def load(self, note_id):
+        raise NotImplementedError
+
+    def save(self, note_id, note):
+        raise NotImplementedError
+
+    def save_many(self, notes):
+        """批量保存 {note_id: 便笺}（迁移等一次改写很多便笺的场景），各后端应合并为一次提交"""
+        for note_id, note in notes.items():
+            self.save(note_id, note)
+
+    def rename(self, note_id, new_name):
+        raise NotImplementedError
+
+    def delete(self, note_id):
+        raise NotImplementedError
+
+    def list_meta(self):
+        """
+        返回 {note_id: {"name", "updated", "size", "first_line"}}。
+        基类实现需要读取全部便笺，各后端应尽量从清单/索引列直接给出。
+        """
+        return {note_id: note_meta(note, updated=0) for note_id, note in self.load_all().items()}
+
+    def watched_files(self):
+        """其他进程写入时会发生变化的文件，供缓存判断是否失效"""
+        return []
+
+    def close(self):
+        pass
+
+
+def read_legacy_notes():
+    """读取旧版 sticky_notes.json，供各后端首次初始化时迁移"""
+    legacy = read_json(LEGACY_SAVE_FILE, default={})
+    if not isinstance(legacy, dict):
+        return {}
+    return {note_id: note for note_id, note in legacy.items() if isinstance(note, dict)}
+
+
+def load_existing_notes():
+    """新后端首次初始化时的数据来源：优先使用已有的分片存储，其次是旧版 sticky_notes.json"""
+    if os.path.exists(os.path.join(NOTES_DIR, "manifest.json")):
+        return ShardedNoteStore(NOTES_DIR).load_all()
+    return read_legacy_notes()
+
+
+def retire_legacy_file(count):
+    if os.path.exists(LEGACY_SAVE_FILE):
+        os.replace(LEGACY_SAVE_FILE, LEGACY_SAVE_FILE + ".migrated")
+        print(f"已将 {LEGACY_SAVE_FILE} 迁移到新存储，共 {count} 个便笺")
+
+
+class ShardedNoteStore(NoteStore):
+    """
+    每个便笺一个文件的存储布局：
+        sticky_notes/
+            manifest.json          # {note_id: {"name", "updated", "size", "first_line"}}
+            manifest.log           # 清单的变更记录，每行一条 {"id", "meta"} 或 {"id", "deleted"}
+            <note_id>.json         # 单个便笺的完整内容
+    保存或删除一个便笺只会重写该便笺自身的文件，并在变更记录末尾追加一行，
+    与便笺总数无关；读取清单时把变更记录重放到 manifest.json 上，
+    变更记录比清单本身还大时在锁内合并回 manifest.json。
+    """
+    def __init__(self, root=NOTES_DIR):
+        self.root = root
+        self.manifest_file = os.path.join(root, "manifest.json")
+        self.manifest_log = os.path.join(root, "manifest.log")
+        self.lock_file = os.path.join(root, ".lock")
+        self._ensure_ready()
+
+    # ------------------ 初始化与迁移 ------------------
+    def _ensure_ready(self):
+        if os.path.exists(self.manifest_file):
+            return
+        with FileLock(self.lock_file):
+            # 其他进程可能已经在我们等锁时完成了迁移
+            if os.path.exists(self.manifest_file):
+                return
+            self._migrate_legacy_file()
+
+    def _migrate_legacy_file(self):
+        """把旧版 sticky_notes.json 拆分成每个便笺一个文件，完成后将旧文件改名保留"""
+        manifest = {}
+        for note_id, note in read_legacy_notes().items():
+            self._write_note_file(note_id, note)
+            manifest[note_id] = self._manifest_entry(note)
+        atomic_write_json(self.manifest_file, manifest)
+        retire_legacy_file(len(manifest))
+
+    # ------------------ 内部工具 ------------------
+    def _note_path(self, note_id):
+        return os.path.join(self.root, quote(str(note_id), safe="") + ".json")
+
+    def _write_note_file(self, note_id, note):
+        atomic_write_json(self._note_path(note_id), note, indent=4)
+
+    @staticmethod
+    def _manifest_entry(note):
+        entry = note_meta(note)
+        if entry["name"] is None:
+            del entry["name"]
+        return entry
+
+    def _read_manifest(self):
+        manifest = read_json(self.manifest_file, default={})
+        if not isinstance(manifest, dict):
+            manifest = {}
+        try:
+            with open(self.manifest_log, "rb") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return manifest
+        for line in lines:
+            try:
+                record = json.loads(line)
+                note_id = record["id"]
+            except (ValueError, KeyError, TypeError):
+                # 写入时进程被中断留下的半行
+                continue
+            if record.get("deleted"):
+                manifest.pop(note_id, None)
+            else:
+                manifest[note_id] = record.get("meta", {})
+        return manifest
+
+    def _log_manifest_change(self, note_id, entry=None):
+        """在变更记录末尾追加一行（entry 为 None 表示删除），必要时合并回清单；调用方持有文件锁"""
+        record = {"id": note_id, "meta": entry} if entry is not None else {"id": note_id, "deleted": True}
+        line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+        with open(self.manifest_log, "a+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # 上一次追加没写完，另起一行
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            log_size = f.tell()
+        try:
+            manifest_size = os.path.getsize(self.manifest_file)
+        except OSError:
+            manifest_size = 0
+        if log_size > max(manifest_size, MANIFEST_LOG_COMPACT_MIN):
+            self._compact_manifest()
+
+    def _compact_manifest(self):
+        """把变更记录合并进 manifest.json 后清空记录；调用方持有文件锁。中途退出时重放记录结果不变"""
+        atomic_write_json(self.manifest_file, self._read_manifest())
+        with open(self.manifest_log, "wb"):
+            pass
+
+    # ------------------ 对外接口 ------------------
+    def watched_files(self):
+        # 每次保存/重命名/删除都会追加变更记录，合并时原子替换清单文件
+        return [self.manifest_file, self.manifest_log]
+
+    def list_ids(self):
+        return list(self._read_manifest().keys())
+
+    def list_meta(self):
+        meta = {}
+        for note_id, entry in self._read_manifest().items():
+            meta[note_id] = {
+                "name": entry.get("name"),
+                "updated": entry.get("updated", 0),
+                "size": entry.get("size", 0),
+                "first_line": entry.get("first_line", ""),
+            }
+        return meta
+
+    def load(self, note_id):
+        note = read_json(self._note_path(note_id), default=None)
+        return note if isinstance(note, dict) else None
+
+    def save(self, note_id, note):
+        note_id = str(note_id)
+        with WriteLock(self):
+            self._write_note_file(note_id, note)
+            self._log_manifest_change(note_id, self._manifest_entry(note))
+
+    def save_many(self, notes):
+        """逐个写便笺文件，清单只重写一次（顺带合并掉变更记录）"""
+        if not notes:
+            return
+        with WriteLock(self):
+            manifest = self._read_manifest()
+            for note_id, note in notes.items():
+                self._write_note_file(str(note_id), note)
+                manifest[str(note_id)] = self._manifest_entry(note)
+            atomic_write_json(self.manifest_file, manifest)
+            with open(self.manifest_log, "wb"):
+                pass
+
+    def rename(self, note_id, new_name):
+        note_id = str(note_id)
+        with WriteLock(self):
+            note = self.load(note_id)
+            if note is None:
+                return False
+            note["name"] = new_name
+            self._write_note_file(note_id, note)
+            self._log_manifest_change(note_id, self._manifest_entry(note))
+        return True
+
+    def delete(self, note_id):
+        note_id = str(note_id)
+        with WriteLock(self):
+            try:
+                os.remove(self._note_path(note_id))
+            except FileNotFoundError:
+                pass
+            self._log_manifest_change(note_id)
+
+
+class SQLiteNoteStore(NoteStore):
+    """
+    SQLite（WAL 模式）存储后端：
+    - 每个便笺一行，按主键做单行 upsert，不再整体重写；
+    - WAL 允许一个进程写入的同时其他便笺进程并发读取；
+    - 写冲突由 SQLite 自身的锁与 busy_timeout 串行化，跨进程不会丢失更新。
+    每个线程使用独立连接（sqlite3 连接不能跨线程共享）。
+    没有独立列的字段（例如 tag_format）以 JSON 存在 extra 列中，读出时原样还原。
+    """
+    COLUMNS = ("text", "name", "tag_info", "header_bg", "is_pinned", "text_bg", "text_fg", "extra")
+    _FIELDS = {"text", "name", "tag_info", "header_bg", "is_pinned", "text_bg", "text_fg"}
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        # 写入另外加一把文件锁，让 observer 的通知与写事务处于同一临界区
+        self.lock_file = path + ".lock"
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS notes (
+                note_id   TEXT PRIMARY KEY,
+                text      TEXT NOT NULL DEFAULT '',
+                name      TEXT,
+                tag_info  TEXT NOT NULL DEFAULT '{}',
+                header_bg TEXT,
+                is_pinned INTEGER NOT NULL DEFAULT 0,
+                text_bg   TEXT,
+                text_fg   TEXT,
+                updated   REAL NOT NULL,
+                size      INTEGER NOT NULL DEFAULT 0,
+                extra     TEXT NOT NULL DEFAULT '{}'
+            )""")
+        # 旧数据库没有 extra 列
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(notes)")}
+        if "extra" not in columns:
+            conn.execute("ALTER TABLE notes ADD COLUMN extra TEXT NOT NULL DEFAULT '{}'")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_notes_updated ON notes(updated)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migrated = conn.execute("SELECT value FROM meta WHERE key = 'migrated'").fetchone()
+            if migrated is None:
+                count = self._migrate_existing(conn)
+                conn.execute("INSERT INTO meta(key, value) VALUES ('migrated', ?)", (str(count),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _migrate_existing(self, conn):
+        """首次创建数据库时，导入分片存储或旧版 sticky_notes.json 中已有的便笺"""
+        notes = load_existing_notes()
+        for note_id, note in notes.items():
+            self._upsert(conn, note_id, note)
+        if notes:
+            print(f"已导入 {len(notes)} 个便笺到 {self.path}")
+        retire_legacy_file(len(notes))
+        return len(notes)
+
+    @classmethod
+    def _upsert(cls, conn, note_id, note):
+        text = note.get("text", "")
+        extra = {key: value for key, value in note.items() if key not in cls._FIELDS}
+        conn.execute("""
+            INSERT INTO notes (note_id, text, name, tag_info, header_bg, is_pinned,
+                               text_bg, text_fg, updated, size, extra)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(note_id) DO UPDATE SET
+                text = excluded.text, name = excluded.name, tag_info = excluded.tag_info,
+                header_bg = excluded.header_bg, is_pinned = excluded.is_pinned,
+                text_bg = excluded.text_bg, text_fg = excluded.text_fg,
+                updated = excluded.updated, size = excluded.size, extra = excluded.extra
+        """, (str(note_id), text, note.get("name"),
+              json.dumps(note.get("tag_info", {}), ensure_ascii=False),
+              note.get("header_bg"), 1 if note.get("is_pinned") else 0,
+              note.get("text_bg"), note.get("text_fg"), time.time(), len(text),
+              json.dumps(extra, ensure_ascii=False)))
+
+    @classmethod
+    def _row_to_note(cls, row):
+        text, name, tag_info, header_bg, is_pinned, text_bg, text_fg, extra = row
+        extra = json.loads(extra or "{}")
+        tag_info = json.loads(tag_info or "{}")
+        if "tag_format" not in extra and any(
+                values and not isinstance(values[0], list) for values in tag_info.values()):
+            # 加 extra 列之前写入的行丢了 tag_format；区间是扁平整数列表说明是差分编码（格式 2）
+            extra["tag_format"] = 2
+        note = {
+            "text": text,
+            "header_bg": header_bg,
+            "is_pinned": bool(is_pinned),
+            "text_bg": text_bg,
+            "text_fg": text_fg,
+            "tag_info": tag_info,
+        }
+        # 与 JSON 存储保持一致：未设置的外观字段不出现在 dict 中，由调用方使用默认值
+        note = {k: v for k, v in note.items() if v is not None}
+        if name is not None:
+            note["name"] = name
+        for key, value in extra.items():
+            note.setdefault(key, value)
+        return note
+
+    def watched_files(self):
+        # WAL 模式下提交写入的是 -wal 文件，检查点之后才回写主库文件
+        return [self.path, self.path + "-wal"]
+
+    def list_ids(self):
+        return [row[0] for row in self._conn().execute("SELECT note_id FROM notes")]
+
+    def list_meta(self):
+        rows = self._conn().execute(
+            f"SELECT note_id, name, updated, size, substr(text, 1, {FIRST_LINE_LIMIT * 4}) FROM notes")
+        return {row[0]: {"name": row[1], "updated": row[2], "size": row[3],
+                         "first_line": first_line(row[4])}
+                for row in rows}
+
+    def load_all(self):
+        columns = ", ".join(self.COLUMNS)
+        rows = self._conn().execute(f"SELECT note_id, {columns} FROM notes")
+        return {row[0]: self._row_to_note(row[1:]) for row in rows}
+
+    def load(self, note_id):
+        columns = ", ".join(self.COLUMNS)
+        row = self._conn().execute(f"SELECT {columns} FROM notes WHERE note_id = ?",
+                                   (str(note_id),)).fetchone()
+        return self._row_to_note(row) if row else None
+
+    def save(self, note_id, note):
+        with WriteLock(self):
+            self._upsert(self._conn(), note_id, note)
+
+    def save_many(self, notes):
+        conn = self._conn()
+        with WriteLock(self):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for note_id, note in notes.items():
+                    self._upsert(conn, note_id, note)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def rename(self, note_id, new_name):
+        with WriteLock(self):
+            cur = self._conn().execute("UPDATE notes SET name = ?, updated = ? WHERE note_id = ?",
+                                       (new_name, time.time(), str(note_id)))
+        return cur.rowcount > 0
+
+    def delete(self, note_id):
+        with WriteLock(self):
+            self._conn().execute("DELETE FROM notes WHERE note_id = ?", (str(note_id),))
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class JournalNoteStore(NoteStore):
+    """
+    追加式变更日志存储：
+        sticky_notes.snapshot.json   # 最近一次压缩得到的完整快照
+        sticky_notes.journal         # 快照之后的 save / rename / delete 记录，每行一条
+    每条记录的格式为 "<crc32>\t<json>\n"。写入只追加一条小记录（O(变更大小)），
+    读取时在快照上重放日志；崩溃导致的残缺记录校验失败会被跳过，而不是清空整个存储。
+    日志超过 JOURNAL_COMPACT_THRESHOLD 后，由后台线程把它压缩进新快照。
+    读取单个便笺（以及重命名前确认便笺存在）不重放整个日志：进程内维护
+    便笺 ID -> 其最后一次 save/delete 之后各条记录偏移的索引，每次只增量扫描新追加的部分，
+    快照解析结果按文件标记缓存，压缩（快照被替换）后索引重建。
+    """
+    def __init__(self, snapshot_file=SNAPSHOT_FILE, journal_file=JOURNAL_FILE,
+                 compact_threshold=JOURNAL_COMPACT_THRESHOLD):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.lock_file = journal_file + ".lock"
+        self.compact_threshold = compact_threshold
+        self._compacting = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._snapshot_cache = (None, {})   # (快照文件标记, 解析结果)
+        self._offsets = {}                  # note_id -> [记录偏移]
+        self._scanned = 0                   # 日志中已编入索引的字节数
+        self._ensure_ready()
+
+    # ------------------ 初始化与迁移 ------------------
+    def _ensure_ready(self):
+        if os.path.exists(self.snapshot_file) or os.path.exists(self.journal_file):
+            return
+        with FileLock(self.lock_file):
+            if os.path.exists(self.snapshot_file) or os.path.exists(self.journal_file):
+                return
+            notes = load_existing_notes()
+            atomic_write_json(self.snapshot_file, notes)
+            retire_legacy_file(len(notes))
+
+    # ------------------ 记录编解码 ------------------
+    @staticmethod
+    def _encode(record):
+        payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return b"%08x\t" % zlib.crc32(payload) + payload + b"\n"
+
+    @staticmethod
+    def _decode(line):
+        """校验失败（例如写到一半时崩溃留下的残缺记录）返回 None"""
+        if not line.endswith(b"\n"):
+            return None
+        crc, sep, payload = line.rstrip(b"\n").partition(b"\t")
+        if not sep:
+            return None
+        try:
+            if int(crc, 16) != zlib.crc32(payload):
+                return None
+            return json.loads(payload.decode("utf-8"))
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    @staticmethod
+    def _apply(data, record):
+        op = record.get("op")
+        note_id = record.get("id")
+        if op == "save":
+            data[note_id] = record.get("note", {})
+        elif op == "rename":
+            if note_id in data:
+                data[note_id]["name"] = record.get("name")
+        elif op == "delete":
+            data.pop(note_id, None)
+
+    # ------------------ 读写 ------------------
+    def _read_snapshot(self):
+        try:
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            # 保留损坏的快照以便人工恢复，绝不直接覆盖
+            backup = f"{self.snapshot_file}.corrupt-{int(time.time())}"
+            os.replace(self.snapshot_file, backup)
+            print(f"⚠️ 快照文件损坏，已另存为 {backup}，仅从日志恢复：{e}")
+            return {}
+
+    def _replay(self, updated=None):
+        """在快照上重放日志；传入 updated 时顺便记录每个便笺最后一条记录的时间"""
+        data = self._read_snapshot()
+        skipped = 0
+        try:
+            with open(self.journal_file, "rb") as f:
+                for line in f:
+                    record = self._decode(line)
+                    if record is None:
+                        skipped += 1
+                        continue
+                    self._apply(data, record)
+                    if updated is not None:
+                        updated[record.get("id")] = record.get("ts", 0)
+        except FileNotFoundError:
+            pass
+        if skipped:
+            print(f"⚠️ 日志中有 {skipped} 条残缺记录，已跳过")
+        return data
+
+    def _append(self, record):
+        self._append_many([record])
+
+    def _append_many(self, records):
+        """一次加锁、一次 fsync 追加多条记录"""
+        now = time.time()
+        for record in records:
+            record["ts"] = now
+        line = b"".join(self._encode(record) for record in records)
+        with WriteLock(self):
+            with open(self.journal_file, "a+b") as f:
+                # 上一条记录若因崩溃没有写完，先补一个换行，避免新记录与残缺记录粘在一起
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+        if size >= self.compact_threshold:
+            self.compact_in_background()
+
+    def compact(self):
+        """把日志合并进新快照，再清空日志。两步之间崩溃也只会让日志被重复重放（幂等）"""
+        with FileLock(self.lock_file):
+            data = self._replay()
+            atomic_write_json(self.snapshot_file, data)
+            with open(self.journal_file, "wb") as f:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def compact_in_background(self):
+        if not self._compacting.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"日志压缩失败：{e}")
+            finally:
+                self._compacting.release()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # ------------------ 对外接口 ------------------
+    def watched_files(self):
+        return [self.snapshot_file, self.journal_file]
+
+    def list_ids(self):
+        return list(self.load_all().keys())
+
+    def load_all(self):
+        with FileLock(self.lock_file):
+            return self._replay()
+
+    def _file_token(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _refresh_index(self):
+        """增量扫描日志新追加的记录；快照被替换或日志变短（已压缩）时从头重建。调用方持有文件锁"""
+        token = self._file_token(self.snapshot_file)
+        if token != self._snapshot_cache[0]:
+            self._snapshot_cache = (token, self._read_snapshot())
+            self._offsets = {}
+            self._scanned = 0
+        try:
+            f = open(self.journal_file, "rb")
+        except FileNotFoundError:
+            self._offsets = {}
+            self._scanned = 0
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size < self._scanned:
+                self._offsets = {}
+                self._scanned = 0
+            f.seek(self._scanned)
+            offset = self._scanned
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 正在写入或崩溃留下的残缺尾部，下次再扫描
+                    break
+                record = self._decode(line)
+                if record is not None:
+                    note_id = record.get("id")
+                    if record.get("op") in ("save", "delete"):
+                        self._offsets[note_id] = [offset]
+                    else:
+                        self._offsets.setdefault(note_id, []).append(offset)
+                offset += len(line)
+            self._scanned = offset
+
+    def load(self, note_id):
+        note_id = str(note_id)
+        with FileLock(self.lock_file), self._index_lock:
+            self._refresh_index()
+            base = self._snapshot_cache[1].get(note_id)
+            data = {note_id: dict(base)} if isinstance(base, dict) else {}
+            offsets = self._offsets.get(note_id, [])
+            if offsets:
+                with open(self.journal_file, "rb") as f:
+                    for offset in offsets:
+                        f.seek(offset)
+                        record = self._decode(f.readline())
+                        if record is not None:
+                            self._apply(data, record)
+        return data.get(note_id)
+
+    def list_meta(self):
+        updated = {}
+        with FileLock(self.lock_file):
+            data = self._replay(updated)
+        # 已压缩进快照的便笺没有单独的时间，用快照文件的修改时间代替
+        try:
+            snapshot_time = os.path.getmtime(self.snapshot_file)
+        except OSError:
+            snapshot_time = 0
+        return {note_id: note_meta(note, updated=updated.get(note_id, snapshot_time))
+                for note_id, note in data.items()}
+
+    def save(self, note_id, note):
+        self._append({"op": "save", "id": str(note_id), "note": note})
+
+    def save_many(self, notes):
+        if notes:
+            self._append_many([{"op": "save", "id": str(note_id), "note": note}
+                               for note_id, note in notes.items()])
+
+    def rename(self, note_id, new_name):
+        if self.load(note_id) is None:
+            return False
+        self._append({"op": "rename", "id": str(note_id), "name": new_name})
+        return True
+
+    def delete(self, note_id):
+        self._append({"op": "delete", "id": str(note_id)})
+
+
+BACKENDS = {
+    "sharded": ShardedNoteStore,
+    "sqlite": SQLiteNoteStore,
+    "journal": JournalNoteStore,
+}
+
+class _InotifyWatcher:
+    """
+    Linux 下用 inotify 监听存储文件所在目录：没有事件时无需 stat 即可确认缓存有效。
+    非 Linux 平台或初始化失败时 available 为 False，由调用方退回到 stat 检查。
+    """
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, paths):
+        self.fd = -1
+        self.names = {os.path.basename(p) for p in paths}
+        if not sys.platform.startswith("linux"):
+            return
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if fd < 0:
+                return
+            mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM |
+                    self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE)
+            for folder in {os.path.dirname(os.path.abspath(p)) for p in paths}:
+                if libc.inotify_add_watch(fd, os.fsencode(folder), mask) < 0:
+                    os.close(fd)
+                    return
+            self.fd = fd
+        except (OSError, AttributeError):
+            self.fd = -1
+
+    @property
+    def available(self):
+        return self.fd >= 0
+
+    def changed(self):
+        """读空事件队列，只要有一个事件涉及被监听的文件就返回 True"""
+        changed = False
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(buf):
+                _, _, _, name_len = self.EVENT_HEADER.unpack_from(buf, offset)
+                offset += self.EVENT_HEADER.size
+                name = os.fsdecode(buf[offset:offset + name_len].rstrip(b"\0"))
+                offset += name_len
+                if name in self.names:
+                    changed = True
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class CachedNoteStore(NoteStore):
+    """
+    进程内的便笺缓存，包装任意存储后端。
+    其他便笺进程写入时，通过 inotify（Linux）或被监听文件的 mtime/size 判断缓存失效；
+    本进程自己的写入直接更新缓存。重复的列表/打开操作不再重新解析整个存储。
+    区分两种写入靠后端在写锁内的通知：写入前先检查一次（此前其他进程的写入使缓存失效），
+    写入后再吸收本次写入产生的事件/文件标记，两步之间其他进程无法写入。
+    缓存中的 dict 由所有调用方共享，只读使用，不要原地修改。
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        backend.observer = self
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.RLock()
+        self._files = backend.watched_files()
+        self._watcher = _InotifyWatcher(self._files)
+        self._token = None
+        self._all = None
+        self._notes = {}
+        self._meta = None
+
+    # ------------------ 失效判断 ------------------
+    def _stat_token(self):
+        token = []
+        for path in self._files:
+            try:
+                st = os.stat(path)
+                token.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            except FileNotFoundError:
+                token.append(None)
+        return tuple(token)
+
+    def _validate(self):
+        """缓存仍然有效返回 True；否则清空缓存"""
+        if self._watcher.available:
+            changed = self._watcher.changed()
+            valid = self._token is not None and not changed
+            token = "inotify"
+        else:
+            token = self._stat_token()
+            valid = token == self._token
+        if not valid:
+            if self._all is not None or self._notes or self._meta is not None:
+                self.invalidations += 1
+            self._all = None
+            self._notes = {}
+            self._meta = None
+            self._token = token
+        return valid
+
+    def before_write(self):
+        """后端已持有写锁、即将写入：先处理此前其他进程的写入"""
+        with self._lock:
+            self._validate()
+
+    def after_write(self):
+        """后端写入完成、尚未释放写锁：此时的事件和文件标记只来自本次写入"""
+        with self._lock:
+            self._after_own_write()
+
+    def _after_own_write(self):
+        """刷新失效标记，避免把自己的写入当成其他进程的修改"""
+        if self._watcher.available:
+            self._watcher.changed()
+        else:
+            self._token = self._stat_token()
+
+    # ------------------ 读 ------------------
+    def load_all(self):
+        with self._lock:
+            self._validate()
+            if self._all is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._all = self.backend.load_all()
+                self._notes = {}
+            return dict(self._all)
+
+    def list_ids(self):
+        return list(self.load_all().keys())
+
+    def load(self, note_id):
+        note_id = str(note_id)
+        with self._lock:
+            self._validate()
+            if self._all is not None:
+                self.hits += 1
+                return self._all.get(note_id)
+            if note_id in self._notes:
+                self.hits += 1
+                return self._notes[note_id]
+            self.misses += 1
+            note = self.backend.load(note_id)
+            self._notes[note_id] = note
+            return note
+
+    def list_meta(self):
+        with self._lock:
+            self._validate()
+            if self._meta is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._meta = self.backend.list_meta()
+            return dict(self._meta)
+
+    # ------------------ 写 ------------------
+    def _update_cached(self, note_id, note):
+        for cache in (self._all, self._notes):
+            if cache is None:
+                continue
+            if note is None:
+                cache.pop(note_id, None)
+            else:
+                cache[note_id] = note
+        if self._meta is not None:
+            if note is None:
+                self._meta.pop(note_id, None)
+            else:
+                self._meta[note_id] = note_meta(note)
+
+    def save(self, note_id, note):
+        note_id = str(note_id)
+        with self._lock:
+            self._validate()
+            self.backend.save(note_id, note)
+            self._update_cached(note_id, note)
+
+    def save_many(self, notes):
+        notes = {str(note_id): note for note_id, note in notes.items()}
+        with self._lock:
+            self._validate()
+            self.backend.save_many(notes)
+            for note_id, note in notes.items():
+                self._update_cached(note_id, note)
+
+    def rename(self, note_id, new_name):
+        note_id = str(note_id)
+        with self._lock:
+            self._validate()
+            ok = self.backend.rename(note_id, new_name)
+            if ok:
+                cache = self._all if self._all is not None else self._notes
+                current = cache.get(note_id)
+                if current is not None:
+                    self._update_cached(note_id, {**current, "name": new_name})
+                elif self._meta is not None and note_id in self._meta:
+                    self._meta[note_id] = {**self._meta[note_id], "name": new_name, "updated": time.time()}
+            return ok
+
+    def delete(self, note_id):
+        note_id = str(note_id)
+        with self._lock:
+            self._validate()
+            self.backend.delete(note_id)
+            self._update_cached(note_id, None)
+
+    def apply_change(self, note_id, deleted=False, meta=None):
+        """
+        其他进程写入了某个便笺（由主进程广播通知）：不读取存储，只让这一条缓存失效，
+        下次用到时再加载；列表元数据直接换成通知中附带的 meta，不重新读取全部元数据。
+        然后刷新失效标记，避免这次写入让整个缓存失效。
+        """
+        note_id = str(note_id)
+        with self._lock:
+            if deleted:
+                self._update_cached(note_id, None)
+            else:
+                if self._all is not None:
+                    # 其余便笺仍然有效，降级为按条缓存
+                    self._notes = self._all
+                    self._all = None
+                self._notes.pop(note_id, None)
+                if self._meta is not None:
+                    if meta is not None:
+                        self._meta[note_id] = meta
+                    else:
+                        # 没有附带元数据（旧版通知）时只能整体重新读取
+                        self._meta = None
+            self._after_own_write()
+
+    # ------------------ 其他 ------------------
+    def invalidate(self):
+        with self._lock:
+            self._all = None
+            self._notes = {}
+            self._meta = None
+            self._token = None
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "mode": "inotify" if self._watcher.available else "stat",
+        }
+
+    def watched_files(self):
+        return self.backend.watched_files()
+
+    def close(self):
+        self._watcher.close()
+        self.backend.close()
+
+
+_store = None
+
+
+def get_store():
+    """
+    返回当前进程共享的存储实例（首次调用时创建并完成旧数据迁移），外面包一层进程内缓存。
+    后端由环境变量 NOTE_STORAGE 选择，未知取值回退到默认后端。
+    """
+    global _store
+    if _store is None:
+        backend = os.getenv("NOTE_STORAGE", DEFAULT_BACKEND).strip().lower()
+        if backend not in BACKENDS:
+            print(f"⚠️ 未知的存储后端 {backend}，使用默认的 {DEFAULT_BACKEND}")
+            backend = DEFAULT_BACKEND
+        _store = CachedNoteStore(BACKENDS[backend]())
+    return _store
+
+
+def close_store():
+    """关闭并丢弃当前进程的存储实例，下次 get_store() 时重新创建（主进程创建子进程前调用）"""
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+# fork 继承的存储实例不能在子进程中继续使用：其中的 SQLite 连接属于父进程，
+# inotify 描述符与父进程共享同一个事件队列（子进程读取会把父进程的失效通知吃掉）
+_inherited = []
+
+
+def _drop_inherited_store():
+    global _store
+    if _store is None:
+        return
+    # 只关闭子进程自己的 inotify 描述符，不读取事件；SQLite 连接既不使用也不关闭，留给进程退出
+    _store._watcher.close()
+    _inherited.append(_store)
+    _store = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_drop_inherited_store)
@@ -0,0 +1,258 @@
+import time
+import tkinter as tk
+import tkinter.simpledialog as simpledialog
+from tkinter import messagebox
+import change_feed
+from note_manager import NoteManager
+
+ROW_HEIGHT = 46
+SEARCH_DELAY_MS = 120
+
+
+class NotesBrowser:
+    """
+    已保存便笺浏览窗口，替代原来"每个便笺一个级联子菜单"的历史列表：
+    - 只读取轻量元数据（id、名称、更新时间、大小、首行），不加载正文；
+    - 列表是虚拟化的：只创建可见高度所需的若干行控件，滚动时复用它们显示不同的条目；
+    - 支持按最近修改或名称排序，顶部搜索框使用全文索引即时过滤；
+    - 其他便笺进程保存/重命名/删除便笺时收到通知后增量刷新，不重新读取全部数据。
+    """
+    def __init__(self, app):
+        self.app = app
+        self.entries = []
+        self.offset = 0
+        self.rows = []
+        self.selected = None
+        self.sort_mode = "recent"
+        self._search_after = None
+        self._search_hits = None
+        self._change_after = None
+
+        bg = app.text_bg
+        fg = app.text_fg
+        self.window = tk.Toplevel(app.root)
+        self.window.title("已保存的便笺")
+        self.window.configure(bg=bg)
+        self.window.geometry(f"320x420+{app.root.winfo_x() + 20}+{app.root.winfo_y() + 40}")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        # 顶部：搜索框与排序按钮
+        top = tk.Frame(self.window, bg=app.header_bg)
+        top.pack(fill=tk.X)
+        self.query_var = tk.StringVar()
+        entry = tk.Entry(top, textvariable=self.query_var, font=("微软雅黑", 10),
+                         bg=bg, fg=fg, insertbackground=fg, relief="flat")
+        entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=6, pady=6)
+        entry.bind("<KeyRelease>", self._on_query_changed)
+        entry.bind("<Return>", lambda e: self.open_selected())
+        self.sort_btn = tk.Button(top, text="按最近", bg=app.header_bg, fg="white", bd=0,
+                                  font=("微软雅黑", 9), command=self.toggle_sort)
+        self.sort_btn.pack(side=tk.RIGHT, padx=6)
+
+        # 列表区：固定数量的行控件 + 滚动条
+        body = tk.Frame(self.window, bg=bg)
+        body.pack(fill=tk.BOTH, expand=True)
+        self.scrollbar = tk.Scrollbar(body, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.viewport = tk.Frame(body, bg=bg)
+        self.viewport.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.viewport.bind("<Configure>", self._on_resize)
+        self._bind_wheel(self.viewport)
+
+        self.status = tk.Label(self.window, text="", anchor="w", font=("微软雅黑", 9), bg=bg, fg=fg)
+        self.status.pack(fill=tk.X, padx=6)
+
+        entry.focus_set()
+        self.refresh()
+        self._unsubscribe = change_feed.subscribe(self._on_note_changed)
+        self.window.bind("<Destroy>", self._on_destroy, add="+")
+
+    # ------------------ 数据 ------------------
+    def refresh(self):
+        """重新读取元数据（走进程内缓存）并按当前排序/搜索条件生成条目"""
+        meta = NoteManager.list_meta()
+        if self._search_hits is not None:
+            self.entries = [(note_id, meta[note_id]) for note_id in self._search_hits if note_id in meta]
+        elif self.sort_mode == "recent":
+            self.entries = sorted(meta.items(), key=lambda item: item[1].get("updated", 0), reverse=True)
+        else:
+            self.entries = sorted(meta.items(), key=lambda item: self._title(item[0], item[1]).lower())
+        self.offset = max(0, min(self.offset, len(self.entries) - self._visible_count()))
+        if self.selected not in {note_id for note_id, _ in self.entries}:
+            self.selected = None
+        if self._search_hits is not None:
+            self.status.config(text=f"找到 {len(self.entries)} 条结果")
+        else:
+            self.status.config(text=f"共 {len(self.entries)} 个便笺")
+        self._render()
+
+    def toggle_sort(self):
+        self.sort_mode = "name" if self.sort_mode == "recent" else "recent"
+        self.sort_btn.config(text="按名称" if self.sort_mode == "name" else "按最近")
+        self.offset = 0
+        self.refresh()
+
+    def _on_query_changed(self, event=None):
+        if self._search_after is not None:
+            self.window.after_cancel(self._search_after)
+        self._search_after = self.window.after(SEARCH_DELAY_MS, self._run_search)
+
+    def _search(self):
+        import search_index
+        query = self.query_var.get().strip()
+        if not query:
+            return None
+        return [note_id for note_id, _name, _score in search_index.get_index().search(query, limit=500)]
+
+    def _run_search(self):
+        self._search_after = None
+        self._search_hits = self._search()
+        self.offset = 0
+        self.refresh()
+
+    def _on_note_changed(self, note_id, kind, version):
+        """便笺缓存已由 change_feed 更新；短时间内的多次通知合并为一次刷新"""
+        if kind == change_feed.DELETED and self._search_hits is not None and note_id in self._search_hits:
+            self._search_hits.remove(note_id)
+        if self._change_after is None:
+            self._change_after = self.window.after(SEARCH_DELAY_MS, self._apply_changes)
+
+    def _apply_changes(self):
+        self._change_after = None
+        if self._search_hits is not None:
+            # 正文或名称变化可能改变搜索结果，保持当前滚动位置重新查询
+            self._search_hits = self._search()
+        self.refresh()
+
+    def _on_destroy(self, event):
+        if event.widget is self.window:
+            self._unsubscribe()
+
+    @staticmethod
+    def _title(note_id, meta):
+        return meta.get("name") or meta.get("first_line") or note_id
+
+    # ------------------ 虚拟化渲染 ------------------
+    def _visible_count(self):
+        height = self.viewport.winfo_height()
+        return max(1, height // ROW_HEIGHT)
+
+    def _on_resize(self, event=None):
+        needed = event.height // ROW_HEIGHT + 1 if event else self._visible_count() + 1
+        while len(self.rows) < needed:
+            self.rows.append(self._create_row(len(self.rows)))
+        self._render()
+
+    def _create_row(self, slot):
+        bg = self.app.text_bg
+        fg = self.app.text_fg
+        frame = tk.Frame(self.viewport, bg=bg, bd=0, highlightthickness=0)
+        title = tk.Label(frame, anchor="w", font=("微软雅黑", 10, "bold"), bg=bg, fg=fg)
+        title.pack(fill=tk.X, padx=8, pady=(4, 0))
+        detail = tk.Label(frame, anchor="w", font=("微软雅黑", 8), bg=bg, fg=fg)
+        detail.pack(fill=tk.X, padx=8)
+        for widget in (frame, title, detail):
+            widget.bind("<Button-1>", lambda e, s=slot: self._select_slot(s))
+            widget.bind("<Double-Button-1>", lambda e, s=slot: self._open_slot(s))
+            widget.bind("<Button-3>", lambda e, s=slot: self._popup_slot(s, e))
+            self._bind_wheel(widget)
+        return frame, title, detail
+
+    def _render(self):
+        visible = self._visible_count()
+        for slot, (frame, title, detail) in enumerate(self.rows):
+            index = self.offset + slot
+            if slot > visible or index >= len(self.entries):
+                frame.place_forget()
+                continue
+            note_id, meta = self.entries[index]
+            updated = meta.get("updated") or 0
+            when = time.strftime("%m-%d %H:%M", time.localtime(updated)) if updated else "--"
+            info = f"{when} · {meta.get('size', 0)} 字"
+            if meta.get("name") and meta.get("first_line"):
+                info += f" · {meta['first_line']}"
+            is_selected = note_id == self.selected
+            row_bg = "#FFCC00" if is_selected else self.app.text_bg
+            row_fg = "black" if is_selected else self.app.text_fg
+            frame.config(bg=row_bg)
+            title.config(text=self._title(note_id, meta), bg=row_bg, fg=row_fg)
+            detail.config(text=info, bg=row_bg, fg=row_fg)
+            frame.place(x=0, y=slot * ROW_HEIGHT, relwidth=1, height=ROW_HEIGHT)
+        total = len(self.entries)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + visible) / total))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _scroll_to(self, offset):
+        limit = max(0, len(self.entries) - self._visible_count())
+        offset = max(0, min(int(offset), limit))
+        if offset != self.offset:
+            self.offset = offset
+            self._render()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self._scroll_to(float(amount) * len(self.entries))
+        elif action == "scroll":
+            step = self._visible_count() if unit == "pages" else 1
+            self._scroll_to(self.offset + int(amount) * step)
+
+    def _bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda e: self._scroll_to(self.offset - int(e.delta / 120) * 3))
+        widget.bind("<Button-4>", lambda e: self._scroll_to(self.offset - 3))
+        widget.bind("<Button-5>", lambda e: self._scroll_to(self.offset + 3))
+
+    # ------------------ 行操作 ------------------
+    def _note_at(self, slot):
+        index = self.offset + slot
+        if index < len(self.entries):
+            return self.entries[index][0]
+        return None
+
+    def _select_slot(self, slot):
+        self.selected = self._note_at(slot)
+        self._render()
+
+    def _open_slot(self, slot):
+        self._select_slot(slot)
+        self.open_selected()
+
+    def open_selected(self):
+        note_id = self.selected
+        if note_id is None and self.entries:
+            note_id = self.entries[0][0]
+        if note_id is not None:
+            self.app.open_note_nearby(note_id)
+
+    def _popup_slot(self, slot, event):
+        self._select_slot(slot)
+        note_id = self.selected
+        if note_id is None:
+            return
+        menu = tk.Menu(self.window, tearoff=0, bg="#3E3E3E", fg="#FFFFFF",
+                       activebackground="#FFCC00", activeforeground="black")
+        menu.add_command(label="打开", command=self.open_selected)
+        menu.add_command(label="重命名", command=lambda: self.rename(note_id))
+        menu.add_command(label="删除", command=lambda: self.delete(note_id))
+        menu.tk_popup(event.x_root, event.y_root)
+
+    def rename(self, note_id):
+        meta = NoteManager.list_meta().get(note_id, {})
+        new_name = simpledialog.askstring("重命名", "请输入新的便笺名称：", parent=self.window,
+                                          initialvalue=meta.get("name") or note_id)
+        if new_name:
+            NoteManager.rename_note(note_id, new_name)
+            self.refresh()
+
+    def delete(self, note_id):
+        if messagebox.askyesno("删除便笺", "确定删除此便笺吗？", parent=self.window):
+            NoteManager.remove_note(note_id)
+            if self._search_hits is not None and note_id in self._search_hits:
+                self._search_hits.remove(note_id)
+            self.refresh()
+
+    def close(self):
+        self.window.destroy()
+        if getattr(self.app, "notes_browser", None) is self:
+            self.app.notes_browser = None
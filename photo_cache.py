@@ -0,0 +1,176 @@
+import os
+from collections import OrderedDict
+
+# 进程内 PhotoImage 缓存的内存预算（按 宽 x 高 x 4 字节估算），可在 .env 中通过 PHOTO_CACHE_BUDGET_MB 调整
+PHOTO_CACHE_BUDGET_MB = int(os.getenv("PHOTO_CACHE_BUDGET_MB", "64"))
+
+
+def _source_key(path):
+    """内容寻址存储中的图片以哈希为键（不同路径写法指向同一张图），其他图片以绝对路径为键"""
+    import image_store
+    if image_store.is_stored(path):
+        return os.path.splitext(os.path.basename(path))[0]
+    return os.path.normcase(os.path.abspath(path))
+
+
+class PhotoCache:
+    """
+    进程内共享的 PhotoImage 缓存，键为 (图片哈希或路径, 目标尺寸)：
+    - 同一张图片在多个便笺、使用说明窗口、编辑器中只创建一个 PhotoImage；
+    - 每个条目记录有哪些 Text 组件正在显示它（按组件统计嵌入次数），
+      sync_widget() 根据组件当前内容重新统计，图片被删除后引用随之释放；
+    - 没有任何组件引用的条目按最近最少使用淘汰，直到总占用回到预算以内。
+    PhotoImage 只能在 UI 线程中创建和使用，本类的方法都应在 UI 线程中调用。
+    """
+    def __init__(self, budget_bytes=PHOTO_CACHE_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # key -> {"photo", "bytes", "users": {widget: 嵌入次数}}
+        self._by_photo = {}             # PhotoImage 名称 -> key
+
+    @staticmethod
+    def make_key(path, size):
+        return _source_key(path), tuple(size)
+
+    # ------------------ 取用与放入 ------------------
+    def get(self, path, size):
+        key = self.make_key(path, size)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry["photo"]
+
+    def put(self, path, size, image):
+        """把（已缩放好的）PIL 图片转换为 PhotoImage 放入缓存并返回"""
+        from PIL import ImageTk
+        key = self.make_key(path, size)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry["photo"]
+        photo = ImageTk.PhotoImage(image)
+        nbytes = photo.width() * photo.height() * 4
+        self._entries[key] = {"photo": photo, "bytes": nbytes, "users": {}}
+        self._by_photo[str(photo)] = key
+        self.total_bytes += nbytes
+        self._evict()
+        return photo
+
+    def load(self, path, size, resample=None):
+        """
+        同步读取：命中直接返回，否则解码并按 size（保持比例、只缩小）缩放后放入缓存。
+        用于使用说明窗口、编辑器等图片很少的地方；便笺正文使用后台解码。
+        """
+        photo = self.get(path, size)
+        if photo is not None:
+            return photo
+        from PIL import Image
+        image = Image.open(path)
+        if resample is None:
+            image.thumbnail(size)
+        else:
+            image.thumbnail(size, resample)
+        return self.put(path, size, image)
+
+    # ------------------ 引用计数 ------------------
+    def acquire(self, widget, photo):
+        """记录 widget 中新嵌入了一次该图片"""
+        key = self._by_photo.get(str(photo))
+        if key is None:
+            return
+        users = self._entries[key]["users"]
+        users[widget] = users.get(widget, 0) + 1
+
+    def sync_widget(self, widget):
+        """按 widget 当前实际嵌入的图片重新统计引用（例如图片被删除、撤销之后）"""
+        counts = {}
+        try:
+            for _key, name, _index in widget.dump("1.0", "end", image=True):
+                photo_name = str(widget.image_cget(name, "image"))
+                key = self._by_photo.get(photo_name)
+                if key is not None:
+                    counts[key] = counts.get(key, 0) + 1
+        except Exception:
+            # 组件已销毁
+            counts = {}
+        for key, entry in self._entries.items():
+            if key in counts:
+                entry["users"][widget] = counts[key]
+            else:
+                entry["users"].pop(widget, None)
+        self._evict()
+
+    def release_widget(self, widget):
+        """组件销毁时释放它的所有引用"""
+        for entry in self._entries.values():
+            entry["users"].pop(widget, None)
+        self._evict()
+
+    def _evict(self):
+        if self.total_bytes <= self.budget_bytes:
+            return
+        for key in list(self._entries):
+            if self.total_bytes <= self.budget_bytes:
+                break
+            entry = self._entries[key]
+            if entry["users"]:
+                continue
+            del self._entries[key]
+            self._by_photo.pop(str(entry["photo"]), None)
+            self.total_bytes -= entry["bytes"]
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "budget_bytes": self.budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_cache = None
+
+
+def get_cache():
+    """返回当前进程共享的 PhotoImage 缓存"""
+    global _cache
+    if _cache is None:
+        _cache = PhotoCache()
+    return _cache
+
+
+def track_widget(widget, sync_delay_ms=1000):
+    """
+    让缓存跟踪 widget：内容修改后（防抖）重新统计引用，组件销毁时释放全部引用。
+    对同一组件重复调用没有副作用。
+    """
+    if getattr(widget, "_photo_cache_tracked", False):
+        return
+    widget._photo_cache_tracked = True
+    cache = get_cache()
+    pending = {"after": None}
+
+    def sync():
+        pending["after"] = None
+        cache.sync_widget(widget)
+
+    def on_modified(event=None):
+        if pending["after"] is not None:
+            widget.after_cancel(pending["after"])
+        pending["after"] = widget.after(sync_delay_ms, sync)
+
+    def on_destroy(event=None):
+        if event is None or event.widget is widget:
+            cache.release_widget(widget)
+
+    widget.bind("<<Modified>>", on_modified, add="+")
+    widget.bind("<Destroy>", on_destroy, add="+")
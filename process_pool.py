@@ -0,0 +1,178 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+
+# 预先启动、等待分配便笺的进程数，可在 .env 中通过 NOTE_POOL_SIZE 调整（0 表示不预热，每次现启动进程）
+NOTE_POOL_SIZE = int(os.getenv("NOTE_POOL_SIZE", "2"))
+# 一个预热进程被取走后，等待多久（秒）再补充，避免新进程的导入与刚分配的窗口抢 CPU
+POOL_REFILL_DELAY = float(os.getenv("NOTE_POOL_REFILL_DELAY", "0.5"))
+
+
+def _pooled_worker(conn, command_queue):
+    """
+    预热进程的入口：先完成导入、Tk 初始化和存储的首次读取，
+    再阻塞在管道上等待分配 (note_id, x, y, requested_at, window_state)；收到 None 或管道关闭时直接退出。
+    分配之后同一条管道继续用于接收主进程广播的便笺变化通知。
+    """
+    import tkinter as tk
+    import Note
+    from note_storage import get_store
+    root = tk.Tk()
+    root.withdraw()
+    try:
+        get_store().list_meta()
+    except Exception as e:
+        print(f"预热读取便笺失败：{e}")
+    # 便笺进程在第一次显示图片/发送 AI 消息时才导入 PIL 和 requests；预热进程空闲，提前导入
+    try:
+        from PIL import Image, ImageTk
+        import requests
+    except ImportError:
+        pass
+    try:
+        assignment = conn.recv()
+    except (EOFError, OSError):
+        assignment = None
+    if assignment is None:
+        conn.close()
+        root.destroy()
+        return
+    note_id, x, y, requested_at, window_state = assignment
+    Note.launch_sticky_note(note_id, command_queue, x, y, requested_at, master=root,
+                            window_state=window_state, events=conn)
+
+
+class ProcessPool:
+    """
+    主进程维护的便笺进程池：
+    - 始终保持 size 个已完成导入和 Tk 初始化的空闲进程；
+    - launch() 取出一个空闲进程，通过管道把要打开的便笺交给它，窗口几乎立即出现；
+      返回 (进程, 管道写入端)，主进程之后通过这条管道向它广播便笺变化通知；
+    - 取走之后记下补充时间，由主进程的事件循环在到期后调用 refill_if_due() 补充；
+      所有 fork 都发生在主进程的主线程中，不与其他线程并发。池为空（或 size 为 0）时退回到现启动进程。
+    空闲进程不算打开的窗口，由 shutdown() 统一结束。
+    """
+    def __init__(self, command_queue, size=NOTE_POOL_SIZE):
+        self.command_queue = command_queue
+        self.size = max(0, size)
+        self.hits = 0
+        self.misses = 0
+        self._idle = deque()        # (进程, 写入端管道)
+        self._lock = threading.RLock()
+        self._starting = 0
+        self._closed = False
+        self._refill_at = None
+
+    def _start_worker(self):
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        p = multiprocessing.Process(target=_pooled_worker, args=(reader, self.command_queue))
+        p.start()
+        reader.close()
+        return p, writer
+
+    def refill(self, target=None):
+        """
+        补充空闲进程直到池满（同时丢弃已意外退出的空闲进程）；启动进程时不持有锁。
+        target 大于池大小时临时多预热一些（例如恢复会话的第一批窗口），用掉后只补回池大小。
+        """
+        if self.size <= 0:
+            return
+        target = self.size if target is None else max(self.size, target)
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                for item in list(self._idle):
+                    if not item[0].is_alive():
+                        self._idle.remove(item)
+                        item[1].close()
+                        item[0].join()
+                if len(self._idle) + self._starting >= target:
+                    return
+                self._starting += 1
+            try:
+                worker = self._start_worker()
+            finally:
+                with self._lock:
+                    self._starting -= 1
+            with self._lock:
+                if not self._closed:
+                    self._idle.append(worker)
+                    continue
+            # 池已关闭：关闭管道后该进程会自行退出
+            worker[1].close()
+            worker[0].join()
+            return
+
+    def refill_later(self, delay=POOL_REFILL_DELAY):
+        """记下 delay 秒后补充（已有更早的补充计划时保持不变），不阻塞主进程处理命令"""
+        if self.size <= 0:
+            return
+        with self._lock:
+            due = time.time() + delay
+            if self._refill_at is None or due < self._refill_at:
+                self._refill_at = due
+
+    def refill_timeout(self):
+        """距离下次补充的秒数，没有补充计划时返回 None（供事件循环计算等待超时）"""
+        with self._lock:
+            if self._refill_at is None:
+                return None
+            return max(0, self._refill_at - time.time())
+
+    def refill_if_due(self):
+        """补充时间已到则补充（在主线程中调用）"""
+        with self._lock:
+            if self._refill_at is None or time.time() < self._refill_at:
+                return
+            self._refill_at = None
+        self.refill()
+
+    def launch(self, note_id, x, y, requested_at, window_state=None):
+        """打开一个便笺窗口（window_state 为会话中记录的窗口状态），返回 (负责该窗口的进程, 管道写入端)"""
+        with self._lock:
+            while self._idle:
+                p, writer = self._idle.popleft()
+                try:
+                    writer.send((note_id, x, y, requested_at, window_state))
+                except (BrokenPipeError, OSError):
+                    writer.close()
+                    p.join(timeout=0)
+                    continue
+                self.hits += 1
+                self.refill_later()
+                return p, writer
+        self.misses += 1
+        from Note import launch_sticky_note
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        p = multiprocessing.Process(target=launch_sticky_note,
+                                    args=(note_id, self.command_queue, x, y, requested_at),
+                                    kwargs={"window_state": window_state, "events": reader})
+        p.start()
+        reader.close()
+        self.refill_later()
+        return p, writer
+
+    def shutdown(self):
+        """结束所有空闲进程"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+        for p, writer in idle:
+            try:
+                writer.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            writer.close()
+        for p, _writer in idle:
+            p.join(timeout=2)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+        return {"size": self.size, "idle": idle, "hits": self.hits, "misses": self.misses}
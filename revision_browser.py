@@ -0,0 +1,91 @@
+import time
+import tkinter as tk
+from tkinter import messagebox
+import revisions
+from rich_text import IMG_PATTERN
+
+
+class RevisionBrowser:
+    """
+    当前便笺的历史版本窗口：左侧列出所有版本（时间、字数），右侧只读预览，
+    "恢复此版本"会把选中的版本载入便笺，随后的自动保存会把它记录为一个新版本。
+    """
+    def __init__(self, app):
+        self.app = app
+        self.entries = []
+
+        bg = app.text_bg
+        fg = app.text_fg
+        self.window = tk.Toplevel(app.root)
+        self.window.title("历史版本")
+        self.window.configure(bg=bg)
+        self.window.geometry(f"520x360+{app.root.winfo_x() + 20}+{app.root.winfo_y() + 40}")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        bottom = tk.Frame(self.window, bg=app.header_bg)
+        bottom.pack(side=tk.BOTTOM, fill=tk.X)
+        tk.Button(bottom, text="恢复此版本", bg=app.header_bg, fg="white", bd=0,
+                  font=("微软雅黑", 10), command=self.restore_selected).pack(side=tk.RIGHT, padx=6, pady=4)
+        self.status = tk.Label(bottom, text="", anchor="w", font=("微软雅黑", 9),
+                               bg=app.header_bg, fg="white")
+        self.status.pack(side=tk.LEFT, fill=tk.X, padx=6)
+
+        self.listbox = tk.Listbox(self.window, width=22, font=("微软雅黑", 9), bg=bg, fg=fg,
+                                  selectbackground="#FFCC00", selectforeground="black",
+                                  relief="flat", exportselection=False)
+        self.listbox.pack(side=tk.LEFT, fill=tk.Y)
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+
+        self.preview = tk.Text(self.window, wrap="word", font=("微软雅黑", 10), bg=bg, fg=fg,
+                               relief="flat", padx=6, pady=6)
+        self.preview.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.preview.config(state=tk.DISABLED)
+
+        self.refresh()
+
+    def refresh(self):
+        self.entries = revisions.list_revisions(self.app.note_id)
+        self.listbox.delete(0, tk.END)
+        for entry in self.entries:
+            when = time.strftime("%m-%d %H:%M:%S", time.localtime(entry["ts"]))
+            self.listbox.insert(tk.END, f"{when} · {entry['size']} 字")
+        self.status.config(text=f"共 {len(self.entries)} 个版本")
+        if self.entries:
+            self.listbox.selection_set(0)
+            self._on_select()
+
+    def _selected_rev(self):
+        selection = self.listbox.curselection()
+        if not selection:
+            return None
+        return self.entries[selection[0]]["rev"]
+
+    def _on_select(self, event=None):
+        rev = self._selected_rev()
+        note = revisions.load_revision(self.app.note_id, rev) if rev is not None else None
+        self.preview.config(state=tk.NORMAL)
+        self.preview.delete("1.0", tk.END)
+        if note is not None:
+            # 预览只显示文字，图片以占位文字代替
+            self.preview.insert("1.0", IMG_PATTERN.sub("[图片]", note.get("text", "")))
+        self.preview.config(state=tk.DISABLED)
+
+    def restore_selected(self):
+        rev = self._selected_rev()
+        if rev is None:
+            return
+        note = revisions.load_revision(self.app.note_id, rev)
+        if note is None:
+            messagebox.showerror("历史版本", "无法读取该版本。", parent=self.window)
+            return
+        if not messagebox.askyesno("历史版本", "用该版本替换便笺当前内容吗？", parent=self.window):
+            return
+        self.app.note_manager.apply_note(note)
+        if hasattr(self.app, "autosaver"):
+            self.app.autosaver.mark_dirty()
+        self.close()
+
+    def close(self):
+        self.window.destroy()
+        if getattr(self.app, "revision_browser", None) is self:
+            self.app.revision_browser = None
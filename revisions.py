@@ -0,0 +1,296 @@
+import difflib
+import json
+import os
+import threading
+import time
+from urllib.parse import quote, unquote
+import image_gc
+from note_storage import FileLock
+
+REVISIONS_DIR = "sticky_notes_revisions"
+# 每隔多少个版本存一次完整关键帧，恢复任意版本最多只需重放这么多个差异
+KEYFRAME_INTERVAL = 10
+# 保留策略：最近 KEEP_LAST 个版本全部保留；更早的版本按时间稀疏化
+KEEP_LAST = int(os.getenv("REVISIONS_KEEP_LAST", "30"))
+# (早于多少秒, 每个时间桶保留一个版本的桶大小)
+THINNING = (
+    (0, 60),                      # 最近 KEEP_LAST 个之外：每分钟最多保留一个
+    (3600, 600),                  # 一小时以前：每十分钟保留一个
+    (24 * 3600, 3600),            # 一天以前：每小时保留一个
+    (30 * 24 * 3600, 24 * 3600),  # 一个月以前：每天保留一个
+)
+# 版本数超过 KEEP_LAST 多少后在后台整理一次
+PRUNE_SLACK = 20
+
+_lock_file = os.path.join(REVISIONS_DIR, ".lock")
+_latest = {}
+_pruning = set()
+_pruning_lock = threading.Lock()
+
+
+def _path(note_id):
+    return os.path.join(REVISIONS_DIR, quote(str(note_id), safe="") + ".jsonl")
+
+
+# ------------------ 差异编解码 ------------------
+def _diff(old, new):
+    """
+    按行计算差异，返回作用于旧文本行列表的操作 [[起始行, 结束行, 新内容], ...]。
+    行级差异比逐字符 SequenceMatcher 快得多，对大便笺也适用。
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            ops.append([i1, i2, "".join(new_lines[j1:j2])])
+    return ops
+
+
+def _patch(old, ops):
+    lines = old.splitlines(keepends=True)
+    # 从后往前应用，前面的行号不受影响
+    for i1, i2, replacement in reversed(ops):
+        lines[i1:i2] = [replacement] if replacement else []
+    return "".join(lines)
+
+
+def _split(note):
+    """把便笺拆成正文和其余属性（外观、标签等）"""
+    attrs = {k: v for k, v in note.items() if k != "text"}
+    return note.get("text", ""), attrs
+
+
+def _file_token(note_id):
+    """历史文件的 (inode, 大小)；其他进程追加或整理后会变化"""
+    try:
+        st = os.stat(_path(note_id))
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size
+
+
+def _encode(records):
+    return "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records)
+
+
+def _read_records(note_id):
+    records = []
+    try:
+        with open(_path(note_id), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 写到一半的最后一行，跳过
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def _materialize(records):
+    """依次还原每个版本，产出 (record, text)"""
+    text = ""
+    for record in records:
+        if "text" in record:
+            text = record["text"]
+        else:
+            text = _patch(text, record.get("ops", []))
+        yield record, text
+
+
+def _build_record(rev, ts, text, attrs, prev_text, since_keyframe):
+    record = {"rev": rev, "ts": ts, "attrs": attrs, "size": len(text)}
+    if prev_text is None or since_keyframe >= KEYFRAME_INTERVAL - 1:
+        record["text"] = text
+        return record
+    ops = _diff(prev_text, text)
+    # 差异比全文还大时直接存关键帧
+    if sum(len(op[2]) for op in ops) * 2 > len(text):
+        record["text"] = text
+    else:
+        record["ops"] = ops
+    return record
+
+
+# ------------------ 对外接口 ------------------
+def record_revision(note_id, note):
+    """
+    在便笺保存后追加一个版本（内容与上一版本相同则跳过）。
+    普通版本只保存与上一版本的行级差异，每 KEYFRAME_INTERVAL 个版本存一次完整关键帧。
+    历史版本中出现过的图片作为一个引用方登记到 image_gc，正文删掉图片后旧版本仍能显示。
+    """
+    note_id = str(note_id)
+    text, attrs = _split(note)
+    rev = None
+    with FileLock(_lock_file):
+        latest = _latest.get(note_id)
+        if latest is not None and latest["file"] != _file_token(note_id):
+            # 同一便笺在其他进程中也打开过并写入了新版本：缓存的基准文本已过期，必须重新读取，
+            # 否则差异会基于错误的文本计算、版本号也会重复
+            latest = None
+        # 本进程第一次（或重新）读取该便笺的历史时同步一次其中的图片引用
+        sync_images = latest is None
+        if latest is None:
+            token = _file_token(note_id)
+            records = _read_records(note_id)
+            latest = {"rev": 0, "text": None, "attrs": None, "since_keyframe": 0, "count": 0,
+                      "images": set(), "file": token}
+            for record, rec_text in _materialize(records):
+                latest["since_keyframe"] = 0 if "text" in record else latest["since_keyframe"] + 1
+                latest.update(rev=record["rev"], text=rec_text, attrs=record.get("attrs"))
+                latest["images"] |= image_gc.extract_refs(rec_text)
+            latest["count"] = len(records)
+            _latest[note_id] = latest
+        if latest["text"] != text or latest["attrs"] != attrs:
+            rev = latest["rev"] + 1
+            record = _build_record(rev, time.time(), text, attrs, latest["text"], latest["since_keyframe"])
+            os.makedirs(REVISIONS_DIR, exist_ok=True)
+            with open(_path(note_id), "a", encoding="utf-8") as f:
+                f.write(_encode([record]))
+            latest["file"] = _file_token(note_id)
+            latest.update(rev=rev, text=text, attrs=attrs, count=latest["count"] + 1,
+                          since_keyframe=0 if "text" in record else latest["since_keyframe"] + 1)
+            new_images = image_gc.extract_refs(text) - latest["images"]
+            if new_images:
+                latest["images"] |= new_images
+                sync_images = True
+        images = set(latest["images"])
+        needs_prune = rev is not None and latest["count"] > KEEP_LAST + PRUNE_SLACK
+    # 在历史版本的锁外更新引用计数（image_gc 重建索引时会读取历史版本）
+    if sync_images:
+        image_gc.update_revision_refs(note_id, images)
+    if needs_prune:
+        prune_in_background(note_id)
+    return rev
+
+
+def list_revisions(note_id):
+    """返回 [{"rev", "ts", "size"}, ...]，最新的在前"""
+    records = _read_records(str(note_id))
+    return [{"rev": r["rev"], "ts": r["ts"], "size": r.get("size", 0)} for r in reversed(records)]
+
+
+def load_revision(note_id, rev):
+    """还原指定版本的完整便笺 dict；从最近的关键帧开始重放，代价有上限"""
+    records = _read_records(str(note_id))
+    target = None
+    for i, record in enumerate(records):
+        if record["rev"] == rev:
+            target = i
+            break
+    if target is None:
+        return None
+    start = target
+    while start > 0 and "text" not in records[start]:
+        start -= 1
+    text = ""
+    for record, text in _materialize(records[start:target + 1]):
+        pass
+    note = dict(records[target].get("attrs") or {})
+    note["text"] = text
+    return note
+
+
+def delete_revisions(note_id):
+    note_id = str(note_id)
+    with FileLock(_lock_file):
+        _latest.pop(note_id, None)
+        try:
+            os.remove(_path(note_id))
+        except FileNotFoundError:
+            pass
+    image_gc.drop_revision_refs(note_id)
+
+
+def image_refs():
+    """扫描全部历史版本，返回 {note_id: 其中出现过的图片名集合}（image_gc 重建索引时使用）"""
+    result = {}
+    try:
+        names = os.listdir(REVISIONS_DIR)
+    except FileNotFoundError:
+        return result
+    for name in names:
+        if not name.endswith(".jsonl"):
+            continue
+        note_id = unquote(name[:-len(".jsonl")])
+        refs = set()
+        for _record, text in _materialize(_read_records(note_id)):
+            refs |= image_gc.extract_refs(text)
+        if refs:
+            result[note_id] = refs
+    return result
+
+
+def _select_kept(records, now):
+    """按保留策略选出要保留的版本号"""
+    keep = {r["rev"] for r in records[-KEEP_LAST:]}
+    buckets = set()
+    for record in reversed(records[:-KEEP_LAST]):
+        age = now - record["ts"]
+        bucket_size = None
+        for older_than, size in THINNING:
+            if age >= older_than:
+                bucket_size = size
+        if bucket_size is None:
+            keep.add(record["rev"])
+            continue
+        bucket = (bucket_size, int(record["ts"] // bucket_size))
+        if bucket not in buckets:
+            buckets.add(bucket)
+            keep.add(record["rev"])
+    return keep
+
+
+def prune(note_id):
+    """
+    执行保留策略：删掉多余版本后，把留下的版本重新编码为关键帧 + 差异并原子替换文件，
+    再按留下的版本更新历史图片引用（只出现在被删版本中的图片进入回收宽限期）
+    """
+    note_id = str(note_id)
+    with FileLock(_lock_file):
+        records = _read_records(note_id)
+        keep = _select_kept(records, time.time())
+        if len(keep) == len(records):
+            return 0
+        kept = [(record, text) for record, text in _materialize(records) if record["rev"] in keep]
+        images = set()
+        for _record, text in kept:
+            images |= image_gc.extract_refs(text)
+        rebuilt = []
+        prev_text = None
+        since_keyframe = 0
+        for record, text in kept:
+            new_record = _build_record(record["rev"], record["ts"], text, record.get("attrs"),
+                                       prev_text, since_keyframe)
+            since_keyframe = 0 if "text" in new_record else since_keyframe + 1
+            rebuilt.append(new_record)
+            prev_text = text
+        tmp_path = f"{_path(note_id)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(_encode(rebuilt))
+        os.replace(tmp_path, _path(note_id))
+        _latest.pop(note_id, None)
+        removed = len(records) - len(rebuilt)
+    image_gc.update_revision_refs(note_id, images)
+    return removed
+
+
+def prune_in_background(note_id):
+    with _pruning_lock:
+        if note_id in _pruning:
+            return
+        _pruning.add(note_id)
+
+    def run():
+        try:
+            prune(note_id)
+        except Exception as e:
+            print(f"整理历史版本失败：{e}")
+        finally:
+            with _pruning_lock:
+                _pruning.discard(note_id)
+
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,150 @@
+import re
+
+# 需要保存的格式标签（"invisible" 只用于隐藏图片标记，不需要保存）
+RICH_TAGS = ("bold", "italic", "bold_italic", "underline", "strikethrough")
+IMG_PATTERN = re.compile(r"\[\[IMG:(.*?)\]\]")
+
+# tag_info 的存储格式版本：
+#   1（旧版，无 tag_format 字段）: {"bold": [[start, end], ...]}，偏移为 Tk 字符计数
+#   2: {"bold": [gap, length, gap, length, ...]}，按 Python 字符串偏移做差分编码，
+#      gap 为相对上一个区间结束位置的距离
+TAG_FORMAT = 2
+
+
+def serialize(widget):
+    """
+    一次遍历 Text.dump 同时得到纯文本（含 [[IMG:...]] 标记）和所有格式标签区间，
+    返回 (text, tag_info)。不再为每个区间调用 widget.count 从文档开头重新计数。
+    """
+    pieces = []
+    offset = 0
+    open_at = {}
+    ranges = {tag: [] for tag in RICH_TAGS}
+    for key, value, _index in widget.dump("1.0", "end-1c", text=True, tag=True, image=True):
+        if key == "text":
+            pieces.append(value)
+            offset += len(value)
+        elif key == "tagon" and value in ranges:
+            open_at[value] = offset
+        elif key == "tagoff" and value in open_at:
+            start = open_at.pop(value)
+            if offset > start:
+                ranges[value].append((start, offset))
+        # 图片本身不占文本位置，紧随其后的隐藏标记 [[IMG:...]] 已作为文本记录
+    for tag, start in open_at.items():
+        if offset > start:
+            ranges[tag].append((start, offset))
+
+    text = "".join(pieces).rstrip("\n")
+    limit = len(text)
+    tag_info = {}
+    for tag, tag_ranges in ranges.items():
+        clipped = [(s, min(e, limit)) for s, e in tag_ranges if s < limit]
+        tag_info[tag] = encode_ranges(clipped)
+    return text, tag_info
+
+
+def encode_ranges(ranges):
+    """[(start, end), ...] -> [gap, length, ...]"""
+    flat = []
+    pos = 0
+    for start, end in sorted(ranges):
+        if end <= start:
+            continue
+        start = max(start, pos)
+        flat.extend((start - pos, end - start))
+        pos = end
+    return flat
+
+
+def decode_ranges(flat):
+    """[gap, length, ...] -> [(start, end), ...]"""
+    ranges = []
+    pos = 0
+    for i in range(0, len(flat) - 1, 2):
+        start = pos + flat[i]
+        pos = start + flat[i + 1]
+        ranges.append((start, pos))
+    return ranges
+
+
+def _tk_offset_converter(text):
+    """
+    旧版偏移来自 Tk 的字符计数，BMP 以外的字符（如 emoji）在 Tk 8.6 中占两个位置；
+    返回把旧偏移换算为 Python 字符串偏移的函数。
+    """
+    if all(ord(ch) <= 0xFFFF for ch in text):
+        return lambda off: off
+    tk_to_py = []
+    for i, ch in enumerate(text):
+        tk_to_py.append(i)
+        if ord(ch) > 0xFFFF:
+            tk_to_py.append(i)
+    tk_to_py.append(len(text))
+    return lambda off: tk_to_py[min(off, len(tk_to_py) - 1)]
+
+
+def decode_tag_info(note):
+    """把便笺中任意版本的 tag_info 解码为 {tag: [(start, end), ...]}（Python 字符串偏移）"""
+    tag_info = note.get("tag_info", {}) or {}
+    if note.get("tag_format") == TAG_FORMAT:
+        return {tag: decode_ranges(flat) for tag, flat in tag_info.items()}
+    convert = _tk_offset_converter(note.get("text", ""))
+    result = {}
+    for tag, pairs in tag_info.items():
+        result[tag] = [(convert(s), convert(e)) for s, e in pairs if e > s]
+    return result
+
+
+def _tagged_segments(length, tag_ranges):
+    """把 [0, length) 按标签边界切分，依次产出 (start, end, tags)"""
+    starts = {}
+    ends = {}
+    points = {0, length}
+    for tag, ranges in tag_ranges.items():
+        for s, e in ranges:
+            s, e = max(0, s), min(e, length)
+            if e <= s:
+                continue
+            starts.setdefault(s, []).append(tag)
+            ends.setdefault(e, []).append(tag)
+            points.update((s, e))
+    active = {}
+    ordered = sorted(points)
+    for a, b in zip(ordered, ordered[1:]):
+        for tag in ends.get(a, ()):
+            active[tag] -= 1
+        for tag in starts.get(a, ()):
+            active[tag] = active.get(tag, 0) + 1
+        yield a, b, tuple(tag for tag, n in active.items() if n > 0)
+
+
+def insert_rich_text(widget, text, tag_ranges, insert_image):
+    """
+    批量反序列化：把文本连同格式标签一次性插入到 widget 末尾。
+    连续的纯文本用一次 widget.insert(index, chars, tags, chars, tags, ...) 完成；
+    遇到 [[IMG:路径]] 时调用 insert_image(路径)，由它在 insert 位置插入图片和隐藏标记。
+    """
+    segments = list(_tagged_segments(len(text), tag_ranges))
+    seg_i = 0
+
+    def insert_plain(start, end):
+        nonlocal seg_i
+        args = []
+        while seg_i < len(segments) and segments[seg_i][1] <= start:
+            seg_i += 1
+        i = seg_i
+        while i < len(segments) and segments[i][0] < end:
+            s, e, tags = segments[i]
+            args.extend((text[max(s, start):min(e, end)], tags))
+            i += 1
+        if args:
+            widget.insert("end-1c", *args)
+
+    pos = 0
+    for match in IMG_PATTERN.finditer(text):
+        insert_plain(pos, match.start())
+        widget.mark_set("insert", "end-1c")
+        insert_image(match.group(1))
+        pos = match.end()
+    insert_plain(pos, len(text))
@@ -0,0 +1,244 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+# 倒排索引保存在存储旁边，随时可以通过 rebuild() 从存储重建
+SEARCH_DB_FILE = "sticky_notes_search.db"
+# 名称中的词项权重（相当于在正文中出现多少次）
+NAME_BOOST = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+IMG_PATTERN = re.compile(r"\[\[IMG:.*?\]\]")
+# CJK 统一表意文字、扩展 A、兼容表意文字，以及日文假名与韩文音节
+CJK_RUN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+")
+WORD = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    """
+    分词：CJK 连续片段切成单字 + 二元组（n-gram），其余按单词切分并转小写。
+    [[IMG:...]] 标记不参与索引。
+    """
+    text = IMG_PATTERN.sub(" ", text or "").lower()
+    tokens = []
+    pos = 0
+    for match in CJK_RUN.finditer(text):
+        tokens.extend(WORD.findall(text[pos:match.start()]))
+        run = match.group()
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        pos = match.end()
+    tokens.extend(WORD.findall(text[pos:]))
+    return tokens
+
+
+def _query_terms(query):
+    """
+    查询词项：CJK 片段取二元组（单字片段取单字），全部需要命中；
+    其他单词按前缀匹配，以便输入过程中即时出结果。
+    返回 [(term, is_prefix), ...]
+    """
+    query = (query or "").lower()
+    terms = []
+    pos = 0
+
+    def words(chunk):
+        return [(w, True) for w in WORD.findall(chunk)]
+
+    for match in CJK_RUN.finditer(query):
+        terms.extend(words(query[pos:match.start()]))
+        run = match.group()
+        if len(run) == 1:
+            terms.append((run, False))
+        else:
+            terms.extend((run[i:i + 2], False) for i in range(len(run) - 1))
+        pos = match.end()
+    terms.extend(words(query[pos:]))
+    # 去重但保持顺序
+    return list(dict.fromkeys(terms))
+
+
+class SearchIndex:
+    """
+    基于 SQLite 的增量倒排索引：
+        docs(note_id, name, length, updated)
+        postings(token, note_id, tf)   -- (token, note_id) 为主键，按词项范围扫描
+    保存/重命名/删除便笺时只更新该便笺自身的倒排项；查询按 BM25 排序。
+    """
+    def __init__(self, path=SEARCH_DB_FILE):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS docs (
+                note_id TEXT PRIMARY KEY,
+                name    TEXT,
+                length  INTEGER NOT NULL,
+                updated REAL NOT NULL
+            )""")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS postings (
+                token   TEXT NOT NULL,
+                note_id TEXT NOT NULL,
+                tf      INTEGER NOT NULL,
+                PRIMARY KEY (token, note_id)
+            ) WITHOUT ROWID""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_note ON postings(note_id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    # ------------------ 维护 ------------------
+    def is_built(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+        return row is not None
+
+    @staticmethod
+    def _write_doc(conn, note_id, text, name):
+        counts = Counter(tokenize(text))
+        for token in tokenize(name or ""):
+            counts[token] += NAME_BOOST
+        conn.execute("DELETE FROM postings WHERE note_id = ?", (note_id,))
+        conn.executemany("INSERT INTO postings(token, note_id, tf) VALUES (?, ?, ?)",
+                         [(token, note_id, tf) for token, tf in counts.items()])
+        conn.execute("INSERT OR REPLACE INTO docs(note_id, name, length, updated) VALUES (?, ?, ?, ?)",
+                     (note_id, name, sum(counts.values()), time.time()))
+
+    def update_note(self, note_id, text, name=None):
+        """便笺保存或重命名后，重新索引这一条"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write_doc(conn, str(note_id), text, name)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def remove_note(self, note_id):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM postings WHERE note_id = ?", (str(note_id),))
+            conn.execute("DELETE FROM docs WHERE note_id = ?", (str(note_id),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def rebuild(self, notes):
+        """从存储中的全部便笺重建索引"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM postings")
+            conn.execute("DELETE FROM docs")
+            for note_id, note in notes.items():
+                self._write_doc(conn, str(note_id), note.get("text", ""), note.get("name"))
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('built', ?)", (str(time.time()),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ------------------ 查询 ------------------
+    def _postings(self, conn, term, is_prefix):
+        """返回 {note_id: tf}；前缀词项合并所有以它开头的词项"""
+        if is_prefix:
+            rows = conn.execute(
+                "SELECT note_id, SUM(tf) FROM postings WHERE token >= ? AND token < ? GROUP BY note_id",
+                (term, term + "\U0010ffff"))
+        else:
+            rows = conn.execute("SELECT note_id, tf FROM postings WHERE token = ?", (term,))
+        return dict(rows.fetchall())
+
+    def search(self, query, limit=50):
+        """
+        返回按相关度排序的 [(note_id, name, score), ...]。
+        所有查询词项都必须命中（CJK 二元组全部命中近似于短语匹配）。
+        """
+        terms = _query_terms(query)
+        if not terms:
+            return []
+        conn = self._conn()
+        total, avg_len = conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+        if not total:
+            return []
+        avg_len = avg_len or 1
+
+        postings = [self._postings(conn, term, is_prefix) for term, is_prefix in terms]
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for p in postings[1:]:
+            candidates &= p.keys()
+            if not candidates:
+                return []
+
+        if len(candidates) <= 500:
+            placeholders = ",".join("?" * len(candidates))
+            rows = conn.execute(f"SELECT note_id, name, length FROM docs WHERE note_id IN ({placeholders})",
+                                tuple(candidates))
+        else:
+            # 候选过多时直接扫描 docs，避免超出 SQLite 的参数个数上限
+            rows = conn.execute("SELECT note_id, name, length FROM docs")
+        docs = {row[0]: row[1:] for row in rows if row[0] in candidates}
+
+        scores = {}
+        for p in postings:
+            idf = math.log(1 + (total - len(p) + 0.5) / (len(p) + 0.5))
+            for note_id in candidates:
+                tf = p[note_id]
+                length = docs.get(note_id, (None, avg_len))[1]
+                norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+                scores[note_id] = scores.get(note_id, 0.0) + idf * norm
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(note_id, docs.get(note_id, (None,))[0], score) for note_id, score in ranked]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_index = None
+
+
+def get_index():
+    """返回当前进程共享的索引；索引文件不存在或从未建立时从存储重建"""
+    global _index
+    if _index is None:
+        _index = SearchIndex()
+        if not _index.is_built():
+            from note_manager import NoteManager
+            _index.rebuild(NoteManager.load_notes_list())
+    return _index
+
+
+_inherited = []
+
+
+def _drop_inherited_index():
+    """fork 出的子进程不能使用父进程的 SQLite 连接：丢弃继承的索引（不关闭连接），用到时重新打开"""
+    global _index
+    if _index is not None:
+        _inherited.append(_index)
+        _index = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_drop_inherited_index)
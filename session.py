@@ -0,0 +1,92 @@
+import os
+import re
+import time
+from note_storage import atomic_write_json, read_json
+
+# 打开的便笺窗口（便笺 ID、位置大小、是否置顶），下次启动时恢复
+SESSION_FILE = "sticky_notes_session.json"
+# 恢复时每批同时启动的窗口数与批之间的间隔（毫秒），可在 .env 中调整
+SESSION_RESTORE_BATCH = int(os.getenv("SESSION_RESTORE_BATCH", str(max(2, os.cpu_count() or 1))))
+SESSION_RESTORE_STAGGER_MS = int(os.getenv("SESSION_RESTORE_STAGGER_MS", "100"))
+
+_GEOMETRY_RE = re.compile(r"(\d+)x(\d+)\+(-?\d+)\+(-?\d+)")
+
+
+def geometry_xy(geometry, default=(100, 100)):
+    """从 "宽x高+x+y" 中取出窗口位置"""
+    match = _GEOMETRY_RE.search(geometry or "")
+    if not match:
+        return default
+    return int(match.group(3)), int(match.group(4))
+
+
+class Session:
+    """
+    主进程维护的窗口会话：
+    - 便笺窗口在显示、移动/缩放、置顶切换时发来 ("window_state", 便笺ID, 几何, 是否置顶)，
+      用户关闭或删除便笺时发来 ("window_closed", 便笺ID)；
+    - 每次变化都立即写入 SESSION_FILE，主进程被结束（注销、关机、异常退出）时也不会丢失；
+      便笺进程异常退出不会从会话中移除，下次启动仍会恢复。
+    - 恢复时记录从开始到所有窗口都显示的耗时。
+    """
+    def __init__(self, path=SESSION_FILE):
+        self.path = path
+        self.windows = {}       # 便笺 ID -> {"geometry", "pinned"}
+        self._restore_started = None
+        self._restore_pending = set()
+        self._restore_count = 0
+        self.restore_ms = None
+
+    def load(self, known_ids=None):
+        """读取上次的会话，返回 [(便笺ID, {"geometry", "pinned"})]；不在 known_ids 中的便笺（已删除或从未保存）被忽略"""
+        data = read_json(self.path, default={}) or {}
+        entries = []
+        for item in data.get("windows", []):
+            note_id = str(item.get("note_id", ""))
+            if not note_id or (known_ids is not None and note_id not in known_ids):
+                continue
+            state = {"geometry": item.get("geometry", ""), "pinned": bool(item.get("pinned", False))}
+            self.windows[note_id] = state
+            entries.append((note_id, state))
+        return entries
+
+    def save(self):
+        try:
+            atomic_write_json(self.path, {
+                "windows": [dict(note_id=note_id, **state) for note_id, state in self.windows.items()],
+                "saved": time.time(),
+            }, indent=2)
+        except OSError as e:
+            print(f"保存窗口会话失败：{e}")
+
+    def handle(self, cmd):
+        """处理与会话有关的命令，返回是否已处理"""
+        if not isinstance(cmd, tuple) or not cmd:
+            return False
+        if cmd[0] == "window_state":
+            _, note_id, geometry, pinned = cmd
+            state = {"geometry": geometry, "pinned": bool(pinned)}
+            if self.windows.get(note_id) != state:
+                self.windows[note_id] = state
+                self.save()
+            return True
+        if cmd[0] == "window_closed":
+            if self.windows.pop(cmd[1], None) is not None:
+                self.save()
+            return True
+        return False
+
+    # ------------------ 恢复计时 ------------------
+    def begin_restore(self, note_ids):
+        self._restore_started = time.time()
+        self._restore_pending = set(note_ids)
+        self._restore_count = len(self._restore_pending)
+
+    def mark_visible(self, note_id):
+        """某个窗口已显示；恢复的窗口全部显示后打印总耗时"""
+        if not self._restore_pending or note_id not in self._restore_pending:
+            return
+        self._restore_pending.discard(note_id)
+        if not self._restore_pending:
+            self.restore_ms = (time.time() - self._restore_started) * 1000
+            print(f"已恢复上次打开的 {self._restore_count} 个便笺，全部显示用时 {self.restore_ms:.0f} ms")
@@ -0,0 +1,162 @@
+import getpass
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import weakref
+from multiprocessing.connection import Client, Listener
+from note_storage import FileLock
+
+# 等待对方回复 / 发来命令的最长时间（秒）
+REPLY_TIMEOUT = float(os.getenv("INSTANCE_REPLY_TIMEOUT", "3"))
+
+_listeners = weakref.WeakSet()
+
+
+def _close_inherited_listeners():
+    """
+    fork 出的便笺进程会继承主进程的监听套接字，主进程退出后端点仍被它们占着。
+    子进程中只关闭描述符，不删除套接字文件（文件属于主进程）。
+    """
+    for listener in list(_listeners):
+        sock = getattr(getattr(listener, "_listener", None), "_socket", None)
+        if sock is not None:
+            sock.close()
+    _listeners.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_close_inherited_listeners)
+
+
+def _instance_name():
+    """同一用户、同一数据目录（便笺文件保存在当前目录）只允许一个主进程"""
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = str(os.getpid())
+    digest = hashlib.sha1(os.path.abspath(os.getcwd()).encode("utf-8")).hexdigest()[:12]
+    return f"ai-note-{user}-{digest}"
+
+
+def endpoint():
+    """返回 (地址, 地址族)：Windows 使用命名管道，其他平台使用 Unix 域套接字"""
+    name = _instance_name()
+    if os.name == "nt":
+        return rf"\\.\pipe\{name}", "AF_PIPE"
+    return os.path.join(tempfile.gettempdir(), f"{name}.sock"), "AF_UNIX"
+
+
+def _encode(command):
+    # 只传 JSON，不接受 pickle，避免连上套接字的进程借反序列化执行代码
+    return json.dumps(command, ensure_ascii=False).encode("utf-8")
+
+
+def _decode(data):
+    command = json.loads(data.decode("utf-8"))
+    return tuple(command) if isinstance(command, list) else command
+
+
+def send_command(command, address=None, family=None, timeout=REPLY_TIMEOUT):
+    """
+    把命令交给正在运行的主进程，成功返回 True；没有主进程（或只剩失效的套接字）返回 False。
+    连上了但 timeout 秒内没有回复时抛出 TimeoutError、连接被中途关闭时抛出 ConnectionError：
+    主进程仍然存在（命令可能已经被处理），不能当作失效端点清理后另起一个主进程。
+    """
+    if address is None:
+        address, family = endpoint()
+    try:
+        conn = Client(address, family=family)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+    except OSError:
+        if os.name == "nt":
+            # Windows 上命名管道不存在时为 OSError；管道名被占用时绑定会失败，不会出现两个主进程
+            return False
+        raise
+    with conn:
+        try:
+            conn.send_bytes(_encode(command))
+            if not conn.poll(timeout):
+                raise TimeoutError(f"主进程 {timeout:g} 秒内没有响应")
+            reply = conn.recv_bytes()
+        except (EOFError, BrokenPipeError, ConnectionResetError) as e:
+            raise ConnectionError(f"主进程关闭了连接：{e}") from e
+    if reply != b"ok":
+        raise ConnectionError(f"主进程返回了无法识别的回复：{reply[:32]!r}")
+    return True
+
+
+class InstanceServer:
+    """
+    主进程的本地 IPC 端点：后台线程接受连接，把收到的命令放入 command_queue，
+    主进程的事件循环像处理便笺发来的命令一样处理它们。
+    每个连接在单独的线程中处理，且最多等待 REPLY_TIMEOUT 秒：连上后不发命令的客户端不会卡住端点。
+    """
+    def __init__(self, listener, command_queue):
+        self.listener = listener
+        self.command_queue = command_queue
+        self.commands = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve, name="instance-server", daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._closed:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                # close() 之后 accept 会失败
+                return
+            threading.Thread(target=self._handle, args=(conn,), name="instance-client",
+                             daemon=True).start()
+
+    def _handle(self, conn):
+        try:
+            with conn:
+                if not conn.poll(REPLY_TIMEOUT):
+                    print("实例客户端没有发送命令，已断开")
+                    return
+                command = _decode(conn.recv_bytes(64 * 1024))
+                self.command_queue.put(command)
+                self.commands += 1
+                conn.send_bytes(b"ok")
+        except Exception as e:
+            print(f"忽略无效的实例命令：{e}")
+
+    def close(self):
+        """关闭端点（Unix 域套接字文件随之删除）"""
+        self._closed = True
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+
+
+def claim_or_forward(command):
+    """
+    尝试成为唯一的主进程：
+    - 已有主进程在运行：把 command 转发给它，返回 None（调用方直接退出）；
+    - 主进程存在但没有回复：抛出 TimeoutError / ConnectionError，不清理它的套接字；
+    - 否则（连接被拒绝或套接字不存在）清理失效的套接字（上次异常退出留下的），
+      绑定端点并返回 Listener，交给 InstanceServer 接收之后的命令。
+    检查与绑定在文件锁内完成，同时启动的两个实例不会都成为主进程。
+    """
+    address, family = endpoint()
+    with FileLock(os.path.join(tempfile.gettempdir(), f"{_instance_name()}.lock")):
+        if send_command(command, address, family):
+            return None
+        if family == "AF_UNIX" and os.path.exists(address):
+            # 套接字文件存在但无人监听：上一个主进程没有正常退出
+            print("清理失效的实例套接字")
+            os.remove(address)
+        # 套接字只允许当前用户访问
+        old_umask = os.umask(0o177) if os.name != "nt" else None
+        try:
+            listener = Listener(address, family=family)
+        finally:
+            if old_umask is not None:
+                os.umask(old_umask)
+        _listeners.add(listener)
+        return listener
@@ -0,0 +1,94 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+# python -X importtime 的输出行：import time: self [us] | cumulative | imported package
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr_text):
+    """解析 -X importtime 的输出，返回 [{"module", "self_ms", "cumulative_ms", "depth"}]"""
+    modules = []
+    for line in stderr_text.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        modules.append({
+            "module": match.group(4),
+            "self_ms": int(match.group(1)) / 1000,
+            "cumulative_ms": int(match.group(2)) / 1000,
+            # 输出中每多一层嵌套导入缩进两个空格
+            "depth": (len(match.group(3)) - 1) // 2,
+        })
+    return modules
+
+
+def _child(started_at, note_id=None):
+    """
+    在子进程中测量（由 run_profile 以 -X importtime 启动）：
+    导入 Note 的耗时，以及从进程启动到便笺窗口第一次显示并完成绘制的耗时。结果以一行 JSON 输出。
+    """
+    import_start = time.time()
+    import Note
+    import window_stats
+    import_ms = (time.time() - import_start) * 1000
+
+    note = Note.StickyNote(note_id=note_id, x=100, y=100)
+    result = {"import_ms": import_ms}
+
+    def painted():
+        note.root.update_idletasks()
+        result["first_paint_ms"] = (time.time() - started_at) * 1000
+        result["rss_kb"] = window_stats.current_rss_kb()
+        # 只测量，不留下窗口；空便笺不会被保存
+        note.root.after(0, note.root.destroy)
+
+    window_stats.on_first_map(note.root, painted)
+    note.root.mainloop()
+    print(json.dumps(result))
+
+
+def run_profile(note_id=None, top=25, output=None):
+    """启动一个新的便笺进程，打印导入耗时最多的模块、导入 Note 总耗时和首次绘制时间"""
+    started_at = time.time()
+    args = [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child", repr(started_at)]
+    if note_id:
+        args.append(str(note_id))
+    proc = subprocess.run(args, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    modules = parse_importtime(proc.stderr)
+    result = None
+    for line in reversed(proc.stdout.splitlines()):
+        try:
+            result = json.loads(line)
+            break
+        except ValueError:
+            continue
+    if proc.returncode != 0 or result is None:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        print("启动测量失败：\n" + "\n".join(errors[-20:]))
+        return None
+
+    # 只列出由本程序直接触发的顶层导入（嵌套导入计入其累计时间），按累计耗时排序
+    top_level = sorted((m for m in modules if m["depth"] == 0),
+                       key=lambda m: m["cumulative_ms"], reverse=True)
+    print(f"{'模块':<32}{'自身(ms)':>10}{'累计(ms)':>10}")
+    for m in top_level[:top]:
+        print(f"{m['module']:<32}{m['self_ms']:>10.1f}{m['cumulative_ms']:>10.1f}")
+    print(f"导入 Note 共 {result['import_ms']:.0f} ms，"
+          f"从启动进程到便笺窗口首次绘制 {result['first_paint_ms']:.0f} ms")
+    report = dict(result, modules=modules)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "--child":
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        _child(float(sys.argv[2]), sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        run_profile()
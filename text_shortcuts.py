@@ -1,5 +1,7 @@
 import tkinter as tk
-from PIL import Image, ImageGrab
+
+# 超过这个长度的文本粘贴时分块插入
+PASTE_CHUNK_CHARS = 16384
 
 class TextShortcuts:
     def __init__(self, text_widget, image_handler=None):
@@ -9,6 +11,7 @@ class TextShortcuts:
         """
         self.text_widget = text_widget
         self.image_handler = image_handler
+        self._paste_count = 0
         self.bind_shortcuts()
 
     def bind_shortcuts(self):
@@ -51,18 +54,55 @@ class TextShortcuts:
 
     def paste(self, event=None):
         """
-        优先尝试获取文本并插入；
-        若剪贴板中没有文本，则尝试调用 image_handler 插入图片。
+        优先尝试获取文本并插入（Tk 读取文本剪贴板很快，没有文本时立即抛出 TclError）；
+        若剪贴板中没有文本，则交给 image_handler 在后台线程中读取并插入图片。
+        很长的文本分块插入，每块之间让出事件循环，窗口不会卡住。
         """
         try:
             clipboard_content = self.text_widget.clipboard_get()
-            self.text_widget.insert(tk.INSERT, clipboard_content)
         except tk.TclError:
             # 没有文本，尝试粘贴图片
             if self.image_handler is not None:
                 self.image_handler.handle_image_paste()
+            return "break"
+        if len(clipboard_content) <= PASTE_CHUNK_CHARS:
+            self.text_widget.insert(tk.INSERT, clipboard_content)
+        else:
+            self._insert_chunked(clipboard_content)
         return "break"
 
+    def _insert_chunked(self, content):
+        """
+        在当前光标处分块插入长文本。插入位置用一个右重力的 mark 跟踪，
+        期间光标移动也不会打乱顺序；整个粘贴在撤销栈中是一步。
+        """
+        widget = self.text_widget
+        self._paste_count += 1
+        mark = f"chunked_paste_{self._paste_count}"
+        widget.mark_set(mark, tk.INSERT)
+        widget.mark_gravity(mark, tk.RIGHT)
+        widget.edit_separator()
+        autoseparators = widget.cget("autoseparators")
+        widget.config(autoseparators=False)
+        chunks = (content[i:i + PASTE_CHUNK_CHARS] for i in range(0, len(content), PASTE_CHUNK_CHARS))
+
+        def step():
+            try:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    widget.mark_unset(mark)
+                    widget.config(autoseparators=autoseparators)
+                    widget.edit_separator()
+                    widget.see(tk.INSERT)
+                    return
+                widget.insert(mark, chunk)
+                widget.after(1, step)
+            except tk.TclError:
+                # 粘贴过程中窗口已关闭
+                pass
+
+        step()
+
     def select_all(self, event=None):
         self.text_widget.tag_add(tk.SEL, "1.0", tk.END)
         self.text_widget.mark_set(tk.INSERT, "1.0")
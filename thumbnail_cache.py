@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+from note_storage import FileLock
+import image_store
+
+# 缩略图缓存目录（不放在 sticky_notes_images 下，图片清理不会扫描到它）
+THUMB_DIR = "sticky_notes_thumbs"
+# 缓存总大小上限（字节），超出后按最近最少使用淘汰到上限的 80%
+THUMB_CACHE_MAX_BYTES = int(os.getenv("THUMB_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+THUMB_SIZE = (200, 200)
+
+_lock = threading.Lock()
+_lock_file = os.path.join(THUMB_DIR, ".lock")
+_total_bytes = None
+
+
+def _source_id(path):
+    """内容寻址存储中的图片直接用文件名里的哈希，其他图片用绝对路径的哈希"""
+    if image_store.is_stored(path):
+        return os.path.splitext(os.path.basename(path))[0]
+    return hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()
+
+
+def _thumb_path(path, size):
+    """缓存键 = 图片哈希 + 源文件修改时间与大小 + 目标尺寸；源文件变化后旧缩略图自然失效并被淘汰"""
+    st = os.stat(path)
+    key = f"{_source_id(path)}|{st.st_mtime_ns}|{st.st_size}|{size[0]}x{size[1]}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(THUMB_DIR, digest[:2], digest + ".png")
+
+
+def _scan():
+    """返回 [(修改时间, 大小, 路径), ...]；命中时会刷新修改时间，所以它就是最近使用时间"""
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(THUMB_DIR):
+        for f in filenames:
+            if f.startswith(".") or not f.endswith(".png"):
+                continue
+            full_path = os.path.join(dirpath, f)
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, full_path))
+    return entries
+
+
+def _evict_if_needed(added):
+    global _total_bytes
+    with _lock:
+        if _total_bytes is None:
+            # 首次统计时扫描到的大小已包含刚写入的文件
+            _total_bytes = sum(size for _mtime, size, _path in _scan())
+        else:
+            _total_bytes += added
+        if _total_bytes <= THUMB_CACHE_MAX_BYTES:
+            return
+    with FileLock(_lock_file):
+        entries = sorted(_scan())
+        total = sum(size for _mtime, size, _path in entries)
+        target = THUMB_CACHE_MAX_BYTES * 0.8
+        for _mtime, size, full_path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(full_path)
+                total -= size
+            except OSError:
+                pass
+    with _lock:
+        _total_bytes = total
+
+
+def thumbnail_size(path, size=THUMB_SIZE):
+    """
+    只读取图片头部，计算缩略图的尺寸（与 Image.thumbnail 一样保持比例、不放大），
+    用于在解码完成前插入同样大小的占位图。
+    """
+    from PIL import Image
+    with Image.open(path) as image:
+        return fit_size(image.size, size)
+
+
+def fit_size(image_size, size=THUMB_SIZE):
+    """按比例缩小到 size 以内（不放大）后的尺寸"""
+    width, height = image_size
+    scale = min(1.0, size[0] / width, size[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def get_thumbnail(path, size=THUMB_SIZE):
+    """
+    返回 path 的缩略图（PIL Image，已完整读入内存）。
+    命中缓存时只解码一张小 PNG；未命中或源文件已变化时才解码原图，并把结果写回缓存。
+    """
+    from PIL import Image
+    try:
+        thumb_path = _thumb_path(path, size)
+    except OSError:
+        thumb_path = None
+    if thumb_path is not None and os.path.exists(thumb_path):
+        try:
+            image = Image.open(thumb_path)
+            image.load()
+            os.utime(thumb_path)
+            return image
+        except Exception:
+            # 缓存文件损坏，重新生成
+            pass
+
+    image = Image.open(path)
+    # JPEG 可以在解码时直接按比例缩小，省掉大部分像素的解码
+    image.draft("RGB", size)
+    image.thumbnail(size)
+    if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+        image = image.convert("RGBA")
+    if thumb_path is not None:
+        try:
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            tmp_path = f"{thumb_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            image.save(tmp_path, format="PNG")
+            os.replace(tmp_path, thumb_path)
+            _evict_if_needed(os.path.getsize(thumb_path))
+        except Exception as e:
+            print(f"写入缩略图缓存失败：{e}")
+    return image
+
+
+def clear():
+    """清空缩略图缓存"""
+    global _total_bytes
+    with FileLock(_lock_file):
+        for _mtime, _size, full_path in _scan():
+            try:
+                os.remove(full_path)
+            except OSError:
+                pass
+    with _lock:
+        _total_bytes = 0
@@ -37,9 +37,15 @@ class WindowControls:
         y = self.app.color_btn.winfo_rooty() + self.app.color_btn.winfo_height()
         menu.tk_popup(x, y)
 
+    def _mark_dirty(self):
+        # 颜色和置顶状态不会触发文本的 <<Modified>>，需要手动通知自动保存
+        if hasattr(self.app, "autosaver"):
+            self.app.autosaver.mark_dirty()
+
     def change_toolbar_color(self):
         color = colorchooser.askcolor()[1]
         if color:
+            self._mark_dirty()
             self.app.header_bg = color
             self.app.header.config(bg=color)
             if hasattr(self.app, "toolbar"):
@@ -65,6 +71,7 @@ class WindowControls:
     def change_background_color(self):
         color = colorchooser.askcolor()[1]
         if color:
+            self._mark_dirty()
             self.app.text_bg = color
             self.app.content_frame.config(bg=color)
             self.app.text_widget.config(bg=color, insertbackground=self.app.text_fg)
@@ -79,6 +86,7 @@ class WindowControls:
     def change_font_color(self):
         color = colorchooser.askcolor()[1]
         if color:
+            self._mark_dirty()
             self.app.text_fg = color
             self.app.text_widget.config(fg=color, insertbackground=color)
             if hasattr(self.app, "ai_chat_display"):
@@ -88,6 +96,7 @@ class WindowControls:
         default_header_bg = "#3F51B5"
         default_text_bg = "#2B2B2B"
         default_text_fg = "#ECECEC"
+        self._mark_dirty()
         self.app.header_bg = default_header_bg
         self.app.text_bg = default_text_bg
         self.app.text_fg = default_text_fg
@@ -123,6 +132,9 @@ class WindowControls:
     def toggle_pin(self):
         """置顶或取消置顶窗口，并调整按钮颜色"""
         self.app.is_pinned = not self.app.is_pinned
+        self._mark_dirty()
         self.app.root.attributes("-topmost", self.app.is_pinned)
         if hasattr(self.app, "_refresh_header_buttons"):
             self.app._refresh_header_buttons()
+        if hasattr(self.app, "report_window_state"):
+            self.app.report_window_state()
@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import time
+
+# 设置后，退出时把窗口统计（打开延迟、每个窗口的内存）写入该 JSON 文件
+WINDOW_STATS_FILE = os.getenv("WINDOW_STATS_FILE", "")
+
+
+def current_rss_kb():
+    """当前进程的常驻内存（KB）；无法获取时返回 None"""
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/self/statm", "r") as f:
+                resident_pages = int(f.read().split()[1])
+            return resident_pages * os.sysconf("SC_PAGE_SIZE") // 1024
+        if os.name == "nt":
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize // 1024
+            return None
+        import resource
+        # macOS 上 ru_maxrss 以字节为单位（峰值，近似当前值）
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    except Exception:
+        return None
+
+
+def on_first_map(window, callback):
+    """窗口第一次显示（<Map>）时调用一次 callback()"""
+    state = {"done": False}
+
+    def handler(event):
+        if event.widget is window and not state["done"]:
+            state["done"] = True
+            callback()
+
+    window.bind("<Map>", handler, add="+")
+
+
+def _summary(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return {
+        "min": round(values[0], 1),
+        "p50": round(values[len(values) // 2], 1),
+        "max": round(values[-1], 1),
+        "mean": round(sum(values) / len(values), 1),
+    }
+
+
+class WindowStats:
+    """
+    汇总便笺窗口的打开延迟（从发出打开请求到窗口第一次显示）和每个窗口占用的内存：
+    - process 模式：每个窗口一个进程，内存为该子进程的常驻内存；
+    - toplevel 模式：所有窗口共用一个进程，内存为创建窗口前后进程常驻内存的增量。
+    """
+    def __init__(self, mode):
+        self.mode = mode
+        self.windows = []
+
+    def record(self, latency_ms, memory_kb, note_id=None):
+        self.windows.append({"note_id": note_id, "latency_ms": latency_ms, "memory_kb": memory_kb})
+        memory = f"{memory_kb / 1024:.1f} MB" if memory_kb is not None else "未知"
+        print(f"[{self.mode}] 便笺 {note_id} 已打开：{latency_ms:.0f} ms，内存 {memory}")
+
+    def summary(self):
+        return {
+            "mode": self.mode,
+            "windows": len(self.windows),
+            "open_latency_ms": _summary(w["latency_ms"] for w in self.windows),
+            "memory_per_window_kb": _summary(w["memory_kb"] for w in self.windows),
+        }
+
+    def report(self):
+        summary = self.summary()
+        if not summary["windows"]:
+            return summary
+        latency = summary["open_latency_ms"]
+        memory = summary["memory_per_window_kb"]
+        line = f"[{self.mode}] 共打开 {summary['windows']} 个窗口，打开延迟中位数 {latency['p50']:.0f} ms"
+        if memory:
+            line += f"，每个窗口内存中位数 {memory['p50'] / 1024:.1f} MB"
+        print(line)
+        if WINDOW_STATS_FILE:
+            with open(WINDOW_STATS_FILE, "w", encoding="utf-8") as f:
+                json.dump({"summary": summary, "windows": self.windows,
+                           "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}, f, ensure_ascii=False, indent=2)
+        return summary